@@ -0,0 +1,414 @@
+"""
+Benchmarks for the data pipeline (spectogram generation, MusicDataset and MusicDataModule).
+
+Everything runs on synthetic audio and spectograms, so the DEAM download isn't needed. Each benchmark runs in its
+own process so the peak memory (RSS) measured belongs to that benchmark only. Results are written to a json file
+so runs can be compared.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+import pathlib
+import numpy as np
+
+# Make it to where paths only need to be from the repo folder (the root is found once, in paths.py).
+if not __package__: sys.path.append(str(pathlib.Path(__file__).resolve().parents[2]))
+from src.dataset.paths import root
+
+# Moods used for the synthetic labels.
+moods = ["calm", "happy", "sad", "tense"]
+
+# Modules whose import time is measured.
+import_modules = ["src.dataset.paths", "src.dataset.data_utils", "src.dataset.spectograms", "src.dataset.features",
+                  "src.dataset.quantized", "src.dataset.music_dataset", "src.dataset.music_datamodule", "src.dataset.cli"]
+
+# Heavy dependencies that should only be imported by the functions that use them (reported if a module imports them).
+lazy_modules = ["cv2", "librosa", "matplotlib", "torchvision", "sklearn"]
+
+
+def make_synthetic_audio(audio_dir: str, n_songs: int, seconds: float = 45.0, sr: int = 44100, seed: int = 0) -> list:
+    """
+    Write wav files of chirps and noise that stand in for the DEAM audio.
+
+    Arguments:
+        audio_dir (str): directory to write the audio files to.
+        n_songs (int): number of audio files.
+        seconds (float): length of each audio file.
+        sr (int): sample rate.
+        seed (int): seed for the noise.
+
+    Return value: list of the song ids written (the files are named <song_id>.wav).
+    """
+    import soundfile
+
+    os.makedirs(audio_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sr)) / sr
+    for song_id in range(1, n_songs + 1):
+        start, end = rng.uniform(100, 4000, 2)
+        chirp = np.sin(2 * np.pi * (start * t + (end - start) * t ** 2 / (2 * seconds)))
+        audio = (0.3 * chirp + 0.05 * rng.standard_normal(len(t))).astype(np.float32)
+        soundfile.write(os.path.join(audio_dir, f"{song_id}.wav"), audio, sr)
+    return list(range(1, n_songs + 1))
+
+
+def make_synthetic_spectograms(image_dir: str, n_songs: int, seed: int = 0) -> list:
+    """
+    Write spectogram pngs the same size and colors as the real ones, without needing audio.
+
+    Arguments:
+        image_dir (str): directory to write the images to.
+        n_songs (int): number of images.
+        seed (int): seed for the random spectograms.
+
+    Return value: list of the song ids written (the images are named <song_id>.png).
+    """
+    import cv2
+    from src.dataset.spectograms import render_spectogram
+
+    os.makedirs(image_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    for song_id in range(1, n_songs + 1):
+        # Smooth random decibels with more energy at low frequencies.
+        Xdb = cv2.resize(rng.normal(0, 10, (64, 96)).astype(np.float32), (1938, 1025)) - np.linspace(0, 60, 1025)[:, None]
+        cv2.imwrite(os.path.join(image_dir, f"{song_id}.png"), render_spectogram(Xdb))
+    return list(range(1, n_songs + 1))
+
+
+def make_synthetic_csv(csv_path: str, song_ids: list, seed: int = 0) -> None:
+    """
+    Write a csv file with headers [song_id, mood, valence, arousal] for the synthetic songs.
+
+    Arguments:
+        csv_path (str): path to the csv file.
+        song_ids (list): song ids to include.
+        seed (int): seed for the labels.
+
+    Return value: None
+    """
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    valence = np.round(rng.uniform(1, 9, len(song_ids)), 1)
+    arousal = np.round(rng.uniform(1, 9, len(song_ids)), 1)
+    mood = np.array(["sad", "tense", "calm", "happy"])[2 * (valence >= 5) + (arousal >= 5)]
+    pd.DataFrame({"song_id": song_ids, "mood": mood, "valence": valence, "arousal": arousal}).to_csv(csv_path, index=False)
+
+
+def _peak_rss_mb() -> float:
+    """
+    Returns the peak memory (RSS) of this process and its finished child processes in MB.
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in KB on Linux and bytes on macOS.
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return max(own, children) / scale
+
+
+def _child(queue, function, args) -> None:
+    """
+    Runs a benchmark in a child process and sends back its results with the peak memory.
+    """
+    results = function(*args)
+    results["peak_rss_mb"] = round(_peak_rss_mb(), 1)
+    queue.put(results)
+
+
+def run_isolated(function, *args) -> dict:
+    """
+    Run a benchmark function in a fresh process so its peak memory isn't mixed up with other benchmarks.
+
+    Arguments:
+        function: benchmark function returning a dict of results.
+        args: arguments for the function.
+
+    Return value: dict of the results (with "peak_rss_mb" added).
+    """
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_child, args=(queue, function, args))
+    process.start()
+    results = queue.get()
+    process.join()
+    return results
+
+
+def bench_generate_spectogram(audio_dir: str, n_files: int) -> dict:
+    """
+    Measure generate_spectogram on its own.
+
+    Arguments:
+        audio_dir (str): directory of audio files.
+        n_files (int): number of files to use.
+
+    Return value: dict of the results.
+    """
+    from src.dataset.spectograms import generate_spectogram
+
+    files = sorted(os.listdir(audio_dir))[:n_files]
+    start = time.perf_counter()
+    for file in files: generate_spectogram(os.path.join(audio_dir, file))
+    elapsed = time.perf_counter() - start
+    return {"files": len(files), "seconds": round(elapsed, 3), "files_per_sec": round(len(files) / elapsed, 3)}
+
+
+def bench_generate_multiple_spectogram(audio_dir: str, output_dir: str, num_workers: int, renderer: str) -> dict:
+    """
+    Measure generate_multiple_spectogram on a whole directory (starting from an empty output directory).
+
+    Arguments:
+        audio_dir (str): directory of audio files.
+        output_dir (str): directory to write the spectograms to.
+        num_workers (int): number of processes.
+        renderer (str): "matplotlib" or "numpy".
+
+    Return value: dict of the results.
+    """
+    import shutil
+    import contextlib
+    from src.dataset.spectograms import generate_multiple_spectogram
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    n_files = len(os.listdir(audio_dir))
+    start = time.perf_counter()
+    # Keep the per-file messages out of the benchmark output.
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        generate_multiple_spectogram(audio_dir, output_dir, num_workers=num_workers, renderer=renderer)
+    elapsed = time.perf_counter() - start
+    return {"num_workers": num_workers, "renderer": renderer, "files": n_files,
+            "seconds": round(elapsed, 3), "files_per_sec": round(n_files / elapsed, 3)}
+
+
+def bench_augment(batch_size: int, shape: list = [3, 120, 120], repeats: int = 20) -> dict:
+    """
+    Samples per second of BatchAugment on a batch, and of the same augmentation applied to one sample at a time.
+    """
+    import torch
+    from src.dataset.augment import BatchAugment
+
+    augment = BatchAugment(time_masks=2, time_mask_width=20, freq_masks=2, freq_mask_width=15, max_shift=10)
+    batch = torch.rand([batch_size] + list(shape))
+    start = time.perf_counter()
+    for _ in range(repeats): augment(batch)
+    batched = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for i in range(batch_size): augment(batch[i:i + 1])
+    per_sample = time.perf_counter() - start
+    return {"batch_size": batch_size, "shape": list(shape),
+            "batched_samples_per_sec": round(repeats * batch_size / batched, 1),
+            "per_sample_samples_per_sec": round(repeats * batch_size / per_sample, 1)}
+
+
+def bench_dataset(csv_path: str, data_dir: str, data_format: str, passes: int) -> dict:
+    """
+    Measure MusicDataset.__getitem__ (with the Resize(120, 120) and ToTensor transforms used for training) and the
+    bytes stored per sample.
+
+    Arguments:
+        csv_path (str): csv file of the songs.
+        data_dir (str): directory (or store path) of the spectograms.
+        data_format (str): data format of MusicDataset.
+        passes (int): number of times to go through the dataset.
+
+    Return value: dict of the results.
+    """
+    import torchvision.transforms as transforms
+    from src.dataset.music_dataset import MusicDataset, Resize
+
+    dataset = MusicDataset(csv_path, data_dir, transforms.Compose([Resize(120, 120), transforms.ToTensor()]), data_format=data_format)
+    start = time.perf_counter()
+    for _ in range(passes):
+        for idx in range(len(dataset)): dataset[idx]
+    elapsed = time.perf_counter() - start
+    samples = passes * len(dataset)
+
+    # Size of the stored data (one file for a packed store, one file per song otherwise).
+    if data_format == "packed": stored = os.path.getsize(os.path.join(root, data_dir) + ".bin")
+    else: stored = sum(os.path.getsize(path) for path in dataset.img_paths)
+    return {"data_format": data_format, "data_dir": os.path.basename(data_dir), "samples": samples,
+            "seconds": round(elapsed, 3), "samples_per_sec": round(samples / elapsed, 3),
+            "bytes_per_sample": round(stored / max(len(dataset), 1))}
+
+
+def bench_datamodule(csv_path: str, data_dir: str, num_workers: int, batch_size: int, epochs: int) -> dict:
+    """
+    Measure batches per second through the training dataloader of MusicDataModule.
+    The first batch (which includes starting the workers) is timed separately, and batches_per_sec is None unless
+    there were at least two batches.
+
+    Arguments:
+        csv_path (str): csv file of the songs (used for training, validation and testing).
+        data_dir (str): directory of the spectograms.
+        num_workers (int): number of DataLoader workers.
+        batch_size (int): batch size.
+        epochs (int): number of epochs.
+
+    Return value: dict of the results.
+    """
+    import torchvision.transforms as transforms
+    from src.dataset.music_dataset import Resize
+    from src.dataset.music_datamodule import MusicDataModule
+
+    music_dm = MusicDataModule(csv_path, data_dir, csv_path, data_dir, csv_path, data_dir,
+                               transforms=transforms.Compose([Resize(120, 120), transforms.ToTensor()]),
+                               batch_size=batch_size, num_workers=num_workers)
+    music_dm.setup(stage="train")
+    loader = music_dm.train_dataloader()
+
+    start = time.perf_counter()
+    first_batch = None
+    batches = 0
+    for _ in range(epochs):
+        for _ in loader:
+            if first_batch is None: first_batch = time.perf_counter() - start
+            batches += 1
+    elapsed = time.perf_counter() - start
+    # The steady rate leaves out the first batch, so it needs at least two (null in the json file otherwise).
+    batches_per_sec = round((batches - 1) / max(elapsed - first_batch, 1e-9), 3) if batches > 1 else None
+    return {"num_workers": num_workers, "batch_size": batch_size, "batches": batches,
+            "first_batch_seconds": None if first_batch is None else round(first_batch, 3), "seconds": round(elapsed, 3),
+            "batches_per_sec": batches_per_sec}
+
+
+def bench_import_time(modules: list = import_modules, repeats: int = 3) -> dict:
+    """
+    Seconds to import each module in a fresh interpreter (the best of repeats, so nothing is imported already), and
+    the wall time of the command-line entry point printing its help. Each module's time is printed along with the
+    heavy dependencies (lazy_modules) importing it pulled in, so an import that made startup slower shows up.
+
+    Arguments:
+        modules (list): names of the modules to import.
+        repeats (int): number of fresh interpreters per module.
+
+    Return value: dict of the seconds of each module and of "cli --help", and "heavy_imports" (the lazy_modules
+                  each module imported).
+    """
+    results, heavy = {}, {}
+    for module in modules:
+        code = (f"import sys, json, time; start = time.perf_counter(); import {module}; seconds = time.perf_counter() - start; "
+                f"print(json.dumps([seconds, [name for name in {lazy_modules!r} if name in sys.modules]]))")
+        runs = [json.loads(subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True).stdout)
+                for _ in range(repeats)]
+        results[module] = round(min(run[0] for run in runs), 3)
+        heavy[module] = runs[0][1]
+        print(f"    {module}: {results[module]:.3f}s" + (f" (imports {', '.join(heavy[module])})" if heavy[module] else ""))
+
+    runs = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-m", "src.dataset.cli", "--help"], cwd=root, capture_output=True, check=True)
+        runs.append(time.perf_counter() - start)
+    results["cli --help"] = round(min(runs), 3)
+    print(f"    cli --help: {results['cli --help']:.3f}s")
+    results["heavy_imports"] = heavy
+    return results
+
+
+def _git_commit() -> str:
+    """
+    Returns the current git commit (or an empty string if it can't be found).
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=root, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def run_benchmarks(output_path: str, n_songs: int = 16, seconds: float = 45.0, workers: list = [1, 2, 4],
+                   batch_sizes: list = [4, 16], epochs: int = 2, work_dir: str = None) -> dict:
+    """
+    Run every benchmark on synthetic data and write the results to a json file.
+
+    Arguments:
+        output_path (str): path of the json file.
+        n_songs (int): number of synthetic songs.
+        seconds (float): length of each synthetic song.
+        workers (list): numbers of workers to try (for generate_multiple_spectogram and the DataModule).
+        batch_sizes (list): batch sizes to try for the DataModule.
+        epochs (int): epochs through the DataModule loaders.
+        work_dir (str): directory for the synthetic data (a temporary directory if None).
+
+    Return value: dict of all the results.
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = os.path.join(root, work_dir) if work_dir is not None else temp_dir
+        audio_dir = os.path.join(work_dir, "audio")
+        image_dir = os.path.join(work_dir, "spectograms")
+        csv_path = os.path.join(work_dir, "mood.csv")
+
+        print(f"Creating {n_songs} synthetic songs in [{work_dir}]")
+        make_synthetic_audio(audio_dir, n_songs, seconds)
+        song_ids = make_synthetic_spectograms(image_dir, n_songs)
+        make_synthetic_csv(csv_path, song_ids)
+
+        results = {"meta": {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": _git_commit(),
+                            "python": platform.python_version(), "platform": platform.platform(),
+                            "cpu_count": os.cpu_count(), "n_songs": n_songs, "seconds_per_song": seconds}}
+
+        print("Benchmarking import times")
+        results["import_time"] = bench_import_time()
+
+        print("Benchmarking generate_spectogram")
+        results["generate_spectogram"] = run_isolated(bench_generate_spectogram, audio_dir, min(n_songs, 4))
+
+        print("Benchmarking generate_multiple_spectogram")
+        results["generate_multiple_spectogram"] = [
+            run_isolated(bench_generate_multiple_spectogram, audio_dir, os.path.join(work_dir, "generated"), num_workers, renderer)
+            for renderer in ("matplotlib", "numpy") for num_workers in workers]
+
+        print("Quantizing the spectograms")
+        from src.dataset.quantized import quantize_multiple_spectogram
+        from src.dataset.spectograms import image_size
+        quantized = {"quantized_uint8": {"bits": 8}, "quantized_uint16": {"bits": 16},
+                     "quantized_uint8_compressed": {"bits": 8, "compress": True},
+                     "quantized_uint8_png_size": {"bits": 8, "size": image_size}}
+        results["quantization"] = {}
+        for name, params in quantized.items():
+            params = {"size": image_size, **params}
+            results["quantization"][name] = quantize_multiple_spectogram(audio_dir, os.path.join(work_dir, name), **params)
+
+        print("Benchmarking MusicDataset.__getitem__")
+        results["music_dataset"] = [run_isolated(bench_dataset, csv_path, image_dir, "png", 3)]
+        results["music_dataset"] += [run_isolated(bench_dataset, csv_path, os.path.join(work_dir, name), "quantized", 3) for name in quantized]
+        # Load speed of each format compared to the pngs.
+        for result in results["music_dataset"][1:]:
+            result["speedup_vs_png"] = round(result["samples_per_sec"] / results["music_dataset"][0]["samples_per_sec"], 3)
+
+        print("Benchmarking BatchAugment")
+        results["batch_augment"] = [run_isolated(bench_augment, batch_size) for batch_size in batch_sizes]
+
+        print("Benchmarking MusicDataModule")
+        results["music_datamodule"] = [run_isolated(bench_datamodule, csv_path, image_dir, num_workers, batch_size, epochs)
+                                       for num_workers in workers for batch_size in batch_sizes]
+
+    output_path = os.path.join(root, output_path)
+    with open(output_path, 'w') as file: json.dump(results, file, indent=2)
+    print(f"Wrote results to [{output_path}]")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the data pipeline on synthetic data.")
+    parser.add_argument("--output", default="benchmark_results.json", help="json file to write the results to")
+    parser.add_argument("--songs", type=int, default=16, help="number of synthetic songs")
+    parser.add_argument("--seconds", type=float, default=45.0, help="length of each synthetic song")
+    parser.add_argument("--workers", default="1,2,4", help="comma separated numbers of workers to try")
+    parser.add_argument("--batch-sizes", default="4,16", help="comma separated batch sizes to try")
+    parser.add_argument("--epochs", type=int, default=2, help="epochs through the DataModule loaders")
+    parser.add_argument("--work-dir", default=None, help="directory for the synthetic data (temporary if not given)")
+    args = parser.parse_args()
+
+    run_benchmarks(args.output, n_songs=args.songs, seconds=args.seconds,
+                   workers=[int(n) for n in args.workers.split(",")],
+                   batch_sizes=[int(n) for n in args.batch_sizes.split(",")],
+                   epochs=args.epochs, work_dir=args.work_dir)
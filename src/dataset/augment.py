@@ -0,0 +1,134 @@
+"""
+SpecAugment-style augmentation of whole batches of spectograms.
+
+The transforms of a MusicDataset run once per sample, in Python. BatchAugment works on the collated batch instead:
+the random parameters of every sample (mask positions and widths, shifts, gains) are drawn with one call each and
+applied with a few tensor operations, so the cost per sample goes down as the batch gets bigger. Use it as the
+collate_fn of a DataLoader (it runs in the workers), through MusicDataModule(batch_augment=...), or on a batch that
+is already on the GPU.
+"""
+
+import torch
+
+# Number of samples augmented at a time (small enough that a chunk of 3x120x120 images stays in the CPU cache).
+chunk_size = 32
+
+
+class BatchAugment(object):
+    """
+    Time masks, frequency masks, time shifts and gain for a batch of spectograms, with different random parameters
+    for every sample. The last two dimensions of a batch are frequency and time (ex: (batch, channels, height, width)
+    from ToTensor, or (batch, 1, frequencies, frames) for features).
+
+    args:
+        time_masks (int): number of time masks per sample.
+        time_mask_width (int): widest time mask (in frames/pixels), each mask is 0 to time_mask_width wide.
+        freq_masks (int): number of frequency masks per sample.
+        freq_mask_width (int): widest frequency mask (in bins/pixels).
+        max_shift (int): samples are rolled in time by -max_shift to max_shift frames/pixels (wrapping around).
+        gain (float): -gain to gain is added to every sample (in the units of the data, ex: decibels for features).
+        p (float): probability that a sample is augmented at all.
+        mask_value: value of the masked parts, "mean" for the mean of each sample.
+    """
+
+    def __init__(self, time_masks: int = 2, time_mask_width: int = 20, freq_masks: int = 2, freq_mask_width: int = 15,
+                 max_shift: int = 0, gain: float = 0.0, p: float = 1.0, mask_value = "mean") -> None:
+        """
+        Constructor for BatchAugment class.
+        """
+        self.time_masks = time_masks
+        self.time_mask_width = time_mask_width
+        self.freq_masks = freq_masks
+        self.freq_mask_width = freq_mask_width
+        self.max_shift = max_shift
+        self.gain = gain
+        self.p = p
+        self.mask_value = mask_value
+
+
+    def _masks(self, batch_size: int, count: int, max_width: int, size: int, device) -> torch.Tensor:
+        """
+        Returns which of size positions are covered by count random masks, for every sample (shape (batch_size, size)).
+        """
+        if count == 0: return torch.zeros((batch_size, size), dtype=torch.bool, device=device)
+        widths = torch.randint(0, min(max_width, size) + 1, (batch_size, count, 1), device=device)
+        starts = (torch.rand((batch_size, count, 1), device=device) * (size - widths + 1)).long()
+        positions = torch.arange(size, device=device)
+        return ((positions >= starts) & (positions < starts + widths)).any(dim=1)
+
+
+    def __call__(self, batch: torch.Tensor, inplace: bool = False) -> torch.Tensor:
+        """
+        Augment a batch of spectograms.
+
+        Args:
+            batch (torch.Tensor): float tensor whose first dimension is the batch and last two are frequency and time.
+            inplace (bool): allow batch to be changed and returned (saves a copy of the batch when there is no shift).
+
+        Return value: torch.Tensor of the augmented batch.
+        """
+        if not torch.is_floating_point(batch) or batch.dim() < 3:
+            raise ValueError(f"BatchAugment needs a float batch of shape (batch, ..., frequency, time), got {batch.dtype} of shape {tuple(batch.shape)}.")
+        batch_size, frequencies, frames = batch.shape[0], batch.shape[-2], batch.shape[-1]
+        device = batch.device
+        # Shape that lines a value per sample up with the batch.
+        per_sample = (batch_size,) + (1,) * (batch.dim() - 1)
+
+        # Draw the random parameters of every sample at once.
+        augmented = torch.rand(batch_size, device=device) < self.p
+        shifts, gains, mask = None, None, None
+        if self.max_shift > 0:
+            shifts = torch.randint(-self.max_shift, self.max_shift + 1, (batch_size,), device=device) * augmented
+            positions = torch.arange(frames, device=device)
+        if self.gain > 0:
+            gains = ((torch.rand(batch_size, device=device) * 2 - 1) * self.gain * augmented).view(per_sample).to(batch.dtype)
+        if self.time_masks > 0 or self.freq_masks > 0:
+            # The masks are bands, so they are drawn as (batch, time) and (batch, frequency) and only combined at the end.
+            time_mask = self._masks(batch_size, self.time_masks, self.time_mask_width, frames, device) & augmented[:, None]
+            freq_mask = self._masks(batch_size, self.freq_masks, self.freq_mask_width, frequencies, device) & augmented[:, None]
+            mask = (time_mask[:, None, :] | freq_mask[:, :, None]).view(per_sample[:-2] + (frequencies, frames))
+
+        # Go through the batch a chunk at a time, so each step reads the chunk from the CPU cache instead of memory.
+        # Every step writes straight into the output (gather can't write into its own input, so shifts need a new tensor).
+        output = batch if inplace and shifts is None else torch.empty_like(batch)
+        for start in range(0, batch_size, chunk_size):
+            rows = slice(start, start + chunk_size)
+            chunk, out = batch[rows], output[rows]
+            written = False
+            # Roll every sample in time by its own shift.
+            if shifts is not None:
+                index = (positions - shifts[rows, None]) % frames
+                chunk = torch.gather(chunk, -1, index.view(index.shape[:1] + per_sample[1:-1] + (frames,)).expand(chunk.shape), out=out)
+                written = True
+            # Add a random gain to every sample.
+            if gains is not None:
+                chunk = torch.add(chunk, gains[rows], out=out)
+                written = True
+            # Fill random time and frequency bands of every sample.
+            if mask is not None:
+                if self.mask_value == "mean": fill = chunk.mean(dim=tuple(range(1, chunk.dim())), keepdim=True)
+                else: fill = torch.tensor(self.mask_value, dtype=chunk.dtype, device=device)
+                chunk = torch.where(mask[rows], fill, chunk, out=out)
+                written = True
+            if not written and out.data_ptr() != chunk.data_ptr(): out.copy_(chunk)
+        return output
+
+
+    def collate(self, samples: list) -> (torch.Tensor, torch.Tensor):
+        """
+        Collate (image, label) samples into a batch and augment the images, to use as the collate_fn of a DataLoader.
+        """
+        images, labels = torch.utils.data.default_collate(samples)
+        # The collated batch is a new tensor, so it can be augmented in place.
+        return self(images, inplace=True), labels
+
+
+if __name__ == "__main__":
+    import time
+
+    augment = BatchAugment(time_masks=2, time_mask_width=20, freq_masks=2, freq_mask_width=15, max_shift=10)
+    for batch_size in [1, 16, 256]:
+        batch = torch.rand((batch_size, 3, 120, 120))
+        start = time.perf_counter()
+        for _ in range(20): augment(batch)
+        print(f"Batch size {batch_size}: {20 * batch_size / (time.perf_counter() - start):.0f} samples/s")
@@ -0,0 +1,242 @@
+"""
+An incremental build of the training data: the labels (mood.csv), the spectograms, the quality scan (exclude.csv),
+the splits and the catalog (catalog.npz), in that order.
+
+Each stage is described by its inputs (files or directories), its parameters and its outputs. After a stage runs, a
+fingerprint of the contents of its inputs and its parameters is recorded in a state file (data/build_state.json),
+along with a fingerprint of its outputs. The next build only runs the stages whose inputs, parameters or outputs
+changed since then. The fingerprints are of the contents, not the modification times, so a stage whose inputs were
+rewritten with the same contents isn't run again. For example, changing the mood thresholds relabels the songs and
+redoes the splits without touching the spectograms. Inside the spectogram stage, the SpectogramCache only generates
+the songs whose audio or settings changed.
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import pathlib
+
+# Make it to where paths only need to be from the repo folder (the root is found once, in paths.py).
+if not __package__: sys.path.append(str(pathlib.Path(__file__).resolve().parents[2]))
+from src.dataset.paths import root, annotation_paths
+
+from src.dataset.spectogram_cache import hash_file
+from src.dataset.quality import exclude_path
+
+# Where the fingerprints of the last build are stored.
+state_path = "data/build_state.json"
+
+# Stages in the order they run.
+build_stages = ["labels", "spectograms", "scan", "split", "catalog"]
+
+
+class BuildState(object):
+    """
+    Fingerprints of the inputs and outputs of every stage of the last build, kept in a json file.
+    Files are only hashed again if their size or modification time changed since they were last hashed.
+
+    args:
+        state_path (str): path of the json file.
+    """
+
+    def __init__(self, state_path: str = state_path) -> None:
+        """
+        Constructor for BuildState class.
+        """
+        self.state_path = os.path.join(root, state_path)
+        self.stages = {}
+        self.hashes = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r') as file: state = json.load(file)
+            self.stages = state["stages"]
+            self.hashes = state["hashes"]
+
+
+    def save(self) -> None:
+        """
+        Write the state to disk.
+        """
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        # Forget the hashes of files that were deleted.
+        hashes = {path: entry for path, entry in self.hashes.items() if os.path.exists(os.path.join(root, path))}
+        temp_path = self.state_path + ".tmp"
+        with open(temp_path, 'w') as file: json.dump({"stages": self.stages, "hashes": hashes}, file, indent=2, sort_keys=True)
+        os.replace(temp_path, self.state_path)
+
+
+    def hash(self, file_path: str) -> str:
+        """
+        Returns the hash of a file's contents, hashing it again only if its size or modification time changed.
+        """
+        stat = os.stat(file_path)
+        name = os.path.relpath(file_path, root)
+        entry = self.hashes.get(name)
+        if entry is None or entry[0] != stat.st_size or entry[1] != stat.st_mtime_ns:
+            entry = [stat.st_size, stat.st_mtime_ns, hash_file(file_path)]
+            self.hashes[name] = entry
+        return entry[2]
+
+
+    def fingerprint(self, paths: list, params: dict = None) -> str:
+        """
+        Make a fingerprint of the contents of files and directories and of parameters.
+
+        Args:
+            paths (list): files or directories (every file inside, or only some with a pattern like "data/spectograms/*.png").
+                          A path that doesn't exist is part of the fingerprint too.
+            params (dict): parameters (must be json serializable).
+
+        Return value: str of the fingerprint.
+        """
+        digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode())
+        for path in paths:
+            directory, pattern = os.path.split(path)
+            extension = pattern[1:] if pattern.startswith("*") else None
+            if extension is None: directory = path
+            directory = os.path.join(root, directory)
+            digest.update(f"\n{path}\n".encode())
+            if os.path.isdir(directory):
+                for file in sorted(os.listdir(directory)):
+                    file_path = os.path.join(directory, file)
+                    if (extension is None or file.endswith(extension)) and os.path.isfile(file_path):
+                        digest.update(f"{file}:{self.hash(file_path)}\n".encode())
+            elif extension is None and os.path.isfile(directory): digest.update(self.hash(directory).encode())
+            else: digest.update(b"missing")
+        return digest.hexdigest()[:16]
+
+
+    def is_current(self, stage: str, inputs: str, outputs: str) -> bool:
+        """
+        Returns whether a stage ran with the same inputs and its outputs haven't changed since.
+        """
+        entry = self.stages.get(stage)
+        return entry is not None and entry["inputs"] == inputs and entry["outputs"] == outputs
+
+
+    def record(self, stage: str, inputs: str, outputs: str) -> None:
+        """
+        Remember the fingerprints of a stage that just ran.
+        """
+        self.stages[stage] = {"inputs": inputs, "outputs": outputs, "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def _exists(path: str) -> bool:
+    """
+    Returns whether an input or output exists (the directory for a pattern like "data/spectograms/*.png").
+    """
+    directory, pattern = os.path.split(path)
+    return os.path.exists(os.path.join(root, directory if pattern.startswith("*") else path))
+
+
+def build_data(stages: list = build_stages, force: list = [], annotations: list = annotation_paths,
+               mood_csv: str = "data/mood.csv", valence_threshold: float = 5, arousal_threshold: float = 5,
+               audio_dir: str = "data/DEAM_audio/MEMD_audio", spectogram_dir: str = "data/spectograms",
+               cache_dir: str = "data/spectogram_cache", renderer: str = "matplotlib", spectogram_params: dict = None,
+               num_workers: int = 1, exclude_manifest: str = exclude_path, split_method: str = "stratified",
+               n_folds: int = 5, test_size: float = 0.1, train_per_class: int = 200, seed: int = 0,
+               catalog_path: str = "data/catalog.npz", state_path: str = state_path) -> dict:
+    """
+    Bring the training data up to date, running only the stages whose inputs, parameters or outputs changed.
+
+    Arguments:
+        stages (list): stages to build (ex: leave out "spectograms" and "scan" without the audio files).
+        force (list): stages to run even if they are up to date.
+        annotations (list): annotation files the labels are made from.
+        mood_csv (str): path of the mood csv file.
+        valence_threshold, arousal_threshold (float): thresholds of the mood types (see label_moods).
+        audio_dir (str): directory of the audio files.
+        spectogram_dir (str): directory of the spectograms.
+        cache_dir (str): directory of the SpectogramCache (only songs whose audio or settings changed are generated).
+        renderer (str): "matplotlib" or "numpy" (see generate_multiple_spectogram).
+        spectogram_params (dict): keyword arguments for generate_spectogram.
+        num_workers (int): number of processes generating spectograms.
+        exclude_manifest (str): path of the songs to exclude (written by the scan, read by the split).
+        split_method (str): "stratified" for a split index file (next to mood_csv), "balanced" for
+                            mood_training.csv and mood_validation.csv (see train_val_split).
+        n_folds, test_size (float): settings of stratified_split.
+        train_per_class (int): setting of train_val_split.
+        seed (int): seed of the split.
+        catalog_path (str): path of the catalog of the songs, splits and exclusions (see catalog.py).
+        state_path (str): path of the state file.
+
+    Return value: dict of each stage to "ran" or "up to date" (a stage that failed and everything after it is left out).
+    """
+    if split_method not in ("stratified", "balanced"): raise ValueError(f"Split method [{split_method}] is not one of ['stratified', 'balanced'].")
+    unknown = set(stages) | set(force)
+    unknown -= set(build_stages)
+    if unknown: raise ValueError(f"Unknown stages {sorted(unknown)}, expected some of {build_stages}.")
+
+    from src.dataset import data_utils, spectograms, quality, catalog
+    split_dir = os.path.dirname(mood_csv)
+    if split_method == "stratified": split_outputs = [os.path.join(split_dir, "mood_splits.csv")]
+    else: split_outputs = [os.path.join(split_dir, "mood_training.csv"), os.path.join(split_dir, "mood_validation.csv")]
+
+    def split() -> None:
+        if split_method == "stratified": data_utils.stratified_split(mood_csv, split_outputs[0], n_folds, test_size, seed, exclude_manifest)
+        else: data_utils.train_val_split(mood_csv, train_per_class, seed, exclude_manifest)
+
+    # Each stage: its inputs, parameters, outputs and how to run it.
+    definitions = {
+        "labels": (list(annotations), {"valence_threshold": valence_threshold, "arousal_threshold": arousal_threshold},
+                   [mood_csv],
+                   lambda: data_utils.create_mood_csv(annotations, mood_csv, valence_threshold, arousal_threshold)),
+        "spectograms": ([audio_dir], spectograms.spectogram_settings(renderer, spectogram_params) if "spectograms" in stages else None,
+                        [os.path.join(spectogram_dir, "*.png")],
+                        lambda: spectograms.generate_multiple_spectogram(audio_dir, spectogram_dir, num_workers=num_workers,
+                                                                         renderer=renderer, cache_dir=cache_dir,
+                                                                         spectogram_params=spectogram_params)),
+        "scan": ([os.path.join(spectogram_dir, "*.png")], {}, [exclude_manifest],
+                 lambda: quality.scan_spectograms(spectogram_dir, exclude_manifest)),
+        "split": ([mood_csv, exclude_manifest],
+                  {"method": split_method, "n_folds": n_folds, "test_size": test_size, "train_per_class": train_per_class, "seed": seed},
+                  split_outputs, split),
+        "catalog": ([mood_csv, exclude_manifest] + split_outputs, {"spectogram_dir": spectogram_dir, "version": catalog.catalog_version}, [catalog_path],
+                    lambda: catalog.build_catalog(mood_csv, catalog_path,
+                                                  split_csvs=split_outputs if split_method == "balanced" else [],
+                                                  split_file=split_outputs[0] if split_method == "stratified" else None,
+                                                  exclude_manifest=exclude_manifest, spectogram_dir=spectogram_dir)),
+    }
+
+    # Inputs a stage can run without (a missing exclusion manifest excludes no songs, like read_exclude).
+    optional = {exclude_manifest}
+
+    state = BuildState(state_path)
+    results = {}
+    try:
+        for name in build_stages:
+            if name not in stages: continue
+            inputs, params, outputs, run = definitions[name]
+
+            # The inputs are fingerprinted right before the stage, after the stages before it updated them.
+            input_fingerprint = state.fingerprint(inputs, params)
+            if name not in force and state.is_current(name, input_fingerprint, state.fingerprint(outputs)):
+                print(f"Stage [{name}] is up to date.")
+                results[name] = "up to date"
+                continue
+
+            # Don't run a stage on inputs that aren't there (its old outputs would look like new ones).
+            missing = [path for path in inputs if path not in optional and not _exists(path)]
+            if missing:
+                print(f"Inputs {missing} of stage [{name}] don't exist, stopping the build.")
+                break
+
+            print(f"Running stage [{name}]")
+            start = time.perf_counter()
+            run()
+            missing = [output for output in outputs if not _exists(output)]
+            if missing:
+                print(f"Stage [{name}] didn't create {missing}, stopping the build.")
+                break
+            state.record(name, input_fingerprint, state.fingerprint(outputs))
+            state.save()
+            print(f"Stage [{name}] took {time.perf_counter() - start:.1f}s")
+            results[name] = "ran"
+    finally:
+        state.save()
+    return results
+
+
+if __name__ == "__main__":
+    build_data()
@@ -0,0 +1,397 @@
+"""
+A catalog of every song in one compact, columnar file (data/catalog.npz).
+
+The csv files (mood.csv, mood_training.csv, mood_validation.csv, mood_splits.csv) and the exclusion manifest are
+read once and stored as typed columns: the song ids, mood types (as small integer codes), valence and arousal, which
+split csv files have each song, the fold of each song, whether it is excluded and whether its spectogram exists.
+The number of songs of each mood type in every split is counted when the catalog is made. Loading the catalog is a
+single read of a few arrays, and the songs of a split, a mood type or a range of valence are found with vectorized
+filters instead of parsing a csv file and grouping a dataframe again.
+
+The catalog remembers the size, modification time and hash of the files it was made from. If any of them changed
+since, catalog_for reads the csv file on its own instead (once per process, until it changes), so the results are
+never out of date.
+"""
+
+import os
+import sys
+import json
+import pathlib
+import numpy as np
+import pandas as pd
+
+# Make it to where paths only need to be from the repo folder (the root is found once, in paths.py).
+if not __package__: sys.path.append(str(pathlib.Path(__file__).resolve().parents[2]))
+from src.dataset.paths import root
+
+from src.dataset.quality import load_exclude, exclude_path
+from src.dataset.spectogram_cache import hash_file
+
+# Mood types in the order of the one-hot encoded labels (and of the mood codes).
+moods = ["calm", "happy", "sad", "tense"]
+
+# Default location of the catalog and of the files it is made from.
+catalog_path = "data/catalog.npz"
+split_csvs = ["data/mood_training.csv", "data/mood_validation.csv"]
+split_file = "data/mood_splits.csv"
+
+# Headers every csv file of songs has.
+required_columns = ["song_id", "mood", "valence", "arousal"]
+
+# Version of the columns of the catalog (catalogs of another version are made again, ex: 2 stores valence and arousal as float64).
+catalog_version = 2
+
+# Fold of the songs that aren't in the split index file (the test set is -1).
+no_fold = -2
+
+# Catalogs that were already loaded (path -> (size and modification time of the file, Catalog)).
+_loaded = {}
+
+
+def _key(path: str) -> str:
+    """
+    Returns the path a file is known by in a catalog (from the repo folder, or absolute if it's outside of it).
+    """
+    full_path = os.path.normpath(os.path.join(root, path))
+    relative = os.path.relpath(full_path, root)
+    return full_path if relative.startswith("..") else relative
+
+
+def _stat(path: str) -> list:
+    """
+    Returns the size and modification time of a file (None if it doesn't exist).
+    """
+    full_path = os.path.join(root, path)
+    if not os.path.exists(full_path): return None
+    stat = os.stat(full_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _source(path: str) -> list:
+    """
+    Returns the size, modification time and hash of a file the catalog is made from (None if it doesn't exist).
+    """
+    stat = _stat(path)
+    return None if stat is None else stat + [hash_file(path)]
+
+
+def _unchanged(path: str, source: list) -> bool:
+    """
+    Returns whether a file has the contents it had when the catalog was made (a file that was rewritten with the
+    same contents, ex: the same split made again, is only hashed to check).
+    """
+    stat = _stat(path)
+    if stat is None or source is None: return stat is None and source is None
+    return stat == source[:2] or (stat[0] == source[0] and hash_file(path) == source[2])
+
+
+class Catalog(object):
+    """
+    Columns of songs (one row per song, in the order of the main csv file) and the counts of each mood type.
+
+    args:
+        columns (dict): np.ndarray of each column ("song_id", "mood", "valence", "arousal", "excluded", "fold",
+                        "has_spectogram" and "in_<split>" for each split csv file).
+        mood_names (list): name of each mood code.
+        meta (dict): the files the catalog was made from (and their sizes, modification times and hashes) and where
+                     the spectograms are.
+        counts (dict): precomputed number of songs of each mood type (not excluded) for each split (None to count them now).
+        split (str): which split this catalog is the rows of (None for all of them).
+    """
+
+    def __init__(self, columns: dict, mood_names: list, meta: dict, counts: dict = None, split: str = None) -> None:
+        """
+        Constructor for Catalog class.
+        """
+        self.columns = columns
+        self.mood_names = list(mood_names)
+        self.meta = meta
+        self.split = split
+        if counts is None:
+            counts = {"all": self._count(~columns["excluded"])}
+            for name in self.splits: counts[name] = self._count(columns[f"in_{name}"] & ~columns["excluded"])
+        self.counts = counts
+
+
+    @property
+    def splits(self) -> list:
+        """
+        Names of the split csv files in the catalog (ex: "mood_training").
+        """
+        return [name[3:] for name in self.columns if name.startswith("in_")]
+
+
+    def __len__(self) -> int:
+        return len(self.columns["song_id"])
+
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        """
+        Returns a column.
+        """
+        return self.columns[name]
+
+
+    def _count(self, mask: np.ndarray) -> np.ndarray:
+        """
+        Returns the number of songs of each mood code in the rows of mask.
+        """
+        return np.bincount(self.columns["mood"][mask], minlength=len(self.mood_names))
+
+
+    def where(self, moods: list = None, split: str = None, folds: list = None, song_ids = None, valence: tuple = None,
+              arousal: tuple = None, excluded: bool = False, has_spectogram: bool = None) -> np.ndarray:
+        """
+        Find the songs that match every filter given (filters left as None match every song).
+
+        Args:
+            moods (list): mood types to keep (ex: ["happy", "sad"]).
+            split (str): only the songs in this split csv file (ex: "mood_training").
+            folds (list): only the songs in these folds of the split index file (-1 is the test set).
+            song_ids: only these songs.
+            valence (tuple): (low, high) range of valence to keep (inclusive).
+            arousal (tuple): (low, high) range of arousal to keep (inclusive).
+            excluded (bool): False to leave out the excluded songs, True for only them, None for both.
+            has_spectogram (bool): only the songs whose spectogram exists (True) or doesn't (False).
+
+        Return value: np.ndarray of bool, True for every row that matches.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if moods is not None:
+            unknown = set(moods) - set(self.mood_names)
+            if unknown: raise ValueError(f"Unknown mood types {sorted(unknown)}, expected some of {self.mood_names}.")
+            mask &= np.isin(self.columns["mood"], [self.mood_names.index(mood) for mood in moods])
+        if split is not None:
+            if split not in self.splits: raise ValueError(f"Split [{split}] is not one of {self.splits}.")
+            mask &= self.columns[f"in_{split}"]
+        if folds is not None: mask &= np.isin(self.columns["fold"], folds)
+        if song_ids is not None: mask &= np.isin(self.columns["song_id"], np.asarray(song_ids, dtype=np.int64))
+        if valence is not None: mask &= (self.columns["valence"] >= valence[0]) & (self.columns["valence"] <= valence[1])
+        if arousal is not None: mask &= (self.columns["arousal"] >= arousal[0]) & (self.columns["arousal"] <= arousal[1])
+        if excluded is not None: mask &= self.columns["excluded"] == excluded
+        if has_spectogram is not None:
+            if "has_spectogram" not in self.columns: raise ValueError("The catalog wasn't made with a spectogram directory.")
+            mask &= self.columns["has_spectogram"] == has_spectogram
+        return mask
+
+
+    def subset(self, mask: np.ndarray, split: str = None) -> "Catalog":
+        """
+        Returns a catalog of the rows of mask (with the precomputed counts of split, if it is the rows of a split).
+        """
+        columns = {name: column[mask] for name, column in self.columns.items()}
+        counts = {"all": self.counts[split]} if split is not None else None
+        return Catalog(columns, self.mood_names, self.meta, counts, split)
+
+
+    def class_counts(self, split: str = None) -> dict:
+        """
+        Returns the number of songs of each mood type that aren't excluded (precomputed).
+
+        Args:
+            split (str): name of a split csv file (ex: "mood_training"), None for every song in the catalog.
+
+        Return value: dict of each mood type to its number of songs.
+        """
+        counts = self.counts["all" if split is None else split]
+        return {mood: int(count) for mood, count in zip(self.mood_names, counts)}
+
+
+    def moods(self, mask: np.ndarray = None) -> np.ndarray:
+        """
+        Returns the mood type names of the rows of mask (every row if mask is None).
+        """
+        codes = self.columns["mood"] if mask is None else self.columns["mood"][mask]
+        return np.array(self.mood_names, dtype=object)[codes]
+
+
+    def frame(self, mask: np.ndarray = None) -> pd.DataFrame:
+        """
+        Returns the rows of mask (every row if mask is None) as a dataframe with headers [song_id, mood, valence, arousal].
+        """
+        rows = slice(None) if mask is None else mask
+        return pd.DataFrame({"song_id": self.columns["song_id"][rows], "mood": self.moods(mask),
+                             "valence": self.columns["valence"][rows], "arousal": self.columns["arousal"][rows]})
+
+
+    def spectogram_paths(self, mask: np.ndarray = None, data_dir: str = None, extension: str = ".png") -> list:
+        """
+        Returns the paths of the spectograms of the rows of mask (in data_dir, or the spectogram directory of the catalog).
+        """
+        data_dir = os.path.join(root, data_dir if data_dir is not None else self.meta["spectogram_dir"])
+        song_ids = self.columns["song_id"] if mask is None else self.columns["song_id"][mask]
+        return [os.path.join(data_dir, f"{song_id}{extension}") for song_id in song_ids]
+
+
+    def is_current(self) -> bool:
+        """
+        Returns whether none of the files the catalog was made from changed since (and its columns are of this version).
+        """
+        if self.meta.get("version") != catalog_version: return False
+        return all(_unchanged(path, source) for path, source in self.meta["sources"].items())
+
+
+    def view(self, csv_file_path: str) -> "Catalog":
+        """
+        Returns the rows of one of the csv files the catalog was made from (every row for the main csv file).
+        """
+        key = _key(csv_file_path)
+        if key == self.meta["mood_csv"]: return self
+        name = os.path.splitext(os.path.basename(key))[0]
+        if self.meta["split_csvs"].get(name) != key: raise ValueError(f"CSV file [{csv_file_path}] is not in the catalog.")
+        return self.subset(self.columns[f"in_{name}"], name)
+
+
+    def save(self, path: str = catalog_path) -> None:
+        """
+        Write the catalog to an .npz file.
+        """
+        path = os.path.join(root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        count_names = list(self.counts)
+        temp_path = path + ".tmp.npz"
+        np.savez(temp_path, **{f"column_{name}": column for name, column in self.columns.items()},
+                 mood_names=np.array(self.mood_names), count_names=np.array(count_names),
+                 counts=np.stack([self.counts[name] for name in count_names]), meta=np.array(json.dumps(self.meta)))
+        os.replace(temp_path, path)
+
+
+def read_songs_csv(csv_file_path: str, exclude_manifest: str = exclude_path) -> Catalog:
+    """
+    Make a catalog of a single csv file of songs (no splits, folds or spectograms).
+
+    Arguments:
+        csv_file_path (str): path to a csv file with headers [song_id, mood, valence, arousal].
+        exclude_manifest (str): path to the exclusion manifest.
+
+    Return value: Catalog of the songs in the csv file.
+    """
+    df = pd.read_csv(os.path.join(root, csv_file_path))
+    if not set(required_columns) <= set(df.columns):
+        raise ValueError(f"CSV file given [{csv_file_path}] does not have all the required headers of {required_columns}.")
+
+    # The known mood types keep their codes, any others come after them.
+    mood_names = moods + sorted(set(df.mood) - set(moods))
+    song_ids = df.song_id.to_numpy(dtype=np.int64)
+    columns = {
+        "song_id": song_ids.astype(np.int32),
+        "mood": pd.Categorical(df.mood, categories=mood_names).codes.astype(np.int8),
+        "valence": df.valence.to_numpy(dtype=np.float64),
+        "arousal": df.arousal.to_numpy(dtype=np.float64),
+        "excluded": np.isin(song_ids, np.fromiter(load_exclude(exclude_manifest), dtype=np.int64)),
+        "fold": np.full(len(df), no_fold, dtype=np.int8),
+    }
+    meta = {"version": catalog_version, "mood_csv": _key(csv_file_path), "split_csvs": {}, "split_file": None, "exclude_manifest": _key(exclude_manifest),
+            "spectogram_dir": None, "sources": {_key(csv_file_path): _source(csv_file_path), _key(exclude_manifest): _source(exclude_manifest)}}
+    return Catalog(columns, mood_names, meta)
+
+
+def build_catalog(mood_csv: str = "data/mood.csv", catalog_path: str = catalog_path, split_csvs: list = split_csvs,
+                  split_file: str = split_file, exclude_manifest: str = exclude_path,
+                  spectogram_dir: str = "data/spectograms") -> Catalog:
+    """
+    Make the catalog of every song in mood_csv and save it. Split csv files and a split index file that don't
+    exist are left out.
+
+    Arguments:
+        mood_csv (str): path to the csv file of every song (headers [song_id, mood, valence, arousal]).
+        catalog_path (str): path of the catalog (.npz).
+        split_csvs (list): csv files of subsets of the songs (ex: mood_training.csv), each gets an in_<name> column.
+        split_file (str): split index file made by stratified_split (gives the fold column).
+        exclude_manifest (str): path to the exclusion manifest (gives the excluded column).
+        spectogram_dir (str): directory of the spectograms (gives the has_spectogram column, None to leave it out).
+
+    Return value: Catalog that was saved.
+    """
+    catalog = read_songs_csv(mood_csv, exclude_manifest)
+    columns, meta = catalog.columns, catalog.meta
+    song_ids = columns["song_id"]
+
+    # Which split csv files have each song.
+    for csv_file_path in split_csvs:
+        meta["sources"][_key(csv_file_path)] = _source(csv_file_path)
+        if not os.path.exists(os.path.join(root, csv_file_path)): continue
+        name = os.path.splitext(os.path.basename(csv_file_path))[0]
+        split_ids = pd.read_csv(os.path.join(root, csv_file_path), usecols=["song_id"]).song_id.to_numpy(dtype=np.int64)
+        missing = np.setdiff1d(split_ids, song_ids)
+        if len(missing) > 0: print(f"Songs {missing.tolist()} of [{csv_file_path}] are not in [{mood_csv}] and are left out.")
+        columns[f"in_{name}"] = np.isin(song_ids, split_ids)
+        meta["split_csvs"][name] = _key(csv_file_path)
+
+    # The fold of each song in the split index file.
+    if split_file is not None:
+        meta["sources"][_key(split_file)] = _source(split_file)
+        if os.path.exists(os.path.join(root, split_file)):
+            splits = pd.read_csv(os.path.join(root, split_file))
+            rows = pd.Index(splits.song_id.to_numpy(dtype=np.int64)).get_indexer(song_ids.astype(np.int64))
+            columns["fold"] = np.where(rows >= 0, splits.fold.to_numpy(dtype=np.int8)[rows], no_fold).astype(np.int8)
+            meta["split_file"] = _key(split_file)
+
+    # Whether the spectogram of each song exists (one listing of the directory).
+    if spectogram_dir is not None:
+        spectogram_path = os.path.join(root, spectogram_dir)
+        files = set(os.listdir(spectogram_path)) if os.path.isdir(spectogram_path) else set()
+        columns["has_spectogram"] = np.array([f"{song_id}.png" in files for song_id in song_ids], dtype=bool)
+        meta["spectogram_dir"] = spectogram_dir
+
+    # Count the mood types of every split (and fold) once.
+    catalog = Catalog(columns, catalog.mood_names, meta)
+    for fold in np.unique(columns["fold"][columns["fold"] != no_fold]):
+        name = "test" if fold == -1 else f"fold_{fold}"
+        catalog.counts[name] = catalog._count((columns["fold"] == fold) & ~columns["excluded"])
+    catalog.save(catalog_path)
+    print(f"Created catalog of {len(catalog)} songs at [{os.path.join(root, catalog_path)}]")
+    return catalog
+
+
+def load_catalog(catalog_path: str = catalog_path) -> Catalog:
+    """
+    Load a catalog (read once, then kept until the file changes).
+
+    Arguments:
+        catalog_path (str): path of the catalog.
+
+    Return value: Catalog (None if the file doesn't exist).
+    """
+    stat = _stat(catalog_path)
+    if stat is None: return None
+    key = _key(catalog_path)
+    if key not in _loaded or _loaded[key][0] != stat:
+        with np.load(os.path.join(root, catalog_path)) as data:
+            columns = {name[len("column_"):]: data[name] for name in data.files if name.startswith("column_")}
+            counts = dict(zip(data["count_names"].tolist(), data["counts"]))
+            catalog = Catalog(columns, data["mood_names"].tolist(), json.loads(data["meta"].item()), counts)
+        _loaded[key] = (stat, catalog)
+    return _loaded[key][1]
+
+
+def catalog_for(csv_file_path: str, exclude_manifest: str = exclude_path, catalog_path: str = catalog_path) -> Catalog:
+    """
+    Get the songs of a csv file as a catalog. They come from the saved catalog if it was made from this csv file and
+    exclusion manifest and none of its files changed since, otherwise the csv file is read (once, until it changes).
+
+    Arguments:
+        csv_file_path (str): path to a csv file with headers [song_id, mood, valence, arousal].
+        exclude_manifest (str): path to the exclusion manifest.
+        catalog_path (str): path of the saved catalog.
+
+    Return value: Catalog of the songs in the csv file (in the order of the main csv file of the catalog).
+    """
+    catalog = load_catalog(catalog_path)
+    if catalog is not None and catalog.meta["exclude_manifest"] == _key(exclude_manifest) and catalog.is_current():
+        key = _key(csv_file_path)
+        if key == catalog.meta["mood_csv"] or key in catalog.meta["split_csvs"].values(): return catalog.view(csv_file_path)
+
+    # Read the csv file on its own.
+    key = ("csv", _key(csv_file_path), _key(exclude_manifest))
+    stats = [_stat(csv_file_path), _stat(exclude_manifest)]
+    if key not in _loaded or _loaded[key][0] != stats: _loaded[key] = (stats, read_songs_csv(csv_file_path, exclude_manifest))
+    return _loaded[key][1]
+
+
+if __name__ == "__main__":
+    catalog = build_catalog()
+    print(catalog.class_counts())
+    for split in catalog.splits: print(split, catalog.class_counts(split))
+    happy = catalog.where(moods=["happy"], valence=(6, 9))
+    print(f"{happy.sum()} happy songs with valence from 6 to 9: {catalog['song_id'][happy][:10]}")
@@ -0,0 +1,222 @@
+"""
+One command-line entry point for the data tasks (labels, splits, spectograms, features, quantized spectograms,
+packing, quality scan, the catalog and an incremental build of all of them).
+
+Every subcommand imports what it needs only when it runs, so the command starts quickly (ex: --help doesn't import
+pandas, librosa or torch). Run it from anywhere as:
+    python -m src.dataset.cli <command> [options]
+    python src/dataset/cli.py <command> [options]
+Paths are from the repo folder, like everywhere else.
+"""
+
+import os
+import sys
+import pathlib
+import argparse
+
+# Make it to where paths only need to be from the repo folder (the root is found once, in paths.py).
+if not __package__: sys.path.append(str(pathlib.Path(__file__).resolve().parents[2]))
+from src.dataset.paths import annotation_paths
+
+
+def labels(args: argparse.Namespace) -> None:
+    """
+    Create the mood csv file from the annotation files.
+    """
+    from src.dataset.data_utils import create_mood_csv
+    create_mood_csv(args.annotations, args.output, args.valence_threshold, args.arousal_threshold)
+
+
+def stats(args: argparse.Namespace) -> None:
+    """
+    Print the stats of a csv file.
+    """
+    from src.dataset.data_utils import csv_stats
+    csv_stats(args.csv)
+
+
+def split(args: argparse.Namespace) -> None:
+    """
+    Split the songs of a csv file, into k folds and a test set (stratified) or a training and validation set (balanced).
+    """
+    from src.dataset.data_utils import train_val_split, stratified_split
+    if args.method == "stratified": stratified_split(args.csv, args.output, args.folds, args.test_size, args.seed)
+    else: train_val_split(args.csv, args.train_per_class, args.seed)
+
+
+def spectograms(args: argparse.Namespace) -> None:
+    """
+    Generate the spectograms of a directory of audio files.
+    """
+    from src.dataset.spectograms import generate_multiple_spectogram
+    generate_multiple_spectogram(args.audio_dir, args.output_dir, num_workers=args.workers, renderer=args.renderer,
+                                 cache_dir=args.cache_dir, exclude_manifest=args.exclude, pipeline=args.pipeline,
+                                 decode_workers=args.decode_workers, write_workers=args.write_workers,
+                                 queue_size=args.queue_size)
+
+
+def features(args: argparse.Namespace) -> None:
+    """
+    Extract the features of a directory of audio files.
+    """
+    from src.dataset.features import extract_multiple_features
+    extract_multiple_features(args.audio_dir, args.output_dir, batch_size=args.batch_size, n_mels=args.n_mels)
+
+
+def quantize(args: argparse.Namespace) -> None:
+    """
+    Save the spectograms of a directory of audio files as quantized decibels.
+    """
+    from src.dataset.quantized import quantize_multiple_spectogram
+    quantize_multiple_spectogram(args.audio_dir, args.output_dir, bits=args.bits, compress=args.compress,
+                                 size=args.size)
+
+
+def pack(args: argparse.Namespace) -> None:
+    """
+    Pack a directory of spectogram images into a SpectogramStore.
+    """
+    from src.dataset.spectogram_store import pack_spectograms
+    pack_spectograms(args.image_dir, args.store)
+
+
+def scan(args: argparse.Namespace) -> None:
+    """
+    Scan a directory of spectogram images for bad ones and write the songs to exclude.
+    """
+    from src.dataset.quality import scan_spectograms
+    excluded = scan_spectograms(args.image_dir, args.exclude)
+    print(f"{len(excluded)} songs excluded in [{args.exclude}]")
+
+
+def catalog(args: argparse.Namespace) -> None:
+    """
+    Make the catalog of the songs, their splits and exclusions and print the number of songs of each mood type.
+    """
+    from src.dataset.catalog import build_catalog
+    songs = build_catalog(args.csv, args.catalog, args.split_csvs, args.split_file, args.exclude, args.spectogram_dir)
+    print(songs.class_counts())
+    for name in songs.splits: print(f"{name}: {songs.class_counts(name)}")
+
+
+def build(args: argparse.Namespace) -> None:
+    """
+    Bring the labels, spectograms, exclusion manifest and splits up to date (only the stages that changed run).
+    """
+    from src.dataset.build import build_data
+    results = build_data(stages=args.stages, force=args.force, valence_threshold=args.valence_threshold,
+                         arousal_threshold=args.arousal_threshold, audio_dir=args.audio_dir,
+                         spectogram_dir=args.spectogram_dir, cache_dir=args.cache_dir, renderer=args.renderer,
+                         num_workers=args.workers, split_method=args.split_method, n_folds=args.folds,
+                         test_size=args.test_size, train_per_class=args.train_per_class, seed=args.seed,
+                         catalog_path=args.catalog)
+    for name, result in results.items(): print(f"{name}: {result}")
+
+
+def make_parser() -> argparse.ArgumentParser:
+    """
+    Returns the parser of every subcommand (each one calls its function with the parsed arguments).
+    """
+    parser = argparse.ArgumentParser(prog="python -m src.dataset.cli", description="Data tasks of the music analyzer.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("labels", help="create the mood csv file from the DEAM annotations")
+    command.add_argument("--annotations", nargs="+", default=annotation_paths)
+    command.add_argument("--output", default="data/mood.csv")
+    command.add_argument("--valence-threshold", type=float, default=5)
+    command.add_argument("--arousal-threshold", type=float, default=5)
+    command.set_defaults(function=labels)
+
+    command = commands.add_parser("stats", help="print the stats of a mood csv file")
+    command.add_argument("--csv", default="data/mood.csv")
+    command.set_defaults(function=stats)
+
+    command = commands.add_parser("split", help="split the songs into folds and a test set (or training/validation)")
+    command.add_argument("--csv", default="data/mood.csv")
+    command.add_argument("--method", choices=["stratified", "balanced"], default="stratified")
+    command.add_argument("--output", default=None, help="split index file (stratified only)")
+    command.add_argument("--folds", type=int, default=5)
+    command.add_argument("--test-size", type=float, default=0.1)
+    command.add_argument("--train-per-class", type=int, default=200, help="balanced only")
+    command.add_argument("--seed", type=int, default=0)
+    command.set_defaults(function=split)
+
+    command = commands.add_parser("spectograms", help="generate the spectograms of the audio files")
+    command.add_argument("--audio-dir", default="data/DEAM_audio/MEMD_audio")
+    command.add_argument("--output-dir", default="data/spectograms")
+    command.add_argument("--workers", type=int, default=os.cpu_count())
+    command.add_argument("--renderer", choices=["matplotlib", "numpy"], default="matplotlib")
+    command.add_argument("--cache-dir", default=None)
+    command.add_argument("--exclude", default=None, help="scan the images afterwards and write the songs to exclude here")
+    command.add_argument("--pipeline", action="store_true", help="decode, compute and write at the same time")
+    command.add_argument("--decode-workers", type=int, default=2)
+    command.add_argument("--write-workers", type=int, default=2)
+    command.add_argument("--queue-size", type=int, default=8)
+    command.set_defaults(function=spectograms)
+
+    command = commands.add_parser("features", help="extract float16 features of the audio files")
+    command.add_argument("--audio-dir", default="data/DEAM_audio/MEMD_audio")
+    command.add_argument("--output-dir", default="data/features_stft")
+    command.add_argument("--batch-size", type=int, default=8)
+    command.add_argument("--n-mels", type=int, default=None)
+    command.set_defaults(function=features)
+
+    command = commands.add_parser("quantize", help="save the spectograms as uint8/uint16 decibels with their scale")
+    command.add_argument("--audio-dir", default="data/DEAM_audio/MEMD_audio")
+    command.add_argument("--output-dir", default="data/spectograms_quantized")
+    command.add_argument("--bits", type=int, choices=[8, 16], default=8)
+    command.add_argument("--compress", action="store_true", help="compress the files (lossless)")
+    command.add_argument("--size", type=int, nargs=2, default=None, metavar=("HEIGHT", "WIDTH"),
+                         help="shrink the spectograms to this size first (ex: 369 496, the size of the pngs), lossy")
+    command.set_defaults(function=quantize)
+
+    command = commands.add_parser("pack", help="pack spectogram images into a memory-mapped store")
+    command.add_argument("--image-dir", default="data/spectograms")
+    command.add_argument("--store", default="data/spectograms_packed")
+    command.set_defaults(function=pack)
+
+    command = commands.add_parser("scan", help="find bad spectograms and write the songs to exclude")
+    command.add_argument("--image-dir", default="data/spectograms")
+    command.add_argument("--exclude", default="data/exclude.csv")
+    command.set_defaults(function=scan)
+
+    command = commands.add_parser("catalog", help="store the songs, splits and exclusions in one columnar file")
+    command.add_argument("--csv", default="data/mood.csv")
+    command.add_argument("--catalog", default="data/catalog.npz")
+    command.add_argument("--split-csvs", nargs="*", default=["data/mood_training.csv", "data/mood_validation.csv"])
+    command.add_argument("--split-file", default="data/mood_splits.csv")
+    command.add_argument("--exclude", default="data/exclude.csv")
+    command.add_argument("--spectogram-dir", default="data/spectograms")
+    command.set_defaults(function=catalog)
+
+    stages = ["labels", "spectograms", "scan", "split", "catalog"]
+    command = commands.add_parser("build", help="rebuild only the data that is out of date (labels, spectograms, scan, split, catalog)")
+    command.add_argument("--stages", nargs="+", choices=stages, default=stages, help="stages to build")
+    command.add_argument("--force", nargs="+", choices=stages, default=[], help="stages to run even if they are up to date")
+    command.add_argument("--valence-threshold", type=float, default=5)
+    command.add_argument("--arousal-threshold", type=float, default=5)
+    command.add_argument("--audio-dir", default="data/DEAM_audio/MEMD_audio")
+    command.add_argument("--spectogram-dir", default="data/spectograms")
+    command.add_argument("--cache-dir", default="data/spectogram_cache")
+    command.add_argument("--renderer", choices=["matplotlib", "numpy"], default="matplotlib")
+    command.add_argument("--workers", type=int, default=os.cpu_count())
+    command.add_argument("--split-method", choices=["stratified", "balanced"], default="stratified")
+    command.add_argument("--folds", type=int, default=5)
+    command.add_argument("--test-size", type=float, default=0.1)
+    command.add_argument("--train-per-class", type=int, default=200)
+    command.add_argument("--seed", type=int, default=0)
+    command.add_argument("--catalog", default="data/catalog.npz")
+    command.set_defaults(function=build)
+    return parser
+
+
+def main(argv: list = None) -> None:
+    """
+    Run the subcommand given on the command line (or in argv).
+    """
+    args = make_parser().parse_args(argv)
+    args.function(args)
+
+
+if __name__ == "__main__":
+    main()
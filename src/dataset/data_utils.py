@@ -5,20 +5,101 @@ Functions for working with the data.
 import os
 import csv
 import sys
-import pyprojroot
+import pathlib
+import numpy as np
 import pandas as pd
 
-# Make it to where paths only need to be from the repo folder.
-root = pyprojroot.find_root(pyprojroot.has_dir(".git"))
-sys.path.append(str(root))
+# Make it to where paths only need to be from the repo folder (the root is found once, in paths.py).
+if not __package__: sys.path.append(str(pathlib.Path(__file__).resolve().parents[2]))
+from src.dataset.paths import root
 
-# When generating the spectograms, some audio files produced black images so exclude those images.
-exclude = [137, 146, 187, 206, 236, 449, 488, 621, 646, 661, 707, 1016, 1109, 1134, 1142, 1161, 1167, 1171, 1184, 1429]
+from src.dataset.quality import load_exclude, exclude_path
+from src.dataset.catalog import catalog_for
+
+
+def label_moods(valence, arousal, valence_threshold: float = 5, arousal_threshold: float = 5) -> np.ndarray:
+    """
+    Assign a mood type to every song at once based on its valence and arousal.
+
+    Mood types:
+        high valence and low arousal: calm
+        high valence and high arousal: happy
+        low valence and low arousal: sad
+        low valence and high arousal: tense
+
+    Arguments:
+        valence (array-like): valence of each song.
+        arousal (array-like): arousal of each song.
+        valence_threshold (float): valence at or above this is high.
+        arousal_threshold (float): arousal below this is low.
+
+    Return value: np.ndarray of the mood type of each song.
+    """
+    high_valence = np.asarray(valence) >= valence_threshold
+    high_arousal = ~(np.asarray(arousal) < arousal_threshold)
+    return np.array(["sad", "tense", "calm", "happy"])[2 * high_valence + high_arousal]
+
+
+def _annotation_columns(data_path: str) -> list:
+    """
+    Find the positions of the song id, mean valence and mean arousal columns of a DEAM annotation file.
+    Falls back to the layout of static_annotations_averaged_songs_1_2000.csv (columns 0, 1 and 3).
+
+    Arguments:
+        data_path (str): path to the annotation file.
+
+    Return value: list of the three column positions.
+    """
+    with open(data_path, 'r', newline='') as file:
+        header = [name.strip() for name in next(csv.reader(file))]
+    if all(name in header for name in ("song_id", "valence_mean", "arousal_mean")):
+        return [header.index("song_id"), header.index("valence_mean"), header.index("arousal_mean")]
+    return [0, 1, 3]
+
+
+def create_mood_csv(data_paths: list, new_file_path: str, valence_threshold: float = 5, arousal_threshold: float = 5, chunksize: int = 1_000_000) -> None:
+    """
+    Create a csv file with headers [song_id, mood, valence, arousal] from one or more annotation files.
+    The files are read chunksize rows at a time, every row of a chunk is labeled at once (with label_moods)
+    and the chunk is written in one go.
+
+    Arguments:
+        data_paths (list): paths to annotation files (ex: both static_annotations_averaged_songs files).
+        new_file_path (str): what to call the new csv file (inclduing the path to that file).
+        valence_threshold (float): valence at or above this is high.
+        arousal_threshold (float): arousal below this is low.
+        chunksize (int): number of rows read at a time.
+
+    Return value: None
+    """
+    # Merge data_paths with root.
+    if isinstance(data_paths, str): data_paths = [data_paths]
+    data_paths = [os.path.join(root, data_path) for data_path in data_paths]
+
+    # Check if paths exist.
+    missing = [data_path for data_path in data_paths if not os.path.exists(data_path)]
+    if missing:
+        print(f"Data paths {missing} don't exist")
+        return
+
+    # Create a new file.
+    with open(os.path.join(root, new_file_path), 'w', newline='') as file:
+        # Same line endings and missing values as csv.writer.
+        file.write("song_id,mood,valence,arousal\r\n")
+        for data_path in data_paths:
+            columns = _annotation_columns(data_path)
+            for chunk in pd.read_csv(data_path, usecols=columns, chunksize=chunksize):
+                # usecols keeps the columns in file order, so pick them by position.
+                song_id, valence, arousal = (chunk.iloc[:, sorted(columns).index(column)] for column in columns)
+                moods = label_moods(valence.to_numpy(), arousal.to_numpy(), valence_threshold, arousal_threshold)
+                labeled = pd.DataFrame({"song_id": song_id.to_numpy(), "mood": moods,
+                                        "valence": valence.to_numpy(), "arousal": arousal.to_numpy()})
+                labeled.to_csv(file, header=False, index=False, lineterminator="\r\n", na_rep="nan")
 
 
 def create_csv(data_path: str, new_file_path: str) -> None:
     """
-    With input from the user, create a csv file to store metadata on data from data_path.
+    Create a csv file to store metadata on data from data_path.
     Specifically, this function is used to create a csv file to store the labels for the dataset.
 
     Arguments:
@@ -32,27 +113,8 @@ def create_csv(data_path: str, new_file_path: str) -> None:
     
     # Check if path exists.
     if os.path.exists(data_path):
-        # Create a new file.
-        with open(os.path.join(root, new_file_path), 'w', newline='') as file:
-            writer = csv.writer(file)
-            field = ["song_id", "mood", "valence", "arousal"]
-            writer.writerow(field)
-
-            # Open the data into a dataframe.
-            df = pd.read_csv(data_path)
-
-            # Go through each song and determine it's moode based on valence and arousal.
-            for i in range(len(df)):
-                valence = df.iloc[i, 1]
-                arousal = df.iloc[i, 3]
-                if valence >= 5:
-                    if arousal < 5: mood = "calm"
-                    else: mood = "happy"
-                else:
-                    if arousal < 5: mood = "sad"
-                    else: mood = "tense"
-                # Write the information into the new csv file.
-                writer.writerow([df.iloc[i, 0], mood, valence, arousal])
+        # Determine each song's mood based on valence and arousal.
+        create_mood_csv([data_path], new_file_path)
 
     # If it doesn't, don't do anything.
     else:
@@ -114,11 +176,14 @@ def display_csv(csv_file_path: str) -> None:
     
     # Check if path exists.
     if os.path.exists(new_file_path):
-        # Open the data into a dataframe.
-        df = pd.read_csv(new_file_path)
-
-        # Remove exluded values.
-        for num in exclude: df = df[df.song_id != num]
+        # Get the songs from the catalog (csv files that aren't lists of songs are shown as they are).
+        try:
+            catalog = catalog_for(csv_file_path)
+            df = catalog.frame(catalog.where())
+        except ValueError:
+            # When generating the spectograms, some audio files produced black images so exclude those images (see quality.py).
+            df = pd.read_csv(new_file_path)
+            df = df[~df.song_id.isin(load_exclude())]
         print(df)
 
     # If it doesn't, don't do anything.
@@ -143,40 +208,39 @@ def csv_stats(csv_file_path: str) -> None:
     
     # Check if path exists.
     if os.path.exists(new_file_path):
-        # Open the data into a dataframe.
-        df = pd.read_csv(new_file_path)
-
-        # Check for the right header.
-        if df.columns.values.tolist() == ['song_id', 'mood', 'valence', 'arousal']:
-            # Remove exluded values.
-            for num in exclude: df = df[df.song_id != num]
-            
-            # Seperate data frame by mood.
-            df_mood = df.groupby('mood')
-
-            # Print stats about groupings.
-            print("\nData Stats:")
-            print(f"There are {len(df_mood.get_group('happy'))} happy songs.")
-            print(f"There are {len(df_mood.get_group('sad'))} sad songs.")
-            print(f"There are {len(df_mood.get_group('tense'))} tense songs.")
-            print(f"There are {len(df_mood.get_group('calm'))} calm songs.")
-            print(f"There are a total of {len(df)} songs.\n")
-            print(f"Number of songs excluded: {len(exclude)}")
+        # Get the songs from the catalog (the number of songs of each mood type is already counted).
+        try:
+            counts = catalog_for(csv_file_path).class_counts()
         # Incorrect csv file.
-        else:
+        except ValueError:
             print(f"CSV file given [{csv_file_path}] does not have all the required headers of ['song_id', 'mood', 'valence', 'arousal'].")
+            return
+
+        # Print stats about groupings.
+        print("\nData Stats:")
+        print(f"There are {counts.get('happy', 0)} happy songs.")
+        print(f"There are {counts.get('sad', 0)} sad songs.")
+        print(f"There are {counts.get('tense', 0)} tense songs.")
+        print(f"There are {counts.get('calm', 0)} calm songs.")
+        print(f"There are a total of {sum(counts.values())} songs.\n")
+        print(f"Number of songs excluded: {len(load_exclude())}")
     # If it doesn't, don't do anything.
     else:
         print(f"File [{new_file_path}] doesn't exist")
 
 
     
-def train_val_split(csv_file_path: str) -> None:
+def train_val_split(csv_file_path: str, train_per_class: int = 200, seed: int = None, exclude_manifest: str = exclude_path) -> None:
     """
     Create csv files that seperates images into training set and validation set.
+    Every mood type gets train_per_class songs in the training set, and the same number of the left over songs
+    of each mood type (as many as the smallest mood type has left) go in the validation set.
     
     Arguments:
         csv_file_path (str): path to the csv file that contains all images and associated labels.
+        train_per_class (int): number of songs of each mood type in the training set.
+        seed (int): seed for choosing the songs (None gives a different split every time).
+        exclude_manifest (str): path to the exclusion manifest (read when the split is made).
     
     Return value: None
     """
@@ -185,65 +249,115 @@ def train_val_split(csv_file_path: str) -> None:
     
     # Check if path exists.
     if os.path.exists(new_file_path):
-        # Open the data into a dataframe.
-        df = pd.read_csv(new_file_path)
-
-        # Remove exluded values.
-        for num in exclude: df = df[df.song_id != num]
-
-        # Seperate df by mood type.
-        happy_df = df[df.mood == "happy"]
-        sad_df = df[df.mood == "sad"]
-        calm_df = df[df.mood == "calm"]
-        tense_df = df[df.mood == "tense"]
-        
-        sampled_happy = happy_df.sample(n=200)
-        extra_happy = happy_df[~happy_df.apply(tuple,1).isin(sampled_happy.apply(tuple,1))]
-
-        sampled_sad = sad_df.sample(n=200)
-        extra_sad = sad_df[~sad_df.apply(tuple,1).isin(sampled_sad.apply(tuple,1))]
-
-        sampled_calm = calm_df.sample(n=200)
-        extra_calm = calm_df[~calm_df.apply(tuple,1).isin(sampled_calm.apply(tuple,1))]
-        
-        sampled_tense = tense_df.sample(n=200)
-        extra_tense = tense_df[~tense_df.apply(tuple,1).isin(sampled_tense.apply(tuple,1))]
+        # Get the songs that aren't excluded from the catalog.
+        catalog = catalog_for(csv_file_path, exclude_manifest)
+        included = catalog.where()
+        df = catalog.frame(included)
+
+        # Shuffle the row positions of each mood type and take the training songs from the front.
+        rng = np.random.default_rng(seed)
+        moods = catalog.moods(included)
+        training_rows = []
+        extra_rows = []
+        for mood in np.unique(moods):
+            rows = rng.permutation(np.flatnonzero(moods == mood))
+            if len(rows) < train_per_class: raise ValueError(f"Mood type [{mood}] only has {len(rows)} songs, can't take {train_per_class}.")
+            training_rows.append(rows[:train_per_class])
+            extra_rows.append(rows[train_per_class:])
         
         # Establish base path.
         base_path = os.path.split(new_file_path)[0]
         
-        # Combine sampled dataframes for training.
-        training_frames = [sampled_happy, sampled_sad, sampled_calm, sampled_tense]
-        sampled_combined = pd.concat(training_frames).sort_values("song_id")
-        
         # Create training set csv file.  
         training_csv_path = os.path.join(base_path, "mood_training.csv")
-        sampled_combined.to_csv(training_csv_path, index=False)
+        df.iloc[np.concatenate(training_rows)].sort_values("song_id").to_csv(training_csv_path, index=False)
         print(f"Created training csv file at [{training_csv_path}]")
 
-        # Get samples of validation data from the extra songs not included in training.
-        min_n = min(len(extra_happy), len(extra_calm), len(extra_sad), len(extra_tense))
-        val_happy = extra_happy.sample(n=min_n)
-        val_sad = extra_sad.sample(n=min_n)
-        val_calm = extra_calm.sample(n=min_n)
-        val_tense = extra_tense.sample(n=min_n)
-        
-        # Combine sampled dataframes for validation.
-        val_frames = [val_calm, val_happy, val_sad, val_tense]
-        val_combined = pd.concat(val_frames).sort_values("song_id")
+        # Get samples of validation data from the extra songs not included in training (already shuffled).
+        min_n = min(len(rows) for rows in extra_rows)
+        val_rows = np.concatenate([rows[:min_n] for rows in extra_rows])
 
         # Create validation set csv file.  
         val_csv_path = os.path.join(base_path, "mood_validation.csv")
-        val_combined.to_csv(val_csv_path, index=False)
+        df.iloc[val_rows].sort_values("song_id").to_csv(val_csv_path, index=False)
         print(f"Created validation csv file at [{val_csv_path}]")
     # If it doesn't, don't do anything.
     else:
         print(f"File [{new_file_path}] doesn't exist")
 
+
+def stratified_split(csv_file_path: str, split_file_path: str = None, n_folds: int = 5, test_size: float = 0.1, seed: int = 0, exclude_manifest: str = exclude_path) -> None:
+    """
+    Split the songs into a held-out test set and n_folds folds (for k-fold cross validation) in one pass.
+    Every mood type (whatever mood types the csv file has) is split in the same proportions.
+    Instead of copying the csv file for each split, a split index file with headers [song_id, fold] is written,
+    where fold is -1 for the test set and 0 to n_folds - 1 otherwise.
+
+    Arguments:
+        csv_file_path (str): path to the csv file that contains all images and associated labels.
+        split_file_path (str): path of the split index file (defaults to mood_splits.csv next to csv_file_path).
+        n_folds (int): number of folds.
+        test_size (float): fraction of each mood type held out for testing.
+        seed (int): seed for the split (the same seed always gives the same split).
+        exclude_manifest (str): path to the exclusion manifest (read when the split is made).
+
+    Return value: None
+    """
+    # Merge csv_file_path with root.
+    new_file_path = os.path.join(root, csv_file_path)
+
+    # Check if path exists.
+    if os.path.exists(new_file_path):
+        # Get the songs that aren't excluded from the catalog.
+        catalog = catalog_for(csv_file_path, exclude_manifest)
+        included = catalog.where()
+        df = catalog.frame(included)
+
+        # Give every row position of each mood type a fold.
+        rng = np.random.default_rng(seed)
+        moods = catalog.moods(included)
+        folds = np.empty(len(df), dtype=np.int64)
+        offset = 0
+        for mood in np.unique(moods):
+            rows = rng.permutation(np.flatnonzero(moods == mood))
+            n_test = int(round(len(rows) * test_size))
+            folds[rows[:n_test]] = -1
+            # Deal the rest out to the folds, continuing where the last mood type stopped so folds stay even.
+            folds[rows[n_test:]] = (np.arange(len(rows) - n_test) + offset) % n_folds
+            offset += len(rows) - n_test
+
+        # Create the split index file.
+        if split_file_path is None: split_file_path = os.path.join(os.path.split(new_file_path)[0], "mood_splits.csv")
+        else: split_file_path = os.path.join(root, split_file_path)
+        splits = pd.DataFrame({"song_id": df.song_id.to_numpy(), "fold": folds}).sort_values("song_id")
+        splits.to_csv(split_file_path, index=False)
+        print(f"Created split index file at [{split_file_path}]")
+    # If it doesn't, don't do anything.
+    else:
+        print(f"File [{new_file_path}] doesn't exist")
+
+
+def split_song_ids(split_file_path: str, folds: list) -> np.ndarray:
+    """
+    Get the song ids in some folds of a split index file made by stratified_split.
+    For example, folds=[-1] gives the test set and folds=[1, 2, 3, 4] the training set when fold 0 is for validation.
+
+    Arguments:
+        split_file_path (str): path to the split index file.
+        folds (list): folds to get the song ids of.
+
+    Return value: np.ndarray of song ids.
+    """
+    splits = pd.read_csv(os.path.join(root, split_file_path))
+    return splits.song_id.to_numpy()[splits.fold.isin(folds).to_numpy()]
+
 if __name__ == "__main__":
     csv_path = "data/DEAM_Annotations/annotations averaged per song/song_level/static_annotations_averaged_songs_1_2000.csv"
+    csv_path_2000 = "data/DEAM_Annotations/annotations averaged per song/song_level/static_annotations_averaged_songs_2000_2058.csv"
     new_csv_path = "data/mood.csv"
     # display_csv(csv_path)
     # create_csv(csv_path, new_csv_path)
+    # create_mood_csv([csv_path, csv_path_2000], new_csv_path)
     csv_stats(new_csv_path)
-    # train_val_split(new_csv_path)
+    # train_val_split(new_csv_path, seed=0)
+    # stratified_split(new_csv_path, n_folds=5, seed=0)
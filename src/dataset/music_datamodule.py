@@ -4,17 +4,17 @@ https://lightning.ai/docs/pytorch/stable/data/datamodule.html#using-a-datamodule
 """
 import os
 import sys
-import pyprojroot
+import pathlib
 import pytorch_lightning as pl
 from torch.utils.data import DataLoader
-import torchvision.transforms as transforms
 from pytorch_lightning.utilities.types import EVAL_DATALOADERS, TRAIN_DATALOADERS
 
-# Make it to where paths only need to be from the repo folder.
-root = pyprojroot.find_root(pyprojroot.has_dir(".git"))
-sys.path.append(str(root))
+# Make it to where paths only need to be from the repo folder (the root is found once, in paths.py).
+if not __package__: sys.path.append(str(pathlib.Path(__file__).resolve().parents[2]))
+from src.dataset.paths import root
 
 from src.dataset.music_dataset import MusicDataset
+from src.dataset.sharding import ShardSampler, shard_rank, csv_song_ids, shard_song_ids
 
  
 class MusicDataModule(pl.LightningDataModule):
@@ -27,7 +27,15 @@ class MusicDataModule(pl.LightningDataModule):
                  test_dir: str,
                  transforms,
                  batch_size: int = 4,
-                 num_workers: int = 1):
+                 num_workers: int = 1,
+                 data_format: str = "png",
+                 cache_bytes: int = 0,
+                 cache_transforms = None,
+                 profile: bool = False,
+                 bake_dir: str = None,
+                 shard: bool = False,
+                 seed: int = 0,
+                 batch_augment = None):
         """
         PyTorch Lightning Data Module for setting up training, testing, and validation datasets/dataloaders.
 
@@ -41,6 +49,18 @@ class MusicDataModule(pl.LightningDataModule):
             transforms: Transforms to apply to the images.
             batch_size (int): The batch size to use for the DataLoader.
             num_workers (int): The number of workers to use for the DataLoader.
+            data_format (str): "png" if the directories contain png images, "packed" if they are SpectogramStore paths,
+                               "features" if they contain float16 features from features.py.
+            cache_bytes (int): Byte budget of the shared-memory cache of each dataset (0 for no cache).
+            cache_transforms: Deterministic transforms applied to the images before they are cached.
+            profile (bool): Time each stage of loading a sample (see StageTimingCallback to log it every epoch).
+            bake_dir (str): Directory to store the outputs of the deterministic transforms in (None to run them every time).
+            shard (bool): Give every rank (process) its own shard of the songs (see sharding.py), so each one only
+                          indexes and reads its part of the data. Use it with Trainer(use_distributed_sampler=False),
+                          and reload_dataloaders_every_n_epochs=1 to deal the training songs out again every epoch.
+            seed (int): Seed for dealing out the shards and shuffling them every epoch (the same on every rank).
+            batch_augment: A BatchAugment (see augment.py) applied to every collated training batch (None for no
+                           augmentation). It needs transforms that return float tensors.
         """
         super().__init__()
         self.train_csv = os.path.join(root, train_csv_file)
@@ -52,6 +72,18 @@ class MusicDataModule(pl.LightningDataModule):
         self.batch_size = batch_size
         self.num_workers = num_workers
         self.transforms = transforms
+        self.data_format = data_format
+        self.cache_bytes = cache_bytes
+        self.cache_transforms = cache_transforms
+        self.profile = profile
+        self.bake_dir = bake_dir
+        self.shard = shard
+        self.seed = seed
+        self.batch_augment = batch_augment
+        # Rank, world size, epoch and samples per epoch of the shard of each stage.
+        self.shards = {}
+        # Epoch the training shard is dealt out for (the training dataloader sets it).
+        self.shard_epoch = 0
     
         
     def setup(self, stage: str) -> None:
@@ -62,32 +94,89 @@ class MusicDataModule(pl.LightningDataModule):
             # Create the MusicDataset object for the training data.
             self.train_MusicDataset = MusicDataset(csv_file_path = self.train_csv,
                                                    data_dir = self.train_dir,
-                                                   transforms= self.transforms)
+                                                   transforms= self.transforms,
+                                                   data_format = self.data_format,
+                                                   cache_bytes = self.cache_bytes,
+                                                   cache_transforms = self.cache_transforms,
+                                                   profile = self.profile,
+                                                   bake_dir = self.bake_dir,
+                                                   song_ids = self._shard_song_ids(stage, self.train_csv))
 
         if stage == "validate":
             # Create the MusicDataset object for the validation data.
             self.validate_MusicDataset = MusicDataset(csv_file_path = self.val_csv,
                                                       data_dir = self.val_dir,
-                                                      transforms= self.transforms)
+                                                      transforms= self.transforms,
+                                                      data_format = self.data_format,
+                                                      cache_bytes = self.cache_bytes,
+                                                      cache_transforms = self.cache_transforms,
+                                                      profile = self.profile,
+                                                      bake_dir = self.bake_dir,
+                                                      song_ids = self._shard_song_ids(stage, self.val_csv))
             
         if stage == "test":
             # Create the MusicDataset object for the test data.
             self.test_MusicDataset = MusicDataset(csv_file_path = self.test_csv,
                                                   data_dir = self.test_dir,
-                                                  transforms= self.transforms)
+                                                  transforms= self.transforms,
+                                                  data_format = self.data_format,
+                                                  cache_bytes = self.cache_bytes,
+                                                  cache_transforms = self.cache_transforms,
+                                                  profile = self.profile,
+                                                  bake_dir = self.bake_dir,
+                                                  song_ids = self._shard_song_ids(stage, self.test_csv))
+
+
+    def _shard_song_ids(self, stage: str, csv_file_path: str):
+        """
+        Returns the song ids of this rank's shard of a csv file (None when not sharding).
+        """
+        if not self.shard: return None
+        rank, world_size = shard_rank(self.trainer)
+        # Only the training songs are dealt out again every epoch.
+        epoch = self.shard_epoch if stage == "train" else 0
+        song_ids = csv_song_ids(csv_file_path)
+        self.shards[stage] = (rank, world_size, epoch, -(-len(song_ids) // world_size))
+        return shard_song_ids(song_ids, rank, world_size, self.seed, epoch)
+
+
+    def _collate(self, stage: str):
+        """
+        Returns the collate function of a stage's dataloader (only training batches are augmented).
+        """
+        return self.batch_augment.collate if stage == "train" and self.batch_augment is not None else None
+
+
+    def _sharded_dataloader(self, stage: str, shuffle: bool) -> DataLoader:
+        """
+        Returns a dataloader of this rank's shard of a stage, with a ShardSampler.
+        """
+        # Deal the training songs out for the current epoch (Lightning only asks for a new training dataloader every
+        # epoch with reload_dataloaders_every_n_epochs=1, otherwise the shards of the first epoch are kept).
+        if stage == "train" and self.trainer is not None: self.shard_epoch = self.trainer.current_epoch
+        epoch = self.shard_epoch if stage == "train" else 0
+        # The ranks are only known for sure once the processes are connected, which can be after setup was called.
+        if self.shards.get(stage, (None,) * 3)[:3] != (*shard_rank(self.trainer), epoch): self.setup(stage)
+        dataset = getattr(self, f"{stage}_MusicDataset")
+        sampler = ShardSampler(len(dataset), self.shards[stage][3], shuffle=shuffle, seed=self.seed)
+        return DataLoader(dataset, batch_size=self.batch_size, sampler=sampler, collate_fn=self._collate(stage),
+                          num_workers=self.num_workers, persistent_workers=True)
 
 
     def train_dataloader(self) -> TRAIN_DATALOADERS:
         """
         Returns the training dataloader.
         """
-        return DataLoader(self.train_MusicDataset, batch_size=self.batch_size, num_workers=self.num_workers, persistent_workers=True)
+        if self.shard: return self._sharded_dataloader("train", shuffle=True)
+        return DataLoader(self.train_MusicDataset, batch_size=self.batch_size, collate_fn=self._collate("train"),
+                          num_workers=self.num_workers, persistent_workers=True)
     
 
     def val_dataloader(self) -> EVAL_DATALOADERS:
         """
         Returns the validation dataloader.
         """
+        if self.shard: return self._sharded_dataloader("validate", shuffle=False)
         return DataLoader(self.validate_MusicDataset, batch_size=self.batch_size, num_workers=self.num_workers, persistent_workers=True)
     
 
@@ -95,10 +184,59 @@ class MusicDataModule(pl.LightningDataModule):
         """
         Returns the test dataloader.
         """
+        if self.shard: return self._sharded_dataloader("test", shuffle=False)
         return DataLoader(self.test_MusicDataset, batch_size=self.batch_size, num_workers=self.num_workers, persistent_workers=True)
 
 
+class StageTimingCallback(pl.Callback):
+    """
+    Logs how long each stage of loading the training samples took during the epoch (the StageTimer of a training
+    dataset made with profile=True), next to the training metrics.
+
+    Args:
+        print_summary (bool): Also print a table of the stages at the end of every epoch.
+    """
+
+    def __init__(self, print_summary: bool = False) -> None:
+        super().__init__()
+        self.print_summary = print_summary
+
+
+    def _timer(self, trainer):
+        """
+        Returns the StageTimer of the training dataset (None if it isn't profiled).
+        """
+        dataset = getattr(trainer.datamodule, "train_MusicDataset", None)
+        if dataset is None and trainer.train_dataloader is not None: dataset = getattr(trainer.train_dataloader, "dataset", None)
+        return getattr(dataset, "timer", None)
+
+
+    def on_train_epoch_start(self, trainer, pl_module) -> None:
+        """
+        Start each epoch's timings from 0.
+        """
+        timer = self._timer(trainer)
+        if timer is not None: timer.reset()
+
+
+    def on_train_epoch_end(self, trainer, pl_module) -> None:
+        """
+        Log the mean time (ms), 95th percentile (ms) and share of the loading time of every stage.
+        """
+        timer = self._timer(trainer)
+        if timer is None: return
+        metrics = {}
+        for stage, row in timer.summary().items():
+            metrics[f"data_time/{stage}_mean_ms"] = row["mean_ms"]
+            metrics[f"data_time/{stage}_p95_ms"] = row["p95_ms"]
+            metrics[f"data_time/{stage}_fraction"] = row["fraction"]
+        if metrics: pl_module.log_dict(metrics, on_step=False, on_epoch=True)
+        if self.print_summary: timer.print_summary()
+
+
 if __name__ == "__main__":
+    import torchvision.transforms as transforms
+
     # Create Paths (without root) to specific locations. 
     train_csv_file = "data/mood_training.csv"
     train_dir = "data/spectograms"
@@ -3,20 +3,20 @@ Custom PyTorch Dataset class for the spectogram/music data.
 """
 import os
 import sys
-import cv2
 import torch
-import pyprojroot
+import pathlib
 import numpy as np
-import pandas as pd
-import torchvision.transforms as transforms
-import matplotlib.pyplot as plt
 
-# Make it to where paths only need to be from the repo folder.
-root = pyprojroot.find_root(pyprojroot.has_dir(".git"))
-sys.path.append(str(root))
+# Make it to where paths only need to be from the repo folder (the root is found once, in paths.py).
+if not __package__: sys.path.append(str(pathlib.Path(__file__).resolve().parents[2]))
+from src.dataset.paths import root
 
-# When generating the spectograms, some audio files produced black images so exclude those images.
-exclude = [137, 146, 187, 206, 236, 449, 488, 621, 646, 661, 707, 1016, 1109, 1134, 1142, 1161, 1167, 1171, 1184, 1429]
+from src.dataset.spectogram_store import SpectogramStore
+from src.dataset.sample_cache import SharedSampleCache
+from src.dataset.profiling import StageTimer, stage, transform_stages, max_workers
+from src.dataset.transform_cache import bake_transforms
+from src.dataset.catalog import catalog_for, moods
+from src.dataset.quantized import load_quantized
 
 
 class MusicDataset(torch.utils.data.Dataset):
@@ -25,28 +25,84 @@ class MusicDataset(torch.utils.data.Dataset):
 
     args:
         csv_file_path (str): path to a csv file.
-        data_dir (str): directory where the data associated with the csv file is stored.
+        data_dir (str): directory where the data associated with the csv file is stored
+                        (or the path of the store when data_format is "packed").
+        transforms: transforms to apply to the images (if None, the images are returned as uint8 tensors).
+        data_format (str): "png" to read the images in data_dir, "packed" to read them from a SpectogramStore,
+                           "features" to read single-channel float16 features (<song_id>.npy from features.py),
+                           "quantized" to read quantized spectograms (<song_id>.npz from quantized.py) as float32 decibels.
+        cache_bytes (int): byte budget of a cache of loaded images shared by all DataLoader workers (0 for no cache).
+        cache_transforms: deterministic transforms (ex: Resize) applied before an image is cached,
+                          transforms are applied after.
+        song_ids: only use these songs from the csv file (ex: from data_utils.split_song_ids), None for all of them.
+        profile (bool): time each stage of fetching a sample (cache lookup, read, each transform, label) in a
+                        StageTimer (self.timer) shared by all DataLoader workers.
+        bake_dir (str): if given, the deterministic transforms at the start of transforms (ex: Resize, ToTensor) are
+                        run once for every sample and their outputs are stored in bake_dir (see transform_cache.py),
+                        only the transforms after them run when a sample is fetched.
     """
 
-    def __init__(self, csv_file_path: str, data_dir: str, transforms) -> None:
+    def __init__(self, csv_file_path: str, data_dir: str, transforms = None, data_format: str = "png",
+                 cache_bytes: int = 0, cache_transforms = None, song_ids = None, profile: bool = False,
+                 bake_dir: str = None) -> None:
         """
         Constructor for MusicDataset class.
         """    
         # Save the location of the data (in other words, the spectograms.)
         self.data_dir = os.path.join(root, data_dir)
         self.csv = csv_file_path
+        self.data_format = data_format
 
-        # Merge root and csv_file_path and read csv file.
-        self.df = pd.read_csv(os.path.join(root, csv_file_path))
+        # Packed spectograms are memory-mapped instead of decoded from a png each time.
+        if data_format == "packed": self.store = SpectogramStore(self.data_dir)
+        elif data_format in ("png", "features", "quantized"): self.store = None
+        else: raise ValueError(f"Data format [{data_format}] is not one of ['png', 'packed', 'features', 'quantized'].")
+
+        # Get the songs of the csv file from the catalog (read once, see catalog.py).
+        catalog = catalog_for(csv_file_path)
 
         # Save transforms.
         self.transforms = transforms
         
-        # Remove exluded values.
-        for num in exclude: self.df = self.df[self.df.song_id != num]
-
-        # One-hot encode the mood type for classification task.
-        self.df = pd.get_dummies(self.df, columns=["mood"])
+        # Remove exluded values and keep only the songs of a split.
+        self.catalog = catalog.subset(catalog.where(song_ids=song_ids))
+
+        # Check that every mood type is one the labels know about.
+        unknown = {mood for mood, count in self.catalog.class_counts().items() if count > 0} - set(moods)
+        if unknown: raise ValueError(f"CSV file [{csv_file_path}] has unknown mood types {sorted(unknown)}, expected {moods}.")
+
+        # Store what __getitem__ needs as arrays so fetching a sample doesn't touch the catalog.
+        self.song_ids = self.catalog["song_id"].astype(np.int64)
+        extension = {"features": ".npy", "quantized": ".npz"}.get(data_format, ".png")
+        self.img_paths = self.catalog.spectogram_paths(data_dir=self.data_dir, extension=extension)
+
+        # One-hot encode the mood type for classification task (the mood codes of the catalog are in the order of moods).
+        self.labels = torch.from_numpy(np.eye(len(moods), dtype=np.float32)[self.catalog["mood"]])
+
+        # Run the deterministic transforms ahead of time (or reuse their outputs if nothing changed).
+        self.cache_transforms = cache_transforms
+        self.timer = None
+        self.baked = None
+        if bake_dir is not None:
+            self.baked, self.transforms = bake_transforms(self._load, self.song_ids, transforms, bake_dir,
+                                                          source=f"{data_format}:{self.data_dir}",
+                                                          cached_steps=[step for _, step in transform_stages(cache_transforms)],
+                                                          source_files=self._source_files())
+            transforms = self.transforms
+
+        # Time every stage (and every transform on its own) when profiling.
+        if profile:
+            self._cache_steps = transform_stages(cache_transforms)
+            self._steps = transform_stages(transforms)
+            stages = ["cache", "read"] + [f"cached_{name}" for name, _ in self._cache_steps] + [name for name, _ in self._steps] + ["label"]
+            self.timer = StageTimer(stages, num_slots=max_workers + 1, shared=True)
+
+        # Cache loaded images in shared memory, with slots the size of the first image after cache_transforms (images
+        # that come out bigger are counted in self.cache.stats()["too_big"] and not cached).
+        self.cache = None
+        if cache_bytes > 0 and len(self) > 0 and self.baked is None:
+            self.cache = SharedSampleCache(len(self), cache_bytes, self._load(0).nbytes)
+            if self.timer is not None: self.timer.reset()
     
 
     def print_df(self) -> None:
@@ -54,7 +110,7 @@ class MusicDataset(torch.utils.data.Dataset):
         Print the current dataframe of the data based on the given csv file.
         """
         print(f"\nCurrent dataframe based on [{self.csv}]")
-        print(self.df)
+        print(self.catalog.frame())
 
 
     def __len__(self) -> int:
@@ -63,7 +119,39 @@ class MusicDataset(torch.utils.data.Dataset):
 
         Return value: int
         """
-        return len(self.df)
+        return len(self.song_ids)
+
+
+    def _source_files(self) -> list:
+        """
+        Returns the files the samples are read from (the store's data and index when packed, else every sample's file).
+        """
+        if self.store is not None: return [self.data_dir + ".bin", self.data_dir + ".csv"]
+        return list(self.img_paths)
+
+
+    def _load(self, idx: int) -> np.ndarray:
+        """
+        Loads the spectogram at the given index and applies cache_transforms to it.
+
+        Args:
+            idx (int): index of the image (spectogram) to load
+
+        Return value: np.ndarray of image.
+        """
+        with stage(self.timer, "read"):
+            if self.store is not None: img = self.store[self.song_ids[idx]]
+            elif self.data_format == "features": img = np.load(self.img_paths[idx])
+            elif self.data_format == "quantized": img = load_quantized(self.img_paths[idx])
+            else:
+                import cv2
+                img = cv2.imread(self.img_paths[idx], cv2.IMREAD_COLOR)
+        if self.cache_transforms is None: return img
+
+        if self.timer is None: return self.cache_transforms(img)
+        for name, step in self._cache_steps:
+            with self.timer.time(f"cached_{name}"): img = step(img)
+        return img
 
 
     def __getitem__(self, idx) -> (torch.Tensor, torch.Tensor):
@@ -73,28 +161,32 @@ class MusicDataset(torch.utils.data.Dataset):
         Args:
             idx (int): index of the image (spectogram) to fetch
 
-        Return value: torch.Tensor of image str of mood type.
+        Return value: torch.Tensor of image and torch.Tensor of one hot encoded mood type.
         """
-        # Get the spectogram at the given index (idx).
-        row = self.df.iloc[idx]
-        img_fname = row["song_id"]
-        img_file_path = os.path.join(self.data_dir, f"{img_fname}.png")
-        img = self.transforms(cv2.imread(img_file_path, cv2.IMREAD_COLOR))
-
-        # Fetch one hot encoded labels for all classes of mood type as a Series
-        mood_type_tensor = row[['mood_calm', 'mood_happy', 'mood_sad', 'mood_tense']]
-
-        # Convert Series to numpy array
-        mood_type_tensor = mood_type_tensor.to_numpy().astype(np.bool_)
-        
-        # Convert One Hot Encoded labels to tensor
-        mood_type_tensor = torch.from_numpy(mood_type_tensor)
-        
-        # Convert tensor data type to Float
-        moood_type_tensor = mood_type_tensor.type(torch.FloatTensor)
-        
-        # Return the image and associated mood type label.
-        return img, moood_type_tensor
+        # Get the spectogram at the given index (idx), from the cache if it is there.
+        img = None
+        if self.baked is not None:
+            with stage(self.timer, "read"): img = self.baked[self.song_ids[idx]]
+        elif self.cache is not None:
+            with stage(self.timer, "cache"): img = self.cache.get(idx)
+        if img is None:
+            img = self._load(idx)
+            if self.cache is not None:
+                with stage(self.timer, "cache"): self.cache.put(idx, img)
+
+        # Without transforms, return the image as it is (a view of the memory map when packed, with a channel
+        # dimension in front for features and quantized spectograms).
+        if self.transforms is None:
+            if not torch.is_tensor(img): img = torch.from_numpy(img)
+            if self.data_format in ("features", "quantized") and self.baked is None: img = img.unsqueeze(0)
+        elif self.timer is None: img = self.transforms(img)
+        else:
+            for name, step in self._steps:
+                with self.timer.time(name): img = step(img)
+
+        # Return the image and associated mood type label (one hot encoded in the order of moods).
+        with stage(self.timer, "label"): label = self.labels[idx]
+        return img, label
 
 # Augmentation for transforms.
 class Resize(object):
@@ -110,6 +202,9 @@ class Resize(object):
             img (np.ndarray): image to be resized.
         Return value: torch.Tensor of resized image.
         """
+        import cv2
+        # OpenCV can't resize float16 (features), so resize them as float32.
+        if img.dtype == np.float16: img = img.astype(np.float32)
         img_resized = cv2.resize(img,
                                  (self.resize_width, self.resize_height),
                                  interpolation = cv2.INTER_LINEAR)
@@ -117,6 +212,8 @@ class Resize(object):
 
 
 if __name__ == "__main__":
+    import torchvision.transforms as transforms
+
     # Data directory.
     csv_path = "data/mood.csv"
     data_dir = "data/spectograms"
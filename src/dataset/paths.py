@@ -0,0 +1,16 @@
+"""
+The root of the repository (the folder with .git), found once per process.
+
+Every other module gets root from here, so the repository is only searched for once no matter how many modules are
+imported, and it is found from where this file is (not the working directory).
+"""
+
+import pathlib
+import pyprojroot
+
+# Make it to where paths only need to be from the repo folder.
+root = pyprojroot.find_root(pyprojroot.has_dir(".git"), start=pathlib.Path(__file__).resolve().parent)
+
+# Annotation files of the DEAM dataset (songs 1-2000 and 2000-2058) that the mood labels are made from.
+annotation_paths = ["data/DEAM_Annotations/annotations averaged per song/song_level/static_annotations_averaged_songs_1_2000.csv",
+                    "data/DEAM_Annotations/annotations averaged per song/song_level/static_annotations_averaged_songs_2000_2058.csv"]
@@ -0,0 +1,219 @@
+"""
+A producer/consumer pipeline with three stages: decode (thread pool), compute (process pool) and write (thread pool).
+
+The stages are connected by bounded queues, so decoding can only get queue_size items ahead of the computation and
+finished items can't pile up in memory while the disk catches up. While one file is being decoded, others are
+being computed and written, so the disk and every CPU are busy at the same time.
+"""
+
+import time
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Marks the end of a queue.
+_done = object()
+
+
+class PipelineProgress(object):
+    """
+    Counts how many items each stage finished and how long it was busy, and prints a line with the throughput
+    of every stage at most every report_interval seconds.
+
+    args:
+        stages (list): names of the stages.
+        total (int): number of items going through the pipeline.
+        report_interval (float): seconds between progress lines (None to never print).
+    """
+
+    def __init__(self, stages: list, total: int, report_interval: float = 5.0) -> None:
+        """
+        Constructor for PipelineProgress class.
+        """
+        self.stages = list(stages)
+        self.total = total
+        self.report_interval = report_interval
+        self.counts = {name: 0 for name in self.stages}
+        self.busy = {name: 0.0 for name in self.stages}
+        self.finished = 0
+        self.failed = 0
+        self.start = time.perf_counter()
+        self.last_report = self.start
+        self.lock = threading.Lock()
+
+
+    def add(self, stage: str, seconds: float) -> None:
+        """
+        Record that a stage finished an item in the given number of seconds (called from any thread).
+        """
+        with self.lock:
+            self.counts[stage] += 1
+            self.busy[stage] += seconds
+
+
+    def line(self) -> str:
+        """
+        Returns the progress of every stage as one line (count and items per second since the start).
+        """
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        with self.lock:
+            stages = " | ".join(f"{name} {self.counts[name]} ({self.counts[name] / elapsed:.2f}/s)" for name in self.stages)
+        return f"[{self.finished}/{self.total}] {stages} | failed {self.failed} | {elapsed:.1f}s"
+
+
+    def finish(self, failed: bool) -> None:
+        """
+        Record that an item made it out of the pipeline and print the progress if it is time to.
+        """
+        self.finished += 1
+        self.failed += failed
+        now = time.perf_counter()
+        if self.report_interval is not None and (now - self.last_report >= self.report_interval or self.finished == self.total):
+            self.last_report = now
+            print(self.line())
+
+
+    def summary(self) -> dict:
+        """
+        Returns the number of items, items per second and busy seconds (added up over every worker) of each stage.
+        """
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        return {name: {"items": self.counts[name], "items_per_sec": self.counts[name] / elapsed, "busy_s": self.busy[name]}
+                for name in self.stages}
+
+
+def check_pipeline_sizes(decode_workers: int, compute_workers: int, write_workers: int, queue_size: int) -> None:
+    """
+    Make sure every stage of run_pipeline has a worker and the queues can hold an item (otherwise nothing ever moves
+    through the stage and the pipeline waits forever).
+
+    Arguments:
+        decode_workers (int): number of decode threads.
+        compute_workers (int): number of compute processes.
+        write_workers (int): number of write threads.
+        queue_size (int): most items that can wait between two stages.
+
+    Return value: None, raises a ValueError if any of them is below 1.
+    """
+    sizes = {"decode_workers": decode_workers, "compute_workers": compute_workers,
+             "write_workers": write_workers, "queue_size": queue_size}
+    for name, size in sizes.items():
+        if size < 1: raise ValueError(f"{name} [{size}] has to be at least 1.")
+
+
+def run_pipeline(items: list, decode, compute, write, decode_workers: int = 2, compute_workers: int = 1,
+                 write_workers: int = 2, queue_size: int = 8, stages: list = ["decode", "compute", "write"],
+                 report_interval: float = 5.0):
+    """
+    Send every item through decode (threads), compute (processes) and write (threads).
+
+    Arguments:
+        items (list): items to process.
+        decode: function of an item that returns what compute needs (runs in a thread, ex: reading a file).
+        compute: function of what decode returned that returns what write needs (runs in a process, so it has to be
+                 defined at the top level of a module).
+        write: function of an item and what compute returned that returns the result (runs in a thread).
+        decode_workers (int): number of decode threads.
+        compute_workers (int): number of compute processes.
+        write_workers (int): number of write threads.
+        queue_size (int): most items that can wait between two stages (and be computed at the same time).
+        stages (list): names of the three stages (used in the progress lines).
+        report_interval (float): seconds between progress lines (None to never print).
+
+    Return value: generator of (item, result, error) in the order the items finish, error is None unless a stage raised
+                  an exception (then result is None). It runs in the thread that iterates over it.
+                  Raises a ValueError right away if a worker count or queue_size is below 1.
+    """
+    # Checked here, not in the generator, so bad sizes fail when it is called instead of on the first item.
+    check_pipeline_sizes(decode_workers, compute_workers, write_workers, queue_size)
+    return _run_pipeline(items, decode, compute, write, decode_workers, compute_workers, write_workers, queue_size,
+                         stages, report_interval)
+
+
+def _run_pipeline(items: list, decode, compute, write, decode_workers: int, compute_workers: int,
+                  write_workers: int, queue_size: int, stages: list, report_interval: float):
+    """
+    The generator behind run_pipeline (the sizes are already checked).
+    """
+    progress = PipelineProgress(stages, len(items), report_interval)
+    todo = queue.Queue()
+    decoded = queue.Queue(maxsize=queue_size)
+    computed = queue.Queue()
+    finished = queue.Queue()
+    # Items being computed or waiting to be written (so results can't pile up in memory).
+    in_flight = threading.Semaphore(queue_size)
+    stop = threading.Event()
+
+    for item in items: todo.put(item)
+    for _ in range(decode_workers): todo.put(_done)
+
+    def decoder() -> None:
+        while True:
+            item = todo.get()
+            if item is _done or stop.is_set(): break
+            start = time.perf_counter()
+            try:
+                payload = decode(item)
+            except Exception as e:
+                finished.put((item, None, e))
+                continue
+            progress.add(stages[0], time.perf_counter() - start)
+            decoded.put((item, payload))
+        decoded.put(_done)
+
+    def dispatcher(executor) -> None:
+        # Hand decoded items to the process pool, never more than queue_size at once.
+        remaining = decode_workers
+        while remaining > 0:
+            entry = decoded.get()
+            if entry is _done:
+                remaining -= 1
+                continue
+            item, payload = entry
+            in_flight.acquire()
+            submitted = time.perf_counter()
+            try:
+                future = executor.submit(compute, payload)
+            except Exception as e:
+                in_flight.release()
+                finished.put((item, None, e))
+                continue
+            future.add_done_callback(lambda future, item=item, submitted=submitted: computed.put((item, future, submitted)))
+
+    def writer() -> None:
+        while True:
+            entry = computed.get()
+            if entry is _done: break
+            item, future, submitted = entry
+            try:
+                payload = future.result()
+                progress.add(stages[1], time.perf_counter() - submitted)
+                start = time.perf_counter()
+                result = write(item, payload)
+                progress.add(stages[2], time.perf_counter() - start)
+                finished.put((item, result, None))
+            except Exception as e:
+                finished.put((item, None, e))
+            finally:
+                in_flight.release()
+
+    with ProcessPoolExecutor(max_workers=compute_workers) as executor:
+        threads = [threading.Thread(target=decoder, daemon=True) for _ in range(decode_workers)]
+        threads.append(threading.Thread(target=dispatcher, args=(executor,), daemon=True))
+        writers = [threading.Thread(target=writer, daemon=True) for _ in range(write_workers)]
+        for thread in threads + writers: thread.start()
+        try:
+            for _ in range(len(items)):
+                item, result, error = finished.get()
+                progress.finish(error is not None)
+                yield item, result, error
+        finally:
+            # Stop decoding new items if the caller stops early, then let the threads finish.
+            stop.set()
+            for thread in threads: thread.join()
+            executor.shutdown(wait=True)
+            for _ in writers: computed.put(_done)
+            for thread in writers: thread.join()
+    if report_interval is not None:
+        for name, row in progress.summary().items():
+            print(f"{name}: {row['items']} items, {row['items_per_sec']:.2f} items/s, busy for {row['busy_s']:.1f}s")
@@ -0,0 +1,226 @@
+"""
+Opt-in timing of the stages of spectogram generation and sample loading.
+
+A StageTimer counts how often each stage ran, how long it took in total and a histogram of how long each run took.
+Timers shared with DataLoader workers keep one row per worker in shared memory (so recording never waits on a lock),
+timers in other processes are sent back as snapshots and merged.
+"""
+
+import os
+import sys
+import time
+import contextlib
+import numpy as np
+
+# Stages of generating a spectogram image.
+generation_stages = ["decode", "stft", "db", "render", "write"]
+
+# Most DataLoader workers that get their own row of counters in a shared timer.
+max_workers = 64
+
+# Histogram bins: bin 0 is under 1 microsecond, bin i is [2^(i-1), 2^i) microseconds, the last bin has the rest.
+num_bins = 28
+
+
+def _bin(elapsed_ns: int) -> int:
+    """
+    Returns the histogram bin of a duration in nanoseconds.
+    """
+    return min((elapsed_ns // 1000).bit_length(), num_bins - 1)
+
+
+def _bin_ms(bin: int) -> float:
+    """
+    Returns the upper edge of a histogram bin in milliseconds.
+    """
+    return 2 ** bin / 1000
+
+
+class StageTimer(object):
+    """
+    Counts, total time and a latency histogram for each stage of a pipeline.
+
+    args:
+        stages (list): names of the stages.
+        num_slots (int): rows of counters, row 0 for the main process and row i + 1 for DataLoader worker i
+                         (workers past the last row share it).
+        shared (bool): keep the counters in shared memory so DataLoader workers add to the same timer.
+    """
+
+    def __init__(self, stages: list, num_slots: int = 1, shared: bool = False) -> None:
+        """
+        Constructor for StageTimer class.
+        """
+        self.stages = list(stages)
+        self.index = {stage: i for i, stage in enumerate(self.stages)}
+        self.num_slots = max(1, num_slots)
+        shapes = [(self.num_slots, len(self.stages)), (self.num_slots, len(self.stages)), (self.num_slots, len(self.stages), num_bins)]
+
+        # Shared counters are torch tensors (they are passed to the workers through shared memory).
+        if shared:
+            import torch
+            self._tensors = [torch.zeros(shape, dtype=torch.int64).share_memory_() for shape in shapes]
+        else:
+            self._tensors = [np.zeros(shape, dtype=np.int64) for shape in shapes]
+        self._views()
+
+
+    def _views(self) -> None:
+        """
+        NumPy views of the counters and which row this process writes to.
+        """
+        self.counts, self.total_ns, self.histogram = [t if isinstance(t, np.ndarray) else t.numpy() for t in self._tensors]
+        self._pid = None
+
+
+    def __getstate__(self) -> dict:
+        """
+        Only the counters are sent to other processes, the views are made again on the other side.
+        """
+        state = self.__dict__.copy()
+        for name in ("counts", "total_ns", "histogram", "_pid", "_slot"): state.pop(name, None)
+        return state
+
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._views()
+
+
+    def _row(self) -> int:
+        """
+        Returns the row of counters of this process (worked out once per process).
+        """
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._slot = 0
+            if "torch" in sys.modules:
+                worker = sys.modules["torch"].utils.data.get_worker_info()
+                if worker is not None: self._slot = min(worker.id + 1, self.num_slots - 1)
+        return self._slot
+
+
+    def record(self, stage: str, elapsed_ns: int) -> None:
+        """
+        Add one run of a stage.
+
+        Args:
+            stage (str): name of the stage.
+            elapsed_ns (int): how long it took in nanoseconds.
+
+        Return value: None
+        """
+        row, i = self._row(), self.index[stage]
+        self.counts[row, i] += 1
+        self.total_ns[row, i] += elapsed_ns
+        self.histogram[row, i, _bin(elapsed_ns)] += 1
+
+
+    @contextlib.contextmanager
+    def time(self, stage: str):
+        """
+        Time the code inside a with block as one run of a stage.
+        """
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter_ns() - start)
+
+
+    def snapshot(self) -> dict:
+        """
+        Returns the counters added up over every row (small enough to send back from a worker process).
+        """
+        return {"stages": self.stages, "counts": self.counts.sum(axis=0).tolist(),
+                "total_ns": self.total_ns.sum(axis=0).tolist(), "histogram": self.histogram.sum(axis=0).tolist()}
+
+
+    def merge(self, snapshot: dict) -> None:
+        """
+        Add a snapshot (ex: from a worker process) to this timer.
+
+        Args:
+            snapshot (dict): output of snapshot() of a timer with stages in this timer.
+
+        Return value: None
+        """
+        if snapshot is None: return
+        row = self._row()
+        for i, stage in enumerate(snapshot["stages"]):
+            j = self.index[stage]
+            self.counts[row, j] += snapshot["counts"][i]
+            self.total_ns[row, j] += snapshot["total_ns"][i]
+            self.histogram[row, j] += np.asarray(snapshot["histogram"][i], dtype=np.int64)
+
+
+    def reset(self) -> None:
+        """
+        Set every counter back to 0 (ex: at the start of each epoch).
+        """
+        self.counts[:] = 0
+        self.total_ns[:] = 0
+        self.histogram[:] = 0
+
+
+    def summary(self) -> dict:
+        """
+        Returns a breakdown of every stage that ran: count, total seconds, mean, median and 95th percentile in
+        milliseconds (the percentiles are the upper edge of their histogram bin) and the fraction of the total time.
+        """
+        counts, total_ns, histogram = self.counts.sum(axis=0), self.total_ns.sum(axis=0), self.histogram.sum(axis=0)
+        overall = max(int(total_ns.sum()), 1)
+        breakdown = {}
+        for i, stage in enumerate(self.stages):
+            if counts[i] == 0: continue
+            cumulative = np.cumsum(histogram[i]) / counts[i]
+            breakdown[stage] = {"count": int(counts[i]),
+                                "total_s": total_ns[i] / 1e9,
+                                "mean_ms": total_ns[i] / counts[i] / 1e6,
+                                "p50_ms": _bin_ms(int(np.searchsorted(cumulative, 0.5))),
+                                "p95_ms": _bin_ms(int(np.searchsorted(cumulative, 0.95))),
+                                "fraction": total_ns[i] / overall}
+        return breakdown
+
+
+    def print_summary(self) -> None:
+        """
+        Print the breakdown from summary() as a table.
+        """
+        print(f"{'stage':<12}{'count':>10}{'total s':>10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'share':>8}")
+        for stage, row in self.summary().items():
+            print(f"{stage:<12}{row['count']:>10}{row['total_s']:>10.2f}{row['mean_ms']:>10.3f}"
+                  f"{row['p50_ms']:>10.3f}{row['p95_ms']:>10.3f}{row['fraction']:>8.1%}")
+
+
+def stage(timer, name: str):
+    """
+    Time a with block as a stage of timer, or do nothing if timer is None (so timing costs nothing when it is off).
+
+    Arguments:
+        timer (StageTimer): timer to record to, or None.
+        name (str): name of the stage.
+
+    Return value: context manager.
+    """
+    return timer.time(name) if timer is not None else contextlib.nullcontext()
+
+
+def transform_stages(transforms) -> list:
+    """
+    Split transforms into named steps so each one can be timed (a Compose is split into its transforms,
+    named after their class, ex: Resize and ToTensor).
+
+    Arguments:
+        transforms: a transform or a torchvision Compose of transforms.
+
+    Return value: list of (name, transform).
+    """
+    if transforms is None: return []
+    steps = getattr(transforms, "transforms", [transforms])
+    names, named = {}, []
+    for step in steps:
+        name = type(step).__name__
+        names[name] = names.get(name, 0) + 1
+        named.append((name if names[name] == 1 else f"{name}_{names[name]}", step))
+    return named
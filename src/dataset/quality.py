@@ -0,0 +1,147 @@
+"""
+Functions for finding spectograms that came out wrong (black, a single color or near-silent) and keeping track of
+the songs to exclude because of them.
+"""
+
+import os
+import sys
+import csv
+import pathlib
+import numpy as np
+
+# Make it to where paths only need to be from the repo folder (the root is found once, in paths.py).
+if not __package__: sys.path.append(str(pathlib.Path(__file__).resolve().parents[2]))
+from src.dataset.paths import root
+
+# Where the songs to exclude are listed.
+exclude_path = "data/exclude.csv"
+
+# Exclusion manifests that were already read (path -> (modification time and size of the file, song ids)).
+_loaded = {}
+
+# Size (height, width) images are shrunk to before their statistics are computed.
+scan_size = (64, 64)
+
+
+def flag_spectograms(images: np.ndarray, black_level: float = 10.0, constant_std: float = 1.0, silent_fraction: float = 0.95) -> list:
+    """
+    Flag degenerate spectogram images, computing the statistics of the whole batch at once.
+
+    Arguments:
+        images (np.ndarray): batch of images of shape (N, height, width, 3) and type uint8.
+        black_level (float): images whose average brightest channel is below this are black.
+        constant_std (float): images whose standard deviation (in every channel) is below this are a single color.
+        silent_fraction (float): images where one color covers at least this fraction of the pixels are near-silent
+                                 (for example a silent song with a single click).
+
+    Return value: list of the reason each image was flagged ("black", "constant" or "near_silent") or None if it looks fine.
+    """
+    n = len(images)
+    if n == 0: return []
+    pixels = images.reshape(n, -1, 3)
+
+    # Black: even the brightest channel of each pixel is dark on average.
+    brightness = pixels.max(axis=2).mean(axis=1)
+
+    # Constant: no channel changes across the image.
+    spread = pixels.std(axis=1).max(axis=1)
+
+    # Near-silent: one (coarsely quantized) color covers nearly the whole image.
+    quantized = pixels >> 4
+    codes = (quantized[..., 0].astype(np.int64) << 8) | (quantized[..., 1] << 4) | quantized[..., 2]
+    counts = np.bincount((codes + np.arange(n)[:, None] * 4096).ravel(), minlength=n * 4096).reshape(n, 4096)
+    dominant = counts.max(axis=1) / pixels.shape[1]
+
+    reasons = np.full(n, None, dtype=object)
+    reasons[dominant >= silent_fraction] = "near_silent"
+    reasons[spread < constant_std] = "constant"
+    reasons[brightness < black_level] = "black"
+    return reasons.tolist()
+
+
+def write_exclude(excluded: dict, manifest_path: str = exclude_path) -> None:
+    """
+    Write the songs to exclude (and why) to a csv file.
+
+    Arguments:
+        excluded (dict): song_id to the reason it is excluded.
+        manifest_path (str): path to the csv file.
+
+    Return value: None
+    """
+    with open(os.path.join(root, manifest_path), 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["song_id", "reason"])
+        for song_id in sorted(excluded): writer.writerow([song_id, excluded[song_id]])
+    _loaded.pop(os.path.join(root, manifest_path), None)
+
+
+def scan_spectograms(image_dir: str, manifest_path: str = exclude_path, batch_size: int = 256, keep_manual: bool = True) -> dict:
+    """
+    Check every spectogram image in a directory with flag_spectograms and write the flagged songs to the exclusion manifest.
+
+    Arguments:
+        image_dir (str): directory that contains the spectogram images.
+        manifest_path (str): path to the exclusion manifest (csv file).
+        batch_size (int): number of images checked at once.
+        keep_manual (bool): keep songs that are in the manifest with the reason "manual".
+
+    Return value: dict of song_id to the reason it is excluded.
+    """
+    import cv2
+    # Merge root and image_dir.
+    image_path = os.path.join(root, image_dir)
+    excluded = {}
+    if keep_manual: excluded = {song_id: reason for song_id, reason in read_exclude(manifest_path).items() if reason == "manual"}
+
+    # Check if path exists.
+    if os.path.exists(image_path):
+        files = sorted(file for file in os.listdir(image_path) if file.endswith(".png"))
+        for start in range(0, len(files), batch_size):
+            batch = files[start:start + batch_size]
+            images = np.stack([cv2.resize(cv2.imread(os.path.join(image_path, file), cv2.IMREAD_COLOR),
+                                          scan_size[::-1], interpolation=cv2.INTER_AREA) for file in batch])
+            for file, reason in zip(batch, flag_spectograms(images)):
+                if reason is not None: excluded[int(os.path.splitext(file)[0])] = reason
+        write_exclude(excluded, manifest_path)
+        print(f"Flagged {len(excluded)} songs in [{image_dir}], written to [{manifest_path}]")
+    # If it doesn't, don't do anything.
+    else:
+        print(f"Image directory [{image_path}] doesn't exist")
+    return excluded
+
+
+def read_exclude(manifest_path: str = exclude_path) -> dict:
+    """
+    Read the exclusion manifest.
+
+    Arguments:
+        manifest_path (str): path to the exclusion manifest (csv file).
+
+    Return value: dict of song_id to the reason it is excluded (empty if the manifest doesn't exist).
+    """
+    manifest_path = os.path.join(root, manifest_path)
+    if not os.path.exists(manifest_path): return {}
+    with open(manifest_path, 'r', newline='') as file:
+        return {int(row["song_id"]): row["reason"] for row in csv.DictReader(file)}
+
+
+def load_exclude(manifest_path: str = exclude_path) -> frozenset:
+    """
+    Load the song ids to exclude (read once, then kept until the file changes, ex: the scan ran in another process).
+
+    Arguments:
+        manifest_path (str): path to the exclusion manifest (csv file).
+
+    Return value: frozenset of song ids.
+    """
+    path = os.path.join(root, manifest_path)
+    stat = os.stat(path) if os.path.exists(path) else None
+    key = None if stat is None else (stat.st_mtime_ns, stat.st_size)
+    if path not in _loaded or _loaded[path][0] != key: _loaded[path] = (key, frozenset(read_exclude(manifest_path)))
+    return _loaded[path][1]
+
+
+if __name__ == "__main__":
+    image_dir = "data/spectograms"
+    scan_spectograms(image_dir)
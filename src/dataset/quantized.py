@@ -0,0 +1,210 @@
+"""
+Compact storage of spectograms as quantized decibels.
+
+A spectogram png is a 3-channel color rendering of a single-channel decibel matrix, so it takes several times the
+bytes the information needs (and has to be decoded from a png every time it is read). Here the decibels from
+generate_spectogram are stored as one channel of uint8 (256 levels) or uint16 (65536 levels) between the song's own
+minimum and maximum, with the minimum and the step size (scale) stored alongside:
+
+    decibels = minimum + level * scale
+
+so every value comes back within about scale / 2 of what it was (at most 0.16 dB for uint8 over the 80 dB range
+generate_spectogram clips to, 0.0006 dB for uint16). Every frequency bin and frame is kept by default. The
+spectograms can be shrunk first (ex: to the size of the pngs) to make them much smaller, but shrinking loses far
+more than quantizing does, so the error reported is always against the full output of generate_spectogram (the stored
+spectogram stretched back to full size), with the quantization error on its own alongside it. Each song is a
+<song_id>.npz file, optionally compressed (zlib, which is lossless). MusicDataset reads them with data_format="quantized".
+"""
+
+import os
+import sys
+import pathlib
+import numpy as np
+
+# Make it to where paths only need to be from the repo folder (the root is found once, in paths.py).
+if not __package__: sys.path.append(str(pathlib.Path(__file__).resolve().parents[2]))
+from src.dataset.paths import root
+
+from src.dataset.spectograms import generate_spectogram
+
+# Type of the stored levels for each number of bits.
+quantized_types = {8: np.uint8, 16: np.uint16}
+
+
+def quantize_spectogram(Xdb: np.ndarray, bits: int = 8) -> (np.ndarray, np.float32, np.float32):
+    """
+    Quantize a spectogram (in decibels) to 2 ** bits levels between its minimum and maximum.
+
+    Arguments:
+        Xdb (np.ndarray): spectogram in decibels (ex: the output of generate_spectogram).
+        bits (int): 8 for uint8 levels or 16 for uint16 levels.
+
+    Return value: (np.ndarray, np.float32, np.float32) of the levels, the minimum and the scale (decibels per level).
+    """
+    if bits not in quantized_types: raise ValueError(f"Bits [{bits}] is not one of {list(quantized_types)}.")
+    Xdb = np.asarray(Xdb, dtype=np.float32)
+    minimum = np.float32(Xdb.min())
+    scale = np.float32((Xdb.max() - minimum) / (2 ** bits - 1))
+    # A spectogram of a single value only needs the minimum.
+    if scale == 0: return np.zeros(Xdb.shape, dtype=quantized_types[bits]), minimum, scale
+    levels = np.rint((Xdb - minimum) / scale)
+    return np.clip(levels, 0, 2 ** bits - 1).astype(quantized_types[bits]), minimum, scale
+
+
+def dequantize_spectogram(levels: np.ndarray, minimum: float, scale: float) -> np.ndarray:
+    """
+    Turn quantized levels back into decibels.
+
+    Arguments:
+        levels (np.ndarray): uint8 or uint16 levels from quantize_spectogram.
+        minimum (float): minimum of the spectogram.
+        scale (float): decibels per level.
+
+    Return value: np.ndarray of type float32 of the spectogram in decibels.
+    """
+    Xdb = levels.astype(np.float32)
+    Xdb *= np.float32(scale)
+    Xdb += np.float32(minimum)
+    return Xdb
+
+
+def quantization_error(Xdb: np.ndarray, levels: np.ndarray, minimum: float, scale: float) -> dict:
+    """
+    Measure how far the reconstruction of a quantized spectogram is from the original.
+
+    Arguments:
+        Xdb (np.ndarray): original spectogram in decibels.
+        levels, minimum, scale: output of quantize_spectogram.
+
+    Return value: dict of the largest and root mean square errors and the largest error possible (scale / 2), in decibels.
+    """
+    return dict(_error(dequantize_spectogram(levels, minimum, scale), Xdb), bound_db=float(scale) / 2)
+
+
+def _error(reconstruction: np.ndarray, Xdb: np.ndarray) -> dict:
+    """
+    Returns the largest and root mean square difference between a reconstruction and the original spectogram.
+    """
+    error = reconstruction - np.asarray(Xdb, dtype=np.float32)
+    return {"max_error_db": float(np.abs(error).max()), "rms_error_db": float(np.sqrt(np.mean(error ** 2)))}
+
+
+def save_quantized(file_path: str, levels: np.ndarray, minimum: float, scale: float, compress: bool = False) -> None:
+    """
+    Save a quantized spectogram (the levels, minimum and scale) to an .npz file.
+
+    Arguments:
+        file_path (str): path of the file (ex: data/spectograms_quantized/10.npz).
+        levels, minimum, scale: output of quantize_spectogram.
+        compress (bool): compress the file (lossless, smaller but slower to read).
+
+    Return value: None
+    """
+    # Write to a temporary file first, so a file that was cut off half way never looks finished.
+    file_path = os.path.join(root, file_path)
+    temp_path = file_path + ".tmp.npz"
+    save = np.savez_compressed if compress else np.savez
+    save(temp_path, levels=levels, minimum=np.float32(minimum), scale=np.float32(scale))
+    os.replace(temp_path, file_path)
+
+
+def load_quantized(file_path: str) -> np.ndarray:
+    """
+    Load a quantized spectogram and turn it back into decibels.
+
+    Arguments:
+        file_path (str): path of the .npz file.
+
+    Return value: np.ndarray of type float32 of the spectogram in decibels.
+    """
+    with np.load(os.path.join(root, file_path)) as data:
+        return dequantize_spectogram(data["levels"], data["minimum"], data["scale"])
+
+
+def quantize_multiple_spectogram(audio_dir: str, output_dir: str, bits: int = 8, compress: bool = False,
+                                 size: tuple = None, spectogram_params: dict = None) -> dict:
+    """
+    Generate the spectogram of every audio file in a directory and save it quantized as <song_id>.npz in output_dir.
+    Files that already have a quantized spectogram in output_dir are not generated again.
+
+    Arguments:
+        audio_dir (str): directory that contains all audio files.
+        output_dir (str): directory to store the quantized spectograms.
+        bits (int): 8 or 16 (see quantize_spectogram).
+        compress (bool): compress the files (see save_quantized).
+        size (tuple): (height, width) to shrink the spectograms to before quantizing them (ex: image_size from
+                      spectograms.py, the size of the pngs), None to keep every frequency bin and frame (the default).
+        spectogram_params (dict): keyword arguments for generate_spectogram.
+
+    Return value: dict of the reconstruction error of the songs quantized in this run and their average size in bytes.
+                  max_error_db and mean_rms_error_db are the error of the stored spectogram (stretched back to full
+                  size if it was shrunk) against the output of generate_spectogram, quantization_max_error_db and
+                  quantization_mean_rms_error_db the error of quantizing alone (at most bound_db), all in decibels.
+                  Without size, the two are the same.
+    """
+    if bits not in quantized_types: raise ValueError(f"Bits [{bits}] is not one of {list(quantized_types)}.")
+    # Get a list of all audio files in the given directory.
+    audio_path = os.path.join(root, audio_dir)
+    list_of_audio = sorted(os.listdir(audio_path))
+
+    # Create a place to store the quantized spectograms.
+    out_dir = os.path.join(root, output_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    existing = set(os.path.splitext(file)[0] for file in os.listdir(out_dir) if file.endswith(".npz"))
+    todo = [file for file in list_of_audio if os.path.splitext(file)[0] not in existing]
+    print("Number of current files:", len(list_of_audio) - len(todo))
+    print("Files to go:", len(todo))
+
+    errors, quantization_errors, sizes, failed = [], [], [], []
+    for i, file in enumerate(todo):
+        try:
+            result = generate_spectogram(os.path.join(audio_path, file), **(spectogram_params or {}))
+        except Exception as e:
+            print(f"Error loading audio file {file}: {e}")
+            result = -1
+        # Could not generate a spectogram.
+        if type(result) != tuple:
+            failed.append(file)
+            continue
+        full_Xdb = Xdb = result[0].astype(np.float32)
+        if size is not None:
+            import cv2
+            Xdb = cv2.resize(full_Xdb, (size[1], size[0]), interpolation=cv2.INTER_AREA)
+
+        # Quantize, save and check how much was lost.
+        levels, minimum, scale = quantize_spectogram(Xdb, bits)
+        file_path = os.path.join(out_dir, f"{os.path.splitext(file)[0]}.npz")
+        save_quantized(file_path, levels, minimum, scale, compress)
+        quantization_errors.append(quantization_error(Xdb, levels, minimum, scale))
+        if size is None: errors.append(quantization_errors[-1])
+        else:
+            # Stretch what was stored back to the size of the spectogram, so what the shrinking lost is counted too.
+            restored = cv2.resize(dequantize_spectogram(levels, minimum, scale), (full_Xdb.shape[1], full_Xdb.shape[0]),
+                                  interpolation=cv2.INTER_LINEAR)
+            errors.append(_error(restored, full_Xdb))
+        sizes.append(os.path.getsize(file_path))
+        print(f"[{i + 1}/{len(todo)}] Quantized file {file} (largest error {errors[-1]['max_error_db']:.4f} dB)")
+
+    # Print messages about any failed files.
+    if failed == []: print(f"Every file in audio directory [{audio_dir}] has a quantized spectogram.")
+    else: print(f"Files {failed} failed in audio directory [{audio_dir}]")
+
+    report = {"songs": len(errors), "bits": bits, "compressed": compress, "size": None if size is None else list(size),
+              "max_error_db": max((error["max_error_db"] for error in errors), default=0.0),
+              "mean_rms_error_db": float(np.mean([error["rms_error_db"] for error in errors])) if errors else 0.0,
+              "quantization_max_error_db": max((error["max_error_db"] for error in quantization_errors), default=0.0),
+              "quantization_mean_rms_error_db": float(np.mean([error["rms_error_db"] for error in quantization_errors])) if quantization_errors else 0.0,
+              "bound_db": max((error["bound_db"] for error in quantization_errors), default=0.0),
+              "bytes_per_song": float(np.mean(sizes)) if sizes else 0.0}
+    print(f"Reconstruction error: largest {report['max_error_db']:.4f} dB, average rms {report['mean_rms_error_db']:.4f} dB, "
+          f"{report['bytes_per_song'] / 1e6:.2f} MB per song")
+    if size is not None:
+        print(f"Quantization error alone (after shrinking to {size}): largest {report['quantization_max_error_db']:.4f} dB "
+              f"(at most {report['bound_db']:.4f} dB), average rms {report['quantization_mean_rms_error_db']:.4f} dB")
+    return report
+
+
+if __name__ == "__main__":
+    audio_dir = "data/DEAM_audio/MEMD_audio"
+    output_dir = "data/spectograms_quantized"
+    quantize_multiple_spectogram(audio_dir, output_dir, bits=8, compress=True)
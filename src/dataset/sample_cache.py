@@ -0,0 +1,155 @@
+"""
+Shared-memory cache of decoded samples for MusicDataset.
+
+The cache lives in shared memory, so every DataLoader worker sees (and fills) the same cache.
+Once a sample has been decoded by any worker, later epochs read it from memory instead of decoding it again.
+"""
+
+import torch
+import numpy as np
+import multiprocessing
+
+# Types of arrays that can be cached (stored in the cache as an index into this list).
+dtypes = [np.dtype(np.uint8), np.dtype(np.float16), np.dtype(np.float32), np.dtype(np.float64), np.dtype(np.int16)]
+
+# Most dimensions an array in the cache can have.
+max_dims = 4
+
+# Positions of the shared counters.
+CLOCK, HITS, MISSES, EVICTIONS, FILLED, TOO_BIG = range(6)
+
+
+class SharedSampleCache(object):
+    """
+    Fixed-size slots in shared memory holding arrays for the items of a dataset, with least recently used eviction.
+
+    args:
+        num_items (int): number of items in the dataset (items are looked up by their index).
+        byte_budget (int): most bytes the cache can use for arrays.
+        slot_bytes (int): bytes per cached array (arrays bigger than this are never cached, they are counted in
+                          stats()["too_big"] and the first one prints a warning).
+    """
+
+    def __init__(self, num_items: int, byte_budget: int, slot_bytes: int) -> None:
+        """
+        Constructor for SharedSampleCache class.
+        """
+        self.slot_bytes = int(slot_bytes)
+        self.num_slots = max(0, min(int(byte_budget) // max(self.slot_bytes, 1), num_items))
+
+        # Everything the workers have to agree on is in shared memory.
+        self.arena = torch.zeros(self.num_slots * self.slot_bytes, dtype=torch.uint8).share_memory_()
+        self.item_slot = torch.full((num_items,), -1, dtype=torch.int64).share_memory_()
+        self.slot_item = torch.full((self.num_slots,), -1, dtype=torch.int64).share_memory_()
+        self.slot_used = torch.zeros(self.num_slots, dtype=torch.int64).share_memory_()
+        self.slot_meta = torch.zeros((self.num_slots, max_dims + 2), dtype=torch.int64).share_memory_()
+        self.counters = torch.zeros(6, dtype=torch.int64).share_memory_()
+        # A lock from the spawn context can be shared with both forked and spawned workers.
+        self.lock = multiprocessing.get_context("spawn").Lock()
+
+
+    def _views(self) -> tuple:
+        """
+        NumPy views of the shared tensors (indexing them is much faster than indexing tensors).
+        """
+        return (self.arena.numpy(), self.item_slot.numpy(), self.slot_item.numpy(),
+                self.slot_used.numpy(), self.slot_meta.numpy(), self.counters.numpy())
+
+
+    def get(self, idx: int):
+        """
+        Look up the array cached for an item.
+
+        Args:
+            idx (int): index of the item.
+
+        Return value: np.ndarray (a copy of the cached array) or None if the item is not cached.
+        """
+        arena, item_slot, slot_item, slot_used, slot_meta, counters = self._views()
+        with self.lock:
+            slot = item_slot[idx]
+            if slot < 0:
+                counters[MISSES] += 1
+                return None
+            counters[HITS] += 1
+            counters[CLOCK] += 1
+            slot_used[slot] = counters[CLOCK]
+
+            # Copy while holding the lock so the slot can't be evicted half way through.
+            ndim, dtype = slot_meta[slot, 0], dtypes[slot_meta[slot, 1]]
+            shape = tuple(slot_meta[slot, 2:2 + ndim])
+            start = slot * self.slot_bytes
+            nbytes = int(np.prod(shape)) * dtype.itemsize
+            return arena[start:start + nbytes].view(dtype).reshape(shape).copy()
+
+
+    def put(self, idx: int, array: np.ndarray) -> bool:
+        """
+        Cache the array of an item, evicting the least recently used item if the cache is full.
+
+        Args:
+            idx (int): index of the item.
+            array (np.ndarray): array to cache.
+
+        Return value: bool of whether the array was cached.
+        """
+        if self.num_slots == 0 or array.ndim > max_dims or array.dtype not in dtypes: return False
+        arena, item_slot, slot_item, slot_used, slot_meta, counters = self._views()
+        if array.nbytes > self.slot_bytes:
+            # Samples of different sizes (ex: images without a Resize in cache_transforms) that don't fit are never
+            # cached, so say so once instead of letting the hit rate drop without a trace.
+            with self.lock:
+                counters[TOO_BIG] += 1
+                first = counters[TOO_BIG] == 1
+            if first:
+                print(f"Sample {idx} ({array.nbytes} bytes, shape {array.shape}) is bigger than the cache slots "
+                      f"({self.slot_bytes} bytes) and won't be cached (samples too big to cache are counted in "
+                      f"stats()['too_big']).")
+            return False
+        with self.lock:
+            # Another worker might have cached it already.
+            if item_slot[idx] >= 0: return True
+
+            # Fill empty slots first, then replace the least recently used one.
+            if counters[FILLED] < self.num_slots:
+                slot = counters[FILLED]
+                counters[FILLED] += 1
+            else:
+                slot = int(np.argmin(slot_used))
+                item_slot[slot_item[slot]] = -1
+                counters[EVICTIONS] += 1
+
+            start = slot * self.slot_bytes
+            arena[start:start + array.nbytes] = np.ascontiguousarray(array).reshape(-1).view(np.uint8)
+            slot_meta[slot, 0] = array.ndim
+            slot_meta[slot, 1] = dtypes.index(array.dtype)
+            slot_meta[slot, 2:2 + array.ndim] = array.shape
+            slot_item[slot] = idx
+            item_slot[idx] = slot
+            counters[CLOCK] += 1
+            slot_used[slot] = counters[CLOCK]
+        return True
+
+
+    def stats(self) -> dict:
+        """
+        Returns the hits, misses and evictions so far, how many samples were too big to cache, and how many items and
+        bytes are cached.
+        """
+        counters = self.counters.numpy()
+        items = int(counters[FILLED])
+        return {"hits": int(counters[HITS]),
+                "misses": int(counters[MISSES]),
+                "evictions": int(counters[EVICTIONS]),
+                "too_big": int(counters[TOO_BIG]),
+                "items": items,
+                "bytes": items * self.slot_bytes}
+
+
+    def reset_stats(self) -> None:
+        """
+        Set the hit, miss, eviction and too big counters back to 0 (ex: at the start of each epoch).
+        """
+        with self.lock:
+            counters = self.counters.numpy()
+            counters[HITS] = counters[MISSES] = counters[EVICTIONS] = counters[TOO_BIG] = 0
@@ -0,0 +1,135 @@
+"""
+Sharded data loading for training on several processes (ex: Lightning DDP on several nodes).
+
+Without sharding, every rank builds a dataset of every song and a DistributedSampler picks its part of the indices,
+so every rank still reads the whole csv file, stats every spectogram and sizes its caches for the whole dataset.
+Here every rank gets its own shard of the song ids instead (a MusicDataset made with song_ids), so the index, the
+files it touches and the caches shrink with the number of ranks. The songs are dealt out to the shards again every
+epoch (shuffled with seed + epoch, the same way on every run), so over the epochs every rank sees songs from every
+shard, and a ShardSampler shuffles the order inside a shard and makes every rank take the same number of steps.
+"""
+
+import os
+import sys
+import torch
+import pathlib
+import numpy as np
+
+# Make it to where paths only need to be from the repo folder (the root is found once, in paths.py).
+if not __package__: sys.path.append(str(pathlib.Path(__file__).resolve().parents[2]))
+from src.dataset.paths import root
+
+from src.dataset.quality import exclude_path, load_exclude
+
+
+def shard_rank(trainer = None) -> (int, int):
+    """
+    Find the rank of this process and the number of processes (world size).
+    Uses the process group if it is set up, then the trainer, then the RANK and WORLD_SIZE environment variables
+    (set by torchrun), and otherwise assumes a single process.
+
+    Arguments:
+        trainer: a Lightning Trainer (or None).
+
+    Return value: (int, int) of the rank and the world size.
+    """
+    if torch.distributed.is_available() and torch.distributed.is_initialized():
+        return torch.distributed.get_rank(), torch.distributed.get_world_size()
+    if trainer is not None: return trainer.global_rank, trainer.world_size
+    if "RANK" in os.environ and "WORLD_SIZE" in os.environ: return int(os.environ["RANK"]), int(os.environ["WORLD_SIZE"])
+    return 0, 1
+
+
+def csv_song_ids(csv_file_path: str, exclude_manifest: str = exclude_path) -> np.ndarray:
+    """
+    Get the song ids of a csv file, without the excluded songs. Only the song_id column is read (every rank calls
+    this before it knows its shard).
+
+    Arguments:
+        csv_file_path (str): path to the csv file.
+        exclude_manifest (str): path to the exclusion manifest.
+
+    Return value: np.ndarray of song ids (in the order of the csv file).
+    """
+    import pandas as pd
+    song_ids = pd.read_csv(os.path.join(root, csv_file_path), usecols=["song_id"]).song_id.to_numpy(dtype=np.int64)
+    return song_ids[~np.isin(song_ids, np.fromiter(load_exclude(exclude_manifest), dtype=np.int64))]
+
+
+def shard_song_ids(song_ids, rank: int, world_size: int, seed: int = 0, epoch: int = 0) -> np.ndarray:
+    """
+    Get the song ids of one shard. The songs are shuffled with seed + epoch and dealt out to the shards, so the shards
+    are random mixes of the songs whose sizes differ by at most 1, every rank computes the same shards and the shards
+    are dealt out differently every epoch.
+
+    Arguments:
+        song_ids: song ids of the whole dataset.
+        rank (int): which shard to get (0 to world_size - 1).
+        world_size (int): number of shards.
+        seed (int): seed for dealing out the songs (must be the same on every rank).
+        epoch (int): epoch to deal the songs out for.
+
+    Return value: np.ndarray of the song ids of the shard (sorted).
+    """
+    if not 0 <= rank < world_size: raise ValueError(f"Rank [{rank}] is not between 0 and world size [{world_size}] - 1.")
+    song_ids = np.asarray(song_ids, dtype=np.int64)
+    order = np.random.default_rng(seed + epoch).permutation(len(song_ids))
+    return np.sort(song_ids[order[rank::world_size]])
+
+
+class ShardSampler(torch.utils.data.Sampler):
+    """
+    Sampler for the dataset of one shard. Every epoch the shard is shuffled with seed + epoch, and shards that are
+    one song short repeat the first song of the epoch, so every rank takes num_samples samples (the same number of
+    steps).
+
+    args:
+        num_items (int): number of samples in this rank's dataset.
+        num_samples (int): number of samples every rank takes per epoch (the size of the biggest shard).
+        shuffle (bool): shuffle the shard every epoch.
+        seed (int): seed for shuffling (must be the same on every rank).
+    """
+
+    def __init__(self, num_items: int, num_samples: int, shuffle: bool = True, seed: int = 0) -> None:
+        """
+        Constructor for ShardSampler class.
+        """
+        if num_items == 0 and num_samples > 0: raise ValueError("Can't sample from an empty shard.")
+        self.num_items = num_items
+        self.num_samples = num_samples
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+
+    def set_epoch(self, epoch: int) -> None:
+        """
+        Set the epoch (Lightning calls this at the start of every epoch), which changes the order of the samples.
+        """
+        self.epoch = epoch
+
+
+    def __iter__(self):
+        if self.shuffle:
+            generator = torch.Generator()
+            generator.manual_seed(self.seed + self.epoch)
+            indices = torch.randperm(self.num_items, generator=generator).tolist()
+        else:
+            indices = list(range(self.num_items))
+        # Wrap around so every shard has the same number of samples.
+        indices += indices[:self.num_samples - len(indices)]
+        return iter(indices[:self.num_samples])
+
+
+    def __len__(self) -> int:
+        return self.num_samples
+
+
+if __name__ == "__main__":
+    csv_path = "data/mood.csv"
+    song_ids = csv_song_ids(csv_path)
+    world_size = 4
+    for rank in range(world_size):
+        shard = shard_song_ids(song_ids, rank, world_size)
+        sampler = ShardSampler(len(shard), -(-len(song_ids) // world_size))
+        print(f"Rank {rank}: {len(shard)} songs, {len(sampler)} samples per epoch, first songs {shard[list(sampler)[:4]]}")
@@ -0,0 +1,212 @@
+"""
+Content-addressed cache for generated spectograms.
+
+Every cached spectogram is stored under a key made from a hash of the audio file's bytes and all the parameters
+used to make it (sample rate, STFT settings, decibel reference, render settings). A spectogram is only generated
+again when the audio or one of the parameters actually changed.
+"""
+
+import os
+import csv
+import json
+import shutil
+import hashlib
+
+from src.dataset.paths import root
+
+
+def hash_file(file_path: str, chunk_size: int = 2 ** 20) -> str:
+    """
+    Hash the bytes of a file.
+
+    Arguments:
+        file_path (str): path to the file.
+        chunk_size (int): number of bytes read at a time.
+
+    Return value: str of the sha256 hash of the file.
+    """
+    digest = hashlib.sha256()
+    with open(os.path.join(root, file_path), 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""): digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(audio_hash: str, params: dict) -> str:
+    """
+    Make the key of a spectogram from the hash of its audio and the parameters used to make it.
+
+    Arguments:
+        audio_hash (str): hash of the audio file (from hash_file).
+        params (dict): every parameter that changes the spectogram (must be json serializable).
+
+    Return value: str of the key.
+    """
+    return hashlib.sha256((audio_hash + json.dumps(params, sort_keys=True)).encode()).hexdigest()
+
+
+class SpectogramCache(object):
+    """
+    A directory of spectograms stored by key (cache_dir/objects/) and an index (cache_dir/index.csv) of which
+    output file was made from which audio file and key.
+
+    args:
+        cache_dir (str): directory of the cache.
+    """
+
+    fields = ["output", "audio", "size", "mtime_ns", "audio_hash", "key"]
+
+    def __init__(self, cache_dir: str) -> None:
+        """
+        Constructor for SpectogramCache class.
+        """
+        self.cache_dir = os.path.join(root, cache_dir)
+        self.index_path = os.path.join(self.cache_dir, "index.csv")
+        os.makedirs(os.path.join(self.cache_dir, "objects"), exist_ok=True)
+
+        # Index entries by output path.
+        self.entries = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', newline='') as file:
+                for row in csv.DictReader(file): self.entries[row["output"]] = row
+
+        # Hashes of audio files that didn't change since they were last hashed (by path, size and modification time).
+        self.hashes = {(row["audio"], row["size"], row["mtime_ns"]): row["audio_hash"] for row in self.entries.values()}
+
+
+    def save(self) -> None:
+        """
+        Write the index to disk.
+        """
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, 'w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=self.fields)
+            writer.writeheader()
+            for output in sorted(self.entries): writer.writerow(self.entries[output])
+        os.replace(temp_path, self.index_path)
+
+
+    def object_path(self, key: str, extension: str = ".png") -> str:
+        """
+        Returns where the spectogram with the given key is stored.
+        """
+        return os.path.join(self.cache_dir, "objects", key[:2], key + extension)
+
+
+    def _stat(self, audio_path: str) -> tuple:
+        """
+        Returns what is used to tell if an audio file changed since it was hashed.
+        """
+        stat = os.stat(audio_path)
+        return (audio_path, str(stat.st_size), str(stat.st_mtime_ns))
+
+
+    def key(self, audio_path: str, params: dict) -> str:
+        """
+        Returns the key of the spectogram of an audio file made with params.
+        The audio file is only hashed again if its size or modification time changed.
+
+        Args:
+            audio_path (str): path to the audio file.
+            params (dict): every parameter that changes the spectogram.
+
+        Return value: str of the key.
+        """
+        stat = self._stat(os.path.join(root, audio_path))
+        if stat not in self.hashes: self.hashes[stat] = hash_file(stat[0])
+        return cache_key(self.hashes[stat], params)
+
+
+    def lookup(self, key: str, extension: str = ".png"):
+        """
+        Returns the path of the cached spectogram with the given key, or None if it isn't cached.
+        """
+        path = self.object_path(key, extension)
+        return path if os.path.exists(path) else None
+
+
+    def is_current(self, output_path: str, key: str) -> bool:
+        """
+        Returns whether output_path exists and was made from the spectogram with the given key.
+        """
+        entry = self.entries.get(output_path)
+        return entry is not None and entry["key"] == key and os.path.exists(output_path)
+
+
+    def put(self, key: str, file_path: str, extension: str = ".png") -> str:
+        """
+        Move a newly generated spectogram into the cache under the given key.
+
+        Args:
+            key (str): key of the spectogram.
+            file_path (str): path to the generated file (it is moved, not copied).
+
+        Return value: str of the path of the cached spectogram.
+        """
+        path = self.object_path(key, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(file_path, path)
+        return path
+
+
+    def materialize(self, key: str, output_path: str, audio_path: str, extension: str = ".png") -> None:
+        """
+        Put the cached spectogram with the given key at output_path (as a hard link when possible) and remember
+        which audio file it was made from.
+
+        Args:
+            key (str): key of the spectogram.
+            output_path (str): where the spectogram should be.
+            audio_path (str): audio file the spectogram was made from.
+
+        Return value: None
+        """
+        path = self.object_path(key, extension)
+        # Remove the old file first so writing a new one never changes the cached copy it might be linked to.
+        if os.path.lexists(output_path): os.remove(output_path)
+        try:
+            os.link(path, output_path)
+        except OSError:
+            shutil.copyfile(path, output_path)
+
+        audio, size, mtime_ns = self._stat(os.path.join(root, audio_path))
+        self.entries[output_path] = {"output": output_path, "audio": audio, "size": size, "mtime_ns": mtime_ns,
+                                     "audio_hash": self.hashes[(audio, size, mtime_ns)], "key": key}
+
+
+    def invalidate(self, path: str) -> int:
+        """
+        Remove the cached spectograms of an audio file or output file, so they are generated again.
+
+        Args:
+            path (str): path to an audio file or an output file.
+
+        Return value: int of the number of entries removed.
+        """
+        path = os.path.join(root, path)
+        removed = [output for output, entry in self.entries.items() if path in (output, entry["audio"])]
+        for output in removed:
+            entry = self.entries.pop(output)
+            for extension in (".png", ".npy", ".npz"):
+                if os.path.exists(self.object_path(entry["key"], extension)): os.remove(self.object_path(entry["key"], extension))
+        return len(removed)
+
+
+    def gc(self) -> int:
+        """
+        Remove index entries whose audio or output file no longer exists, then remove every cached spectogram
+        that no entry uses anymore (ex: spectograms of audio that changed or of old parameters).
+
+        Return value: int of the number of cached spectograms removed.
+        """
+        self.entries = {output: entry for output, entry in self.entries.items()
+                        if os.path.exists(output) and os.path.exists(entry["audio"])}
+        used = set(entry["key"] for entry in self.entries.values())
+
+        removed = 0
+        objects_dir = os.path.join(self.cache_dir, "objects")
+        for prefix in os.listdir(objects_dir):
+            for file in os.listdir(os.path.join(objects_dir, prefix)):
+                if os.path.splitext(file)[0] not in used:
+                    os.remove(os.path.join(objects_dir, prefix, file))
+                    removed += 1
+        return removed
@@ -0,0 +1,151 @@
+"""
+Packed, memory-mapped storage for spectograms.
+
+Every spectogram is stored back to back in one binary file (store_path + ".bin") and a csv index
+(store_path + ".csv") keeps the offset, shape and type of each song's spectogram.
+"""
+
+import os
+import sys
+import csv
+import pathlib
+import numpy as np
+
+# Make it to where paths only need to be from the repo folder (the root is found once, in paths.py).
+if not __package__: sys.path.append(str(pathlib.Path(__file__).resolve().parents[2]))
+from src.dataset.paths import root
+
+
+def pack_arrays(arrays, store_path: str) -> int:
+    """
+    Pack arrays into a store that can be opened with SpectogramStore.
+
+    Arguments:
+        arrays: iterable of (song_id, np.ndarray) pairs.
+        store_path (str): path of the store without the extension (ex: data/spectograms_packed).
+
+    Return value: int of the number of arrays that were packed.
+    """
+    # Merge root and store_path.
+    store_path = os.path.join(root, store_path)
+    os.makedirs(os.path.dirname(store_path), exist_ok=True)
+
+    count = 0
+    offset = 0
+    with open(store_path + ".bin", 'wb') as data, open(store_path + ".csv", 'w', newline='') as index:
+        writer = csv.writer(index)
+        writer.writerow(["song_id", "offset", "shape", "dtype"])
+        for song_id, array in arrays:
+            array = np.ascontiguousarray(array)
+            data.write(array.tobytes())
+            writer.writerow([song_id, offset, "x".join(str(n) for n in array.shape), array.dtype.str])
+            offset += array.nbytes
+            count += 1
+    return count
+
+
+def pack_spectograms(image_dir: str, store_path: str) -> None:
+    """
+    Convert a directory of spectogram images (ex: data/spectograms/*.png) into a packed store.
+    The images are stored exactly as cv2.imread loads them (uint8 in BGR order).
+
+    Arguments:
+        image_dir (str): directory that contains the spectogram images.
+        store_path (str): path of the store without the extension (ex: data/spectograms_packed).
+
+    Return value: None
+    """
+    import cv2
+    # Merge root and image_dir.
+    image_path = os.path.join(root, image_dir)
+
+    # Check if path exists.
+    if os.path.exists(image_path):
+        images = sorted((file for file in os.listdir(image_path) if file.endswith(".png")),
+                        key=lambda file: int(os.path.splitext(file)[0]))
+        arrays = ((int(os.path.splitext(file)[0]), cv2.imread(os.path.join(image_path, file), cv2.IMREAD_COLOR)) for file in images)
+        count = pack_arrays(arrays, store_path)
+        print(f"Packed {count} spectograms from [{image_dir}] into [{store_path}]")
+    # If it doesn't, don't do anything.
+    else:
+        print(f"Image directory [{image_path}] doesn't exist")
+
+
+class SpectogramStore(object):
+    """
+    Read-only access to a store created by pack_arrays/pack_spectograms.
+    Indexing the store by song_id returns a view into the memory-mapped file, so nothing is copied or decoded.
+
+    args:
+        store_path (str): path of the store without the extension (ex: data/spectograms_packed).
+    """
+
+    def __init__(self, store_path: str) -> None:
+        """
+        Constructor for SpectogramStore class.
+        """
+        self.store_path = os.path.join(root, store_path)
+        self.index = {}
+        with open(self.store_path + ".csv", 'r', newline='') as file:
+            for row in csv.DictReader(file):
+                shape = tuple(int(n) for n in row["shape"].split("x"))
+                self.index[int(row["song_id"])] = (int(row["offset"]), shape, np.dtype(row["dtype"]))
+
+        # The file is mapped the first time it is needed (so each DataLoader worker maps it on its own).
+        self._data = None
+
+
+    def __getstate__(self) -> dict:
+        """
+        Don't copy the memory map when the store is sent to another process.
+        """
+        state = self.__dict__.copy()
+        state["_data"] = None
+        return state
+
+
+    def __len__(self) -> int:
+        """
+        Returns the number of spectograms in the store.
+        """
+        return len(self.index)
+
+
+    def __contains__(self, song_id: int) -> bool:
+        """
+        Returns whether the store has a spectogram for song_id.
+        """
+        return int(song_id) in self.index
+
+
+    def shape(self, song_id: int) -> tuple:
+        """
+        Returns the shape of the spectogram of song_id.
+        """
+        return self.index[int(song_id)][1]
+
+
+    def __getitem__(self, song_id: int) -> np.ndarray:
+        """
+        Returns the spectogram of song_id as a view of the memory-mapped file.
+
+        Args:
+            song_id (int): id of the song.
+
+        Return value: np.ndarray
+        """
+        if self._data is None:
+            # Copy-on-write so the views are writable (for torch.from_numpy) while pages stay shared.
+            self._data = np.memmap(self.store_path + ".bin", dtype=np.uint8, mode='c')
+        offset, shape, dtype = self.index[int(song_id)]
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        return self._data[offset:offset + nbytes].view(dtype).reshape(shape)
+
+
+if __name__ == "__main__":
+    image_dir = "data/spectograms"
+    store_path = "data/spectograms_packed"
+    pack_spectograms(image_dir, store_path)
+
+    store = SpectogramStore(store_path)
+    print(len(store))
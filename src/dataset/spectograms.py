@@ -2,91 +2,549 @@
 Functions for generating spectograms.
 """
 
+import io
 import os
 import sys
-import cv2
-import librosa
-import pyprojroot
+import csv
+import inspect
+import pathlib
 import numpy as np
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-# Make it to where paths only need to be from the repo folder.
-root = pyprojroot.find_root(pyprojroot.has_dir(".git"))
-sys.path.append(str(root))
+# Make it to where paths only need to be from the repo folder (the root is found once, in paths.py).
+if not __package__: sys.path.append(str(pathlib.Path(__file__).resolve().parents[2]))
+from src.dataset.paths import root
 
+from src.dataset.spectogram_cache import SpectogramCache
+from src.dataset.quality import scan_spectograms
+from src.dataset.profiling import StageTimer, generation_stages, stage
+from src.dataset.pipeline import run_pipeline, check_pipeline_sizes
 
-def generate_spectogram(audio_file_path: str) -> (np.ndarray, int):
+# Heavy libraries (librosa, matplotlib, cv2 and the audio decoders) are imported inside the functions that use them, so importing this module is fast.
+
+# Size (height, width) of the images saved by matplotlib (the default figure with the axes cropped out).
+image_size = (369, 496)
+
+# Color lookup tables used by render_spectogram, filled in the first time a colormap is needed.
+_color_tables = {}
+
+
+def generate_spectogram(audio_file_path: str, sr: int = 44100, n_fft: int = 2048, hop_length: int = 512,
+                        ref: float = 1.0, top_db: float = 80.0, timer: StageTimer = None) -> (np.ndarray, int):
     """
     Create a spectogram based on the audio in the audio_file_path.
 
     Arguments:
         audio_file_path (str): Path to a specific audio file (ex: mp3).
+        sr (int): sample rate to resample the audio to.
+        n_fft (int): length of the FFT window.
+        hop_length (int): number of samples between frames.
+        ref (float): amplitude that is 0 decibels.
+        top_db (float): the spectogram is clipped to top_db below its loudest value.
+        timer (StageTimer): if given, the decode, stft and db stages are timed.
     
     Return value: (np.ndarray, int) if audio file exists, -1 otherwise.
     """
+    import librosa
     # Merge root and audio_file_path.
     new_file_path = os.path.join(root, audio_file_path)
 
     # If audio file exists, generate a spectogram for it.
     if os.path.exists(new_file_path):
         # Load audio and create spectogram.
-        x, sr = librosa.load(new_file_path, sr=44100)
-        Xdb = librosa.amplitude_to_db(abs(librosa.stft(x)))
-        return (Xdb, sr)
+        with stage(timer, "decode"): x, sr = librosa.load(new_file_path, sr=sr)
+        return (_stft_db(x, n_fft, hop_length, ref, top_db, timer), sr)
     # Could not find file.
     else:
         print(f"Audio file [{audio_file_path}] not found.")
         return -1
 
 
-def generate_multiple_spectogram(audio_dir: str, output_dir: str) -> None:
+def _stft_db(x: np.ndarray, n_fft: int, hop_length: int, ref: float, top_db: float, timer: StageTimer = None) -> np.ndarray:
+    """
+    The spectogram (in decibels) of loaded audio, the part of generate_spectogram after decoding.
+    """
+    import librosa
+    with stage(timer, "stft"): X = abs(librosa.stft(x, n_fft=n_fft, hop_length=hop_length))
+    with stage(timer, "db"): return librosa.amplitude_to_db(X, ref=ref, top_db=top_db)
+
+
+def _audio_blocks(audio_file_path: str, block_size: int):
+    """
+    Read an audio file a block at a time instead of all at once.
+    Uses soundfile and falls back to audioread for formats soundfile can't read.
+
+    Arguments:
+        audio_file_path (str): path to the audio file.
+        block_size (int): number of samples per block (at the sample rate of the file).
+
+    Return value: generator of (np.ndarray, int) of mono float32 blocks and the sample rate of the file.
+    """
+    import audioread
+    import soundfile
+    try:
+        file = soundfile.SoundFile(audio_file_path)
+    except RuntimeError:
+        file = None
+    if file is not None:
+        with file:
+            for block in file.blocks(blocksize=block_size, dtype='float32', always_2d=True):
+                yield block.mean(axis=1), file.samplerate
+    else:
+        with audioread.audio_open(audio_file_path) as file:
+            for buffer in file:
+                # Audioread gives interleaved 16 bit samples (scaled the same way as librosa).
+                block = np.frombuffer(buffer, dtype='<i2').reshape(-1, file.channels) / np.float32(32768)
+                yield block.mean(axis=1, dtype=np.float32), file.samplerate
+
+
+def _write_npy_header(file, shape: tuple, dtype: np.dtype) -> None:
+    """
+    Write a fixed size (128 byte) .npy header for a column-major array, so it can be rewritten once the shape is known.
+
+    Arguments:
+        file: binary file opened for writing, positioned at the start.
+        shape (tuple): shape of the array.
+        dtype (np.dtype): type of the array.
+
+    Return value: None
+    """
+    header = "{'descr': '%s', 'fortran_order': True, 'shape': (%d, %d), }" % (np.dtype(dtype).str, shape[0], shape[1])
+    header = header.ljust(128 - 10 - 1) + "\n"
+    file.write(b"\x93NUMPY\x01\x00" + len(header).to_bytes(2, "little") + header.encode("latin1"))
+
+
+def generate_spectogram_streaming(audio_file_path: str, output_path: str, sr: int = 44100, n_fft: int = 2048,
+                                  hop_length: int = 512, block_size: int = 2 ** 16, top_db: float = 80.0) -> (np.ndarray, int):
+    """
+    Create a spectogram the same way as generate_spectogram, but read the audio a block at a time and write the
+    decibel columns straight to output_path (a .npy file), so the memory used doesn't depend on the length of the audio.
+
+    Arguments:
+        audio_file_path (str): Path to a specific audio file (ex: mp3).
+        output_path (str): Path to the .npy file to write the spectogram to.
+        sr (int): sample rate to resample the audio to.
+        n_fft (int): length of the FFT window.
+        hop_length (int): number of samples between frames.
+        block_size (int): number of samples read from the audio file at a time.
+        top_db (float): the spectogram is clipped to top_db below its loudest value (like librosa.amplitude_to_db).
+    
+    Return value: (np.ndarray, int) of the spectogram (memory-mapped from output_path) and sample rate if audio file exists, -1 otherwise.
+    """
+    import soxr
+    import scipy.signal
+    # Merge root and the paths.
+    new_file_path = os.path.join(root, audio_file_path)
+    output_path = os.path.join(root, output_path)
+
+    # Could not find file.
+    if not os.path.exists(new_file_path):
+        print(f"Audio file [{audio_file_path}] not found.")
+        return -1
+
+    n_bins = 1 + n_fft // 2
+    window = scipy.signal.get_window("hann", n_fft, fftbins=True).astype(np.float32)
+    resampler = None
+    # Pad the start with zeros like librosa.stft(center=True).
+    buffer = np.zeros(n_fft // 2, dtype=np.float32)
+    n_frames = 0
+    loudest = -np.inf
+
+    def write_frames(buffer: np.ndarray, output) -> np.ndarray:
+        # Compute every full frame in the buffer and return what is left for the next block.
+        nonlocal n_frames, loudest
+        if len(buffer) < n_fft: return buffer
+        count = 1 + (len(buffer) - n_fft) // hop_length
+        frames = np.lib.stride_tricks.sliding_window_view(buffer, n_fft)[::hop_length][:count]
+        Xdb = 20 * np.log10(np.maximum(1e-5, np.abs(np.fft.rfft(frames * window, axis=1)))).astype(np.float32)
+        output.write(Xdb.tobytes())
+        n_frames += count
+        loudest = max(loudest, float(Xdb.max()))
+        return buffer[count * hop_length:]
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'wb') as output:
+        _write_npy_header(output, (n_bins, 0), np.float32)
+        # Frames are written one after another, which is the column-major layout of the (frequency, time) spectogram.
+        for block, native_sr in _audio_blocks(new_file_path, block_size):
+            if resampler is None and native_sr != sr: resampler = soxr.ResampleStream(native_sr, sr, 1, dtype='float32')
+            if resampler is not None: block = resampler.resample_chunk(block)
+            buffer = write_frames(np.concatenate([buffer, block]), output)
+        # Flush the resampler and pad the end with zeros.
+        if resampler is not None: buffer = np.concatenate([buffer, resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)])
+        write_frames(np.concatenate([buffer, np.zeros(n_fft // 2, dtype=np.float32)]), output)
+
+        # Now that the number of frames is known, fill it into the header.
+        output.seek(0)
+        _write_npy_header(output, (n_bins, n_frames), np.float32)
+
+    # Clip to top_db below the loudest value, a chunk of columns at a time.
+    if top_db is not None:
+        chunk_bytes = 4096 * n_bins * 4
+        with open(output_path, 'r+b') as output:
+            for start in range(128, 128 + n_frames * n_bins * 4, chunk_bytes):
+                output.seek(start)
+                Xdb = np.maximum(np.frombuffer(output.read(chunk_bytes), dtype=np.float32), loudest - top_db)
+                output.seek(start)
+                output.write(Xdb.tobytes())
+    return (np.load(output_path, mmap_mode='r'), sr)
+
+
+def save_spectogram(result: np.ndarray, sr: int, image_path: str, timer: StageTimer = None) -> None:
+    """
+    Plot a spectogram (the output of generate_spectogram) and save it as a png.
+
+    Arguments:
+        result (np.ndarray): spectogram in decibels.
+        sr (int): sample rate used to create the spectogram.
+        image_path (str): where to save the image (or a file object to write the png to).
+        timer (StageTimer): if given, the render (plot) and write (savefig) stages are timed.
+
+    Return value: None
+    """
+    import librosa.display
+    from matplotlib.figure import Figure
+    # Use a figure that is not tracked by pyplot so it is freed after saving.
+    with stage(timer, "render"):
+        fig = Figure()
+        ax = fig.add_subplot()
+        ax.axis('off')
+        librosa.display.specshow(result, sr=sr, ax=ax)
+    with stage(timer, "write"): fig.savefig(image_path, format='png', bbox_inches='tight', pad_inches=0.0)
+
+
+def _color_table(name: str) -> np.ndarray:
+    """
+    Get a 256 color lookup table (in BGR order) for a matplotlib colormap.
+
+    Arguments:
+        name (str): name of the colormap.
+
+    Return value: np.ndarray of shape (256, 3) and type uint8.
+    """
+    import matplotlib
+    if name not in _color_tables:
+        rgb = matplotlib.colormaps[name](np.linspace(0, 1, 256))[:, :3]
+        _color_tables[name] = np.ascontiguousarray((rgb * 255 + 0.5).astype(np.uint8)[:, ::-1])
+    return _color_tables[name]
+
+
+def render_spectogram(result: np.ndarray, height: int = image_size[0], width: int = image_size[1]) -> np.ndarray:
+    """
+    Turn a spectogram (the output of generate_spectogram) into a color image without plotting it.
+    The colors match the images saved by save_spectogram (the same colormap librosa picks and the same scaling).
+
+    Arguments:
+        result (np.ndarray): spectogram in decibels.
+        height (int): height of the image.
+        width (int): width of the image.
+
+    Return value: np.ndarray of shape (height, width, 3) and type uint8 in BGR order (the same as cv2.imread).
+    """
+    import cv2
+    # Like librosa, use a diverging colormap if the data has both positive and negative values.
+    low, high = np.percentile(result, [2, 98])
+    table = _color_table("magma" if low >= 0 or high <= 0 else "coolwarm")
+
+    # Scale the whole spectogram to the range of the colormap.
+    vmin, vmax = result.min(), result.max()
+    scale = 256 / (vmax - vmin) if vmax > vmin else 0
+
+    # Low frequencies are at the bottom of the image.
+    resized = cv2.resize(np.ascontiguousarray(result[::-1], dtype=np.float32), (width, height), interpolation=cv2.INTER_LINEAR)
+    index = np.clip(((resized - vmin) * scale).astype(np.int32), 0, 255)
+    return table[index]
+
+
+def spectogram_image(result: np.ndarray, sr: int, renderer: str = "matplotlib") -> np.ndarray:
+    """
+    Make the image of a spectogram in memory, exactly as cv2.imread would load the png generate_multiple_spectogram
+    saves with the same renderer.
+
+    Arguments:
+        result (np.ndarray): spectogram in decibels.
+        sr (int): sample rate used to create the spectogram.
+        renderer (str): "matplotlib" (save_spectogram) or "numpy" (render_spectogram).
+
+    Return value: np.ndarray of type uint8 in BGR order.
+    """
+    if renderer == "numpy": return render_spectogram(result)
+    if renderer != "matplotlib": raise ValueError(f"Renderer [{renderer}] is not one of ['matplotlib', 'numpy'].")
+    import cv2
+    buffer = io.BytesIO()
+    save_spectogram(result, sr, buffer)
+    return cv2.imdecode(np.frombuffer(buffer.getvalue(), dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def _spectogram_job(audio_file_path: str, image_path: str, renderer: str = "matplotlib", spectogram_params: dict = None,
+                    profile: bool = False) -> (str, str, dict):
+    """
+    Generate and save the spectogram of a single audio file.
+    Runs inside the worker processes of generate_multiple_spectogram.
+
+    Arguments:
+        audio_file_path (str): path to the audio file.
+        image_path (str): where to save the image of the spectogram.
+        renderer (str): how to save the image ("matplotlib" or "numpy").
+        spectogram_params (dict): keyword arguments for generate_spectogram.
+        profile (bool): time each stage of generating the spectogram.
+
+    Return value: (str, str, dict) of the audio file name, its manifest status ("done" or "failed") and
+                  a snapshot of the stage timings (None if profile is False).
+    """
+    import cv2
+    file = os.path.basename(audio_file_path)
+    timer = StageTimer(generation_stages) if profile else None
+    snapshot = lambda: timer.snapshot() if timer is not None else None
+    try:
+        result = generate_spectogram(audio_file_path, **(spectogram_params or {}), timer=timer)
+        # Could not generate a spectogram.
+        if type(result) != tuple: return (file, "failed", snapshot())
+        if renderer == "numpy":
+            with stage(timer, "render"): image = render_spectogram(result[0])
+            with stage(timer, "write"): cv2.imwrite(image_path, image)
+        else: save_spectogram(result[0], result[1], image_path, timer)
+        return (file, "done", snapshot())
+    except Exception as e:
+        print(f"Error generating spectogram for file {file}: {e}")
+        return (file, "failed", snapshot())
+
+
+def _decode_job(job: tuple) -> dict:
+    """
+    Decode stage of the generation pipeline (runs in a thread): load and resample the audio of a job.
+    """
+    import librosa
+    audio_file_path, image_path, renderer, spectogram_params, profile = job
+    params = _spectogram_params(spectogram_params)
+    timer = StageTimer(generation_stages) if profile else None
+    new_file_path = os.path.join(root, audio_file_path)
+    if not os.path.exists(new_file_path): raise FileNotFoundError(f"Audio file [{audio_file_path}] not found.")
+    with stage(timer, "decode"): x, sr = librosa.load(new_file_path, sr=params["sr"])
+    return {"x": x, "sr": sr, "renderer": renderer, "params": params, "timer": timer}
+
+
+def _compute_job(payload: dict) -> dict:
+    """
+    Compute stage of the generation pipeline (runs in a process): the spectogram and its image.
+    Only the image is sent back (a BGR array for the numpy renderer, the png bytes for matplotlib), not the spectogram.
+    """
+    params, timer = payload["params"], payload["timer"]
+    Xdb = _stft_db(payload["x"], params["n_fft"], params["hop_length"], params["ref"], params["top_db"], timer)
+    if payload["renderer"] == "numpy":
+        with stage(timer, "render"): return {"image": render_spectogram(Xdb), "timer": timer}
+    buffer = io.BytesIO()
+    save_spectogram(Xdb, payload["sr"], buffer, timer)
+    return {"png": buffer.getvalue(), "timer": timer}
+
+
+def _write_job(job: tuple, payload: dict) -> dict:
+    """
+    Write stage of the generation pipeline (runs in a thread): save the image of a job.
+    Returns a snapshot of the job's stage timings (None if it isn't profiled).
+    """
+    import cv2
+    image_path, timer = job[1], payload["timer"]
+    if "image" in payload:
+        with stage(timer, "write"):
+            if not cv2.imwrite(image_path, payload["image"]): raise OSError(f"Could not write [{image_path}]")
+    else:
+        # The png was already encoded (and timed as the write stage) by save_spectogram in the process.
+        with open(image_path, 'wb') as file: file.write(payload["png"])
+    return timer.snapshot() if timer is not None else None
+
+
+def _spectogram_params(spectogram_params: dict = None) -> dict:
+    """
+    Returns the keyword arguments of generate_spectogram with the defaults filled in.
+    """
+    signature = inspect.signature(generate_spectogram)
+    params = {name: parameter.default for name, parameter in signature.parameters.items()
+              if parameter.default is not inspect.Parameter.empty and name != "timer"}
+    params.update(spectogram_params or {})
+    return params
+
+
+def spectogram_settings(renderer: str = "matplotlib", spectogram_params: dict = None) -> dict:
+    """
+    Collect every setting that changes the spectogram images (used as part of the key in a SpectogramCache).
+
+    Arguments:
+        renderer (str): how the images are saved ("matplotlib" or "numpy").
+        spectogram_params (dict): keyword arguments for generate_spectogram (missing ones use the defaults).
+
+    Return value: dict of the settings.
+    """
+    import matplotlib
+    settings = _spectogram_params(spectogram_params)
+    settings["renderer"] = renderer
+    if renderer == "numpy": settings["image_size"] = list(image_size)
+    else: settings["matplotlib"] = matplotlib.__version__
+    return settings
+
+
+def read_manifest(manifest_path: str) -> dict:
+    """
+    Read the manifest written by generate_multiple_spectogram.
+
+    Arguments:
+        manifest_path (str): path to the manifest csv file.
+
+    Return value: dict of audio file name to its latest status (done, failed, skipped).
+    """
+    status = {}
+    manifest_path = os.path.join(root, manifest_path)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', newline='') as file:
+            # Later rows overwrite earlier ones, so the latest status of each file wins.
+            for row in csv.DictReader(file): status[row["file"]] = row["status"]
+    return status
+
+
+def generate_multiple_spectogram(audio_dir: str, output_dir: str, num_workers: int = 1, manifest_path: str = None,
+                                 renderer: str = "matplotlib", cache_dir: str = None, spectogram_params: dict = None,
+                                 exclude_manifest: str = None, timer: StageTimer = None, pipeline: bool = False,
+                                 decode_workers: int = 2, write_workers: int = 2, queue_size: int = 8,
+                                 report_interval: float = 5.0) -> None:
     """
     Generate spectograms for all audio files in a directory.
 
+    The status of each file (done, failed, skipped) is recorded in a manifest as soon as the file is finished,
+    so an interrupted run picks up where it stopped. Files that are done or skipped are not generated again (unless
+    their png was deleted), failed files are retried.
+
+    With a cache_dir, a SpectogramCache decides what to generate instead: only files whose audio or settings changed
+    since their spectogram was cached are generated, everything else is linked from the cache.
+
     Arguments:
         audio_dir (str): Directory that contains all audio files.
         output_dir (str): Directory to store the images of spectograms.
+        num_workers (int): Number of processes used to generate spectograms (1 generates them in this process).
+        manifest_path (str): Path to the manifest csv file (defaults to manifest.csv inside output_dir).
+        renderer (str): "matplotlib" to plot the spectograms with librosa, "numpy" to use render_spectogram (much faster).
+        cache_dir (str): Directory of a SpectogramCache (None to not use a cache).
+        spectogram_params (dict): Keyword arguments for generate_spectogram (ex: {"n_fft": 4096}).
+        exclude_manifest (str): If given, scan the spectograms for black/constant/near-silent images afterwards and
+                                write the songs to exclude to this csv file (ex: data/exclude.csv).
+        timer (StageTimer): If given, every stage of every file (in any worker) is timed and added to it
+                            (a StageTimer with profiling.generation_stages).
+        pipeline (bool): Decode, compute and write at the same time (see pipeline.py): audio is decoded in
+                         decode_workers threads, the spectograms and images are computed in num_workers processes and
+                         the images are written in write_workers threads, with at most queue_size files between stages.
+                         Progress is printed per stage every report_interval seconds instead of once per file.
+        decode_workers (int): Number of decode threads (pipeline only).
+        write_workers (int): Number of write threads (pipeline only).
+        queue_size (int): Most files waiting between two stages (pipeline only).
+                          decode_workers, write_workers and queue_size below 1 raise a ValueError.
+        report_interval (float): Seconds between progress lines (pipeline only).
     
     Return value: None
     """
+    if renderer not in ("matplotlib", "numpy"):
+        print(f"Renderer [{renderer}] is not one of ['matplotlib', 'numpy'].")
+        return
+    # Before any file is touched, since a stage without workers would never finish.
+    if pipeline: check_pipeline_sizes(decode_workers, max(1, num_workers), write_workers, queue_size)
+
     # Get a list of all audio files in the given directory.
     audio_path = os.path.join(root, audio_dir)
-    list_of_audio = os.listdir(audio_path)
+    list_of_audio = sorted(os.listdir(audio_path))
     
     # Create a place to store spectogram images.
-    ignore = []
     out_dir_spectogram = os.path.join(root, output_dir)
-    if not os.path.exists(out_dir_spectogram): os.makedirs(out_dir_spectogram, exist_ok=True)
-    else: ignore = [os.path.splitext(file)[0] for file in os.listdir(output_dir)]
-    # Go through the directory of audio files and create spectograms for each file.
-    print(ignore)
-    print("Number of current files:", len(ignore))
-    print("Files to go:", len(list_of_audio) - len(ignore))
-    skipped = []
-    for file in list_of_audio:
-        # If the file already exists, then ignore it and move on.
-        if os.path.splitext(file)[0] in ignore: continue
-        # Otherwise, make spectogram.
-        print(f"Generating spectogram for file: {file}")
-        current = os.path.join(audio_path, file)
-        result, sr = generate_spectogram(current)
-        # Save the image to the output directory.
-        if type(result) == np.ndarray:
-            new_image_name = os.path.join(out_dir_spectogram, f"{os.path.splitext(file)[0]}.png")
-            #plt.figure(figsize=(14, 5))
-            plt.axis('off')
-            librosa.display.specshow(result, sr=sr)
-            plt.savefig(new_image_name, bbox_inches='tight', pad_inches=0.0)
-            #cv2.imwrite(new_image_name, cv2.cvtColor(result, cv2.COLOR_GRAY2RGB))
-        # Keep track of files where a spectogram could not be generated.    
-        else: skipped.append(file)
+    os.makedirs(out_dir_spectogram, exist_ok=True)
+    existing = set(os.path.splitext(file)[0] for file in os.listdir(out_dir_spectogram) if file.endswith(".png"))
+    outputs = {file: os.path.join(out_dir_spectogram, f"{os.path.splitext(file)[0]}.png") for file in list_of_audio}
+
+    # Load the status of files from previous runs.
+    if manifest_path is None: manifest_path = os.path.join(out_dir_spectogram, "manifest.csv")
+    else: manifest_path = os.path.join(root, manifest_path)
+    status = read_manifest(manifest_path)
+
+    # Figure out which files still need a spectogram.
+    todo = []
+    newly_skipped = []
+    if cache_dir is not None:
+        cache = SpectogramCache(cache_dir)
+        settings = spectogram_settings(renderer, spectogram_params)
+        keys = {file: cache.key(os.path.join(audio_path, file), settings) for file in list_of_audio}
+        for file in list_of_audio:
+            if cache.is_current(outputs[file], keys[file]): continue
+            # Cached, but not at the output path yet (ex: the settings were changed back).
+            if cache.lookup(keys[file]): newly_skipped.append(file)
+            else: todo.append(file)
+    else:
+        for file in list_of_audio:
+            # Done in an earlier run, unless the png was deleted since.
+            if status.get(file) in ("done", "skipped") and os.path.exists(outputs[file]): continue
+            # Images from before the manifest existed are kept as they are.
+            if status.get(file) is None and os.path.splitext(file)[0] in existing: newly_skipped.append(file)
+            else: todo.append(file)
+    print("Number of current files:", len(list_of_audio) - len(todo))
+    print("Files to go:", len(todo))
+
+    new_manifest = not os.path.exists(manifest_path)
+    with open(manifest_path, 'a', newline='') as manifest:
+        writer = csv.writer(manifest)
+        if new_manifest: writer.writerow(["file", "status"])
+
+        def record(file: str, file_status: str) -> None:
+            # Move the new spectogram into the cache and link it to the output directory.
+            if cache_dir is not None and file_status == "done": cache.put(keys[file], images[file])
+            if cache_dir is not None and file_status in ("done", "skipped"):
+                cache.materialize(keys[file], outputs[file], os.path.join(audio_path, file))
+            # Write the status right away so an interrupted run keeps its progress.
+            status[file] = file_status
+            writer.writerow([file, file_status])
+            manifest.flush()
+
+        for file in newly_skipped: record(file, "skipped")
+
+        # With a cache, images are written into the cache first.
+        if cache_dir is not None: images = {file: cache.object_path(keys[file], ".tmp.png") for file in todo}
+        else: images = outputs
+        for file in todo: os.makedirs(os.path.dirname(images[file]), exist_ok=True)
+
+        # Go through the directory of audio files and create spectograms for each file.
+        jobs = [(os.path.join(audio_path, file), images[file], renderer, spectogram_params, timer is not None) for file in todo]
+        try:
+            if pipeline:
+                results = run_pipeline(jobs, _decode_job, _compute_job, _write_job, decode_workers=decode_workers,
+                                       compute_workers=max(1, num_workers), write_workers=write_workers,
+                                       queue_size=queue_size, stages=["decode", "stft", "write"], report_interval=report_interval)
+                for job, snapshot, error in results:
+                    file = os.path.basename(job[0])
+                    if error is not None: print(f"Error generating spectogram for file {file}: {type(error).__name__} {error}")
+                    if timer is not None: timer.merge(snapshot)
+                    record(file, "done" if error is None else "failed")
+            elif num_workers <= 1:
+                for job in jobs:
+                    print(f"Generating spectogram for file: {os.path.basename(job[0])}")
+                    file, file_status, snapshot = _spectogram_job(*job)
+                    if timer is not None: timer.merge(snapshot)
+                    record(file, file_status)
+            else:
+                with ProcessPoolExecutor(max_workers=num_workers) as executor:
+                    futures = [executor.submit(_spectogram_job, *job) for job in jobs]
+                    for count, future in enumerate(as_completed(futures), start=1):
+                        file, file_status, snapshot = future.result()
+                        if timer is not None: timer.merge(snapshot)
+                        print(f"[{count}/{len(jobs)}] Generated spectogram for file: {file} ({file_status})")
+                        record(file, file_status)
+        finally:
+            # Keep the cache index up to date even if the run is interrupted.
+            if cache_dir is not None: cache.save()
     
-    # Print messages about any skipped files.
-    if skipped == []: print(f"Every file in audio directory [{audio_dir}] generated a spectogram.")
-    else: print(f"Files {skipped} where skipped in audio directory [{audio_dir}]")
+    # Print messages about any failed files.
+    failed = [file for file in list_of_audio if status.get(file) == "failed"]
+    if failed == []: print(f"Every file in audio directory [{audio_dir}] generated a spectogram.")
+    else: print(f"Files {failed} failed in audio directory [{audio_dir}]")
+
+    # Find spectograms that came out wrong.
+    if exclude_manifest is not None: scan_spectograms(out_dir_spectogram, exclude_manifest)
 
 
 if __name__ == "__main__":
     audio_dir = "data/DEAM_audio/MEMD_audio"
     output_dir = "data/spectograms"
-    generate_multiple_spectogram(audio_dir, output_dir)
+    generate_multiple_spectogram(audio_dir, output_dir, num_workers=os.cpu_count())
@@ -0,0 +1,173 @@
+"""
+Baking the deterministic transforms of a dataset ahead of time.
+
+The deterministic steps at the start of a transform pipeline (ex: Resize(120, 120) then ToTensor) give the same
+output for a sample every epoch, so they are run once per dataset and the results are packed into a SpectogramStore.
+The store is named after a fingerprint of those steps and their parameters, so changing a parameter (ex: the resize
+target) makes a new store instead of reusing the old one. The size and modification time of the files the samples are
+read from are part of the fingerprint too, so spectograms that were made again (ex: with other STFT settings) are
+baked again instead of reusing the outputs of the old ones. Only the random transforms after them run every epoch.
+"""
+
+import os
+import json
+import torch
+import hashlib
+import numpy as np
+
+from src.dataset.paths import root
+from src.dataset.spectogram_store import SpectogramStore, pack_arrays
+
+# Transforms (by class name) that always give the same output for the same input.
+# Other transforms can be marked deterministic by giving their class the attribute deterministic = True.
+deterministic_transforms = {"Resize", "ToTensor", "Normalize", "ConvertImageDtype", "Grayscale", "CenterCrop", "PILToTensor"}
+
+
+def is_deterministic(transform) -> bool:
+    """
+    Returns whether a transform always gives the same output for the same input.
+    """
+    return getattr(transform, "deterministic", type(transform).__name__ in deterministic_transforms)
+
+
+def split_transforms(transform) -> (list, object):
+    """
+    Split transforms into the deterministic steps at the start and the rest.
+
+    Arguments:
+        transform: a transform or a torchvision Compose of transforms (or None).
+
+    Return value: (list, object) of the deterministic steps and a Compose of the remaining steps (None if there are none).
+    """
+    import torchvision.transforms as transforms
+    if transform is None: return [], None
+    steps = list(getattr(transform, "transforms", [transform]))
+    count = 0
+    while count < len(steps) and is_deterministic(steps[count]): count += 1
+    rest = steps[count:]
+    return steps[:count], transforms.Compose(rest) if rest else None
+
+
+def _describe(step) -> list:
+    """
+    Returns the class and parameters of a transform (everything that changes its output).
+    """
+    params = {name: value for name, value in vars(step).items() if not name.startswith("_") and name != "training"}
+    return [type(step).__module__ + "." + type(step).__qualname__, repr(sorted(params.items()))]
+
+
+def transform_fingerprint(steps: list, source: str = "") -> str:
+    """
+    Make a fingerprint of transforms and their parameters.
+
+    Arguments:
+        steps (list): transforms in the order they are applied.
+        source (str): anything else the baked outputs depend on (ex: the data directory and format).
+
+    Return value: str of the fingerprint.
+    """
+    description = json.dumps({"source": source, "steps": [_describe(step) for step in steps]}, sort_keys=True)
+    return hashlib.sha256(description.encode()).hexdigest()[:16]
+
+
+def files_signature(paths) -> str:
+    """
+    Make a signature of the contents of files from their sizes and modification times (files that don't exist count too).
+
+    Arguments:
+        paths: paths of the files.
+
+    Return value: str of the signature.
+    """
+    signature = hashlib.sha256()
+    for path in paths:
+        path = os.path.join(root, path)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            signature.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+        else: signature.update(f"{path}:missing\n".encode())
+    return signature.hexdigest()
+
+
+class BakedTransforms(object):
+    """
+    Outputs of the deterministic transforms of a dataset, memory-mapped from a SpectogramStore.
+
+    args:
+        store_path (str): path of the store (without the extension).
+        tensor (bool): whether the transforms returned tensors (the outputs are returned as tensors too).
+    """
+
+    def __init__(self, store_path: str, tensor: bool) -> None:
+        """
+        Constructor for BakedTransforms class.
+        """
+        self.store = SpectogramStore(store_path)
+        self.tensor = tensor
+
+
+    def __contains__(self, song_id: int) -> bool:
+        return song_id in self.store
+
+
+    def __getitem__(self, song_id: int):
+        """
+        Returns the baked output of a song (a view of the memory map, as a tensor if the transforms returned tensors).
+        """
+        output = self.store[song_id]
+        return torch.from_numpy(output) if self.tensor else output
+
+
+def bake_transforms(load, song_ids, transform, bake_dir: str, source: str = "", cached_steps: list = [],
+                    source_files: list = None) -> (BakedTransforms, object):
+    """
+    Run the deterministic steps of transform on every sample once and store the outputs, or reuse the outputs stored
+    by an earlier run if the steps, their parameters, source and source files are the same.
+
+    Arguments:
+        load: function that loads the sample at an index (before any transforms).
+        song_ids: song id of each index.
+        transform: a transform or a torchvision Compose of transforms.
+        bake_dir (str): directory of the baked outputs (one store per fingerprint).
+        source (str): anything else the outputs depend on (ex: the data directory and format).
+        cached_steps (list): transforms load already applies (they are part of the fingerprint).
+        source_files (list): files the samples are read from (their sizes and modification times are part of the
+                             fingerprint, so changed files are baked again).
+
+    Return value: (BakedTransforms, object) of the baked outputs (None if no steps could be baked) and the
+                  transforms that still have to run on them (None if there are none).
+    """
+    steps, rest = split_transforms(transform)
+    if not steps: return None, transform
+
+    # The songs are part of the fingerprint so datasets with different songs (ex: training and validation) don't share a store.
+    songs = hashlib.sha256(np.asarray(song_ids, dtype=np.int64).tobytes()).hexdigest()
+    files = files_signature(source_files or [])
+    fingerprint = transform_fingerprint(list(cached_steps) + steps, f"{source}:{songs}:{files}")
+    store_path = os.path.join(root, bake_dir, fingerprint)
+    meta_path = store_path + ".json"
+
+    # Reuse the stored outputs if they are complete.
+    if os.path.exists(meta_path):
+        with open(meta_path, 'r') as file: meta = json.load(file)
+        baked = BakedTransforms(store_path, meta["tensor"])
+        if all(int(song_id) in baked for song_id in song_ids): return baked, rest
+
+    # Run the steps on every sample and pack the outputs.
+    tensor = False
+    def outputs():
+        nonlocal tensor
+        for idx, song_id in enumerate(song_ids):
+            output = load(idx)
+            for step in steps: output = step(output)
+            tensor = torch.is_tensor(output)
+            yield int(song_id), output.numpy() if tensor else np.asarray(output)
+
+    if os.path.exists(meta_path): os.remove(meta_path)
+    print(f"Baking {len(song_ids)} samples into [{store_path}]")
+    count = pack_arrays(outputs(), store_path)
+
+    # The description is written last, so a store that was interrupted half way is baked again.
+    with open(meta_path, 'w') as file:
+        json.dump({"tensor": tensor, "count": count, "steps": [_describe(step) for step in list(cached_steps) + steps], "source": source}, file, indent=2)
+    return BakedTransforms(store_path, tensor), rest
@@ -0,0 +1,176 @@
+"""
+Custom PyTorch Dataset class that cuts each song's spectogram into fixed-length windows labeled with the
+dynamic (per second) valence and arousal annotations of DEAM.
+"""
+import os
+import sys
+import torch
+import pathlib
+import numpy as np
+import pandas as pd
+
+# Make it to where paths only need to be from the repo folder (the root is found once, in paths.py).
+if not __package__: sys.path.append(str(pathlib.Path(__file__).resolve().parents[2]))
+from src.dataset.paths import root
+
+from src.dataset.spectogram_store import SpectogramStore
+from src.dataset.music_dataset import moods
+from src.dataset.catalog import catalog_for
+from src.dataset.data_utils import label_moods
+
+# Dynamic annotations of DEAM (valence and arousal every 500ms from 15 seconds in, between -1 and 1).
+valence_path = "data/DEAM_Annotations/annotations averaged per song/dynamic (per second annotations)/valence.csv"
+arousal_path = "data/DEAM_Annotations/annotations averaged per song/dynamic (per second annotations)/arousal.csv"
+
+
+def read_dynamic_annotations(annotation_path: str) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Read a DEAM dynamic annotation file (headers [song_id, sample_15000ms, sample_15500ms, ...]).
+
+    Arguments:
+        annotation_path (str): path to the annotation file.
+
+    Return value: (np.ndarray, np.ndarray, np.ndarray) of song ids, the time (in seconds) of each column and
+                  the values (songs x times, NaN where a song has no annotation).
+    """
+    df = pd.read_csv(os.path.join(root, annotation_path), skipinitialspace=True)
+    df.columns = [column.strip() for column in df.columns]
+    columns = [column for column in df.columns if column.startswith("sample_")]
+    times = np.array([int(column[len("sample_"):-len("ms")]) / 1000 for column in columns])
+    return df.song_id.to_numpy(dtype=np.int64), times, df[columns].to_numpy(dtype=np.float32)
+
+
+class WindowedMusicDataset(torch.utils.data.Dataset):
+    """
+    Custom PyTorch Dataset class of spectogram windows and the valence/arousal at the end of each window.
+    Each song's spectogram is stored once (memory-mapped) and every window is a view of it, so there are many
+    more samples per song without using more disk or memory.
+
+    args:
+        csv_file_path (str): path to a csv file with the songs to use (ex: data/mood_training.csv).
+        data_dir (str): path of a SpectogramStore (data_format "packed") or a directory of <song_id>.npy spectograms
+                        (data_format "npy", ex: from generate_spectogram_streaming).
+        transforms: transforms to apply to the windows (if None, the windows are returned as tensors).
+        data_format (str): "packed" or "npy".
+        window_seconds (float): length of each window in seconds.
+        clip_seconds (float): length of the audio each spectogram covers (DEAM clips are 45 seconds).
+        frames_per_second (float): spectogram columns per second of audio (None to use width / clip_seconds).
+        target (str): "mood" for one-hot encoded mood types, "valence_arousal" for the values themselves.
+        valence_threshold (float): valence at or above this is high (the dynamic annotations are between -1 and 1).
+        arousal_threshold (float): arousal below this is low.
+        valence_file_path (str): path to the dynamic valence annotations.
+        arousal_file_path (str): path to the dynamic arousal annotations.
+    """
+
+    def __init__(self, csv_file_path: str, data_dir: str, transforms = None, data_format: str = "packed",
+                 window_seconds: float = 3.0, clip_seconds: float = 45.0, frames_per_second: float = None,
+                 target: str = "mood", valence_threshold: float = 0.0, arousal_threshold: float = 0.0,
+                 valence_file_path: str = valence_path, arousal_file_path: str = arousal_path) -> None:
+        """
+        Constructor for WindowedMusicDataset class.
+        """
+        self.data_dir = os.path.join(root, data_dir)
+        self.transforms = transforms
+        self.data_format = data_format
+        if data_format == "packed": self.store = SpectogramStore(self.data_dir)
+        elif data_format == "npy": self.store = None
+        else: raise ValueError(f"Data format [{data_format}] is not one of ['packed', 'npy'].")
+        if target not in ("mood", "valence_arousal"): raise ValueError(f"Target [{target}] is not one of ['mood', 'valence_arousal'].")
+
+        # Songs in the csv file that aren't excluded.
+        catalog = catalog_for(csv_file_path)
+        songs = set(catalog["song_id"][catalog.where()].tolist())
+
+        # Line up the valence and arousal annotations of the songs.
+        valence_ids, times, valence = read_dynamic_annotations(valence_file_path)
+        arousal_ids, arousal_times, arousal = read_dynamic_annotations(arousal_file_path)
+        if not np.array_equal(times, arousal_times): raise ValueError("The valence and arousal annotations are not at the same times.")
+        arousal_rows = {song_id: row for row, song_id in enumerate(arousal_ids)}
+
+        # Every annotation with a full window of audio before it becomes a window (only offsets are stored).
+        self.song_ids = []
+        window_song, window_start, window_values = [], [], []
+        self.window_frames = None
+        for row, song_id in enumerate(valence_ids):
+            if song_id not in songs or song_id not in arousal_rows: continue
+            width = self._width(song_id)
+            if width is None: continue
+            fps = frames_per_second if frames_per_second is not None else width / clip_seconds
+            frames = int(round(window_seconds * fps))
+            if self.window_frames is None: self.window_frames = frames
+            elif frames != self.window_frames: raise ValueError(f"Song {song_id} has windows of {frames} frames instead of {self.window_frames}, set frames_per_second.")
+
+            values = np.stack([valence[row], arousal[arousal_rows[song_id]]], axis=1)
+            ends = np.round(times * fps).astype(np.int64)
+            keep = (ends - frames >= 0) & (ends <= width) & ~np.isnan(values).any(axis=1)
+            window_song.append(np.full(keep.sum(), len(self.song_ids)))
+            window_start.append(ends[keep] - frames)
+            window_values.append(values[keep])
+            self.song_ids.append(song_id)
+
+        self.song_ids = np.array(self.song_ids, dtype=np.int64)
+        self.window_song = np.concatenate(window_song) if window_song else np.zeros(0, dtype=np.int64)
+        self.window_start = np.concatenate(window_start) if window_start else np.zeros(0, dtype=np.int64)
+        values = np.concatenate(window_values) if window_values else np.zeros((0, 2), dtype=np.float32)
+
+        # Targets of every window, ready to index.
+        if target == "mood":
+            labels = label_moods(values[:, 0], values[:, 1], valence_threshold, arousal_threshold)
+            self.targets = torch.from_numpy((labels[:, None] == np.array(moods)).astype(np.float32))
+        else:
+            self.targets = torch.from_numpy(values.astype(np.float32))
+
+
+    def _width(self, song_id: int):
+        """
+        Returns the number of columns (time frames) of a song's spectogram, or None if it doesn't have one.
+        """
+        if self.store is not None: return self.store.shape(song_id)[1] if song_id in self.store else None
+        path = os.path.join(self.data_dir, f"{song_id}.npy")
+        return np.load(path, mmap_mode='r').shape[1] if os.path.exists(path) else None
+
+
+    def _spectogram(self, song_id: int) -> np.ndarray:
+        """
+        Returns the whole memory-mapped spectogram of a song.
+        """
+        if self.store is not None: return self.store[song_id]
+        return np.load(os.path.join(self.data_dir, f"{song_id}.npy"), mmap_mode='c')
+
+
+    def __len__(self) -> int:
+        """
+        Returns the number of windows in the dataset.
+
+        Return value: int
+        """
+        return len(self.window_start)
+
+
+    def __getitem__(self, idx) -> (torch.Tensor, torch.Tensor):
+        """
+        Fetches a window of a spectogram and the target at the end of the window.
+
+        Args:
+            idx (int): index of the window to fetch
+
+        Return value: torch.Tensor of the window and torch.Tensor of the target.
+        """
+        # Slice the window out of the memory-mapped spectogram (a view, nothing is copied).
+        start = self.window_start[idx]
+        window = self._spectogram(self.song_ids[self.window_song[idx]])[:, start:start + self.window_frames]
+
+        if self.transforms is not None: window = self.transforms(window)
+        else: window = torch.from_numpy(window)
+        return window, self.targets[idx]
+
+
+if __name__ == "__main__":
+    csv_path = "data/mood_training.csv"
+    store_path = "data/spectograms_packed"
+
+    dataset = WindowedMusicDataset(csv_file_path=csv_path, data_dir=store_path)
+    print(len(dataset), "windows from", len(dataset.song_ids), "songs")
+    window, label = dataset[0]
+    print("Window shape:", window.shape)
+    print("Label:", label)
@@ -0,0 +1,261 @@
+"""
+Scoring directories of new audio files with a trained classifier, without generating spectograms first.
+
+The audio files are streamed through DataLoader workers: every worker decodes its share of the files, makes the
+same input a MusicDataset would give the model (the color spectogram image or the float16 features, then the
+transforms the model was trained with) and puts the samples together into batches. While the workers prepare the
+next batches, the model runs on the current one, so decoding and feature extraction overlap with the forward passes.
+The mood probabilities of each song are appended to a csv file after every batch, so a job that stops can be started
+again and only scores the songs that aren't in the csv file yet.
+"""
+
+import os
+import sys
+import csv
+import time
+import torch
+import pathlib
+import argparse
+import numpy as np
+
+# Make it to where paths only need to be from the repo folder (the root is found once, in paths.py).
+if not __package__: sys.path.append(str(pathlib.Path(__file__).resolve().parents[2]))
+from src.dataset.paths import root
+
+from src.dataset.music_dataset import moods
+
+# Extensions of the files scored in an audio directory.
+audio_extensions = (".mp3", ".wav", ".flac", ".ogg", ".m4a")
+
+
+class AudioStream(torch.utils.data.IterableDataset):
+    """
+    Stream of batches of model inputs made straight from audio files. Each DataLoader worker takes every
+    num_workers-th file, so the files are split between the workers and each file is only read once.
+
+    args:
+        audio_dir (str): directory of the audio files.
+        files (list): names of the files to stream (inside audio_dir).
+        batch_size (int): number of songs per batch (the last batch of each worker can be smaller).
+        transforms: transforms to apply to each input (the ones the model was trained with).
+        data_format (str): "png" for color spectogram images (like cv2.imread of the pngs), "features" for
+                           float16 spectograms (like extract_multiple_features) or "quantized" for quantized
+                           decibels (like quantize_multiple_spectogram, turned back into float32).
+        sr (int): sample rate to resample the audio to.
+        offset (float): where to start reading each file (in seconds).
+        duration (float): how much of each file to read (in seconds, None for all of it).
+        spectogram_params (dict): keyword arguments for generate_spectogram (png, and "size" and "bits" for quantized) or
+                                  extract_features (features).
+        renderer (str): how the png spectograms the model was trained on were made ("matplotlib" or "numpy", the
+                        renderer given to generate_multiple_spectogram).
+    """
+
+    def __init__(self, audio_dir: str, files: list, batch_size: int = 32, transforms = None, data_format: str = "png",
+                 sr: int = 44100, offset: float = 0.0, duration: float = None, spectogram_params: dict = None,
+                 renderer: str = "matplotlib") -> None:
+        """
+        Constructor for AudioStream class.
+        """
+        if data_format not in ("png", "features", "quantized"):
+            raise ValueError(f"Data format [{data_format}] is not one of ['png', 'features', 'quantized'].")
+        if renderer not in ("matplotlib", "numpy"):
+            raise ValueError(f"Renderer [{renderer}] is not one of ['matplotlib', 'numpy'].")
+        self.audio_dir = os.path.join(root, audio_dir)
+        self.files = list(files)
+        self.batch_size = batch_size
+        self.transforms = transforms
+        self.data_format = data_format
+        self.sr = sr
+        self.offset = offset
+        self.duration = duration
+        self.spectogram_params = spectogram_params or {}
+        self.renderer = renderer
+
+
+    def _input(self, file: str) -> torch.Tensor:
+        """
+        Decode an audio file and make its model input (what MusicDataset returns for the song).
+        """
+        import librosa
+        x, sr = librosa.load(os.path.join(self.audio_dir, file), sr=self.sr, offset=self.offset, duration=self.duration)
+        if len(x) == 0: raise ValueError("no audio")
+        if self.data_format == "features":
+            from src.dataset.features import extract_features
+            img = extract_features([x], sr, **self.spectogram_params)[0]
+        else:
+            from src.dataset.spectograms import _stft_db, spectogram_image
+            params = {"n_fft": 2048, "hop_length": 512, "ref": 1.0, "top_db": 80.0, "size": None, "bits": 8}
+            params.update(self.spectogram_params)
+            Xdb = _stft_db(x, params["n_fft"], params["hop_length"], params["ref"], params["top_db"])
+            if self.data_format == "png": img = spectogram_image(Xdb, sr, self.renderer)
+            else:
+                # The same steps as quantize_multiple_spectogram then load_quantized.
+                import cv2
+                from src.dataset.quantized import quantize_spectogram, dequantize_spectogram
+                if params["size"] is not None:
+                    Xdb = cv2.resize(Xdb.astype(np.float32), (params["size"][1], params["size"][0]), interpolation=cv2.INTER_AREA)
+                img = dequantize_spectogram(*quantize_spectogram(Xdb, params["bits"]))
+
+        # Same as MusicDataset.__getitem__: without transforms, features get a channel dimension in front.
+        if self.transforms is not None: return self.transforms(img)
+        img = torch.from_numpy(img)
+        return img.unsqueeze(0) if self.data_format in ("features", "quantized") else img
+
+
+    def __iter__(self):
+        """
+        Yields dicts of the song ids of a batch, the batch of inputs (None if every song failed) and the songs that failed.
+        """
+        info = torch.utils.data.get_worker_info()
+        files = self.files if info is None else self.files[info.id::info.num_workers]
+        song_ids, inputs, failed = [], [], []
+        for i, file in enumerate(files):
+            song_id = os.path.splitext(file)[0]
+            try:
+                inputs.append(self._input(file))
+                song_ids.append(song_id)
+            except Exception as e:
+                print(f"Error loading audio file {file}: {e}")
+                failed.append(song_id)
+
+            # A batch is full (or these are the last songs of this worker).
+            if len(inputs) == self.batch_size or (i == len(files) - 1 and (inputs or failed)):
+                yield {"song_ids": song_ids, "inputs": torch.stack(inputs) if inputs else None, "failed": failed}
+                song_ids, inputs, failed = [], [], []
+
+
+def _scored_song_ids(output_csv: str) -> set:
+    """
+    Get the song ids already in an output csv file. A last line that was cut off half way (the job stopped while
+    writing it) is removed, so that song is scored again.
+    """
+    if not os.path.exists(output_csv): return set()
+    with open(output_csv, 'rb+') as file:
+        data = file.read()
+        if data and not data.endswith(b"\n"):
+            file.truncate(data.rfind(b"\n") + 1)
+            data = data[:data.rfind(b"\n") + 1]
+    rows = list(csv.reader(data.decode().splitlines()))
+    return set(row[0] for row in rows[1:] if row)
+
+
+def score_directory(model: torch.nn.Module, audio_dir: str, output_csv: str, transforms = None, data_format: str = "png",
+                    batch_size: int = 32, num_workers: int = 2, prefetch_factor: int = 2, device: str = "cpu",
+                    sr: int = 44100, offset: float = 0.0, duration: float = None, spectogram_params: dict = None,
+                    report_every: float = 10.0, renderer: str = "matplotlib") -> dict:
+    """
+    Score every audio file in a directory with a classifier and append the mood probabilities of each song to a csv
+    file with headers [song_id, calm, happy, sad, tense]. Songs already in the csv file are skipped, so an interrupted
+    job picks up where it stopped.
+
+    Arguments:
+        model (torch.nn.Module): classifier that takes a batch of MusicDataset inputs and returns one logit per mood
+                                 (in the order of moods).
+        audio_dir (str): directory of the audio files.
+        output_csv (str): path of the csv file of results.
+        transforms: transforms the model was trained with (applied to each input, like in MusicDataset).
+        data_format (str): "png", "features" or "quantized", the data_format of the MusicDataset the model was trained on.
+        batch_size (int): number of songs per forward pass.
+        num_workers (int): number of processes decoding audio and making inputs (0 to do it between forward passes).
+        prefetch_factor (int): number of batches each worker prepares ahead.
+        device (str): device to run the model on.
+        sr, offset, duration, spectogram_params: how the inputs are made (see AudioStream).
+        report_every (float): seconds between progress messages.
+        renderer (str): renderer the training pngs were made with (see AudioStream).
+
+    Return value: dict of the number of songs scored, skipped (already scored) and failed, the seconds it took and
+                  the songs per second.
+    """
+    # Only score the songs that aren't in the output yet.
+    output_csv = os.path.join(root, output_csv)
+    scored = _scored_song_ids(output_csv)
+    audio_path = os.path.join(root, audio_dir)
+    files = sorted(file for file in os.listdir(audio_path) if file.lower().endswith(audio_extensions))
+    todo = [file for file in files if os.path.splitext(file)[0] not in scored]
+    print("Number of current files:", len(files) - len(todo))
+    print("Files to go:", len(todo))
+
+    stream = AudioStream(audio_dir, todo, batch_size, transforms, data_format, sr, offset, duration, spectogram_params, renderer)
+    loader = torch.utils.data.DataLoader(stream, batch_size=None, num_workers=num_workers,
+                                         prefetch_factor=prefetch_factor if num_workers > 0 else None,
+                                         pin_memory=torch.device(device).type == "cuda")
+
+    model = model.to(device).eval()
+    os.makedirs(os.path.dirname(output_csv) or ".", exist_ok=True)
+    new_file = not os.path.exists(output_csv) or os.path.getsize(output_csv) == 0
+    done, failed = 0, []
+    start = last_report = time.perf_counter()
+    with open(output_csv, 'a', newline='') as file, torch.inference_mode():
+        writer = csv.writer(file)
+        if new_file: writer.writerow(["song_id"] + moods)
+        for batch in loader:
+            failed += batch["failed"]
+            if batch["inputs"] is None: continue
+            logits = model(batch["inputs"].to(device, non_blocking=True))
+            if logits.dim() != 2 or logits.shape[1] != len(moods):
+                raise ValueError(f"Model returned shape {tuple(logits.shape)}, expected (batch, {len(moods)}) for moods {moods}.")
+            probabilities = torch.softmax(logits.float(), dim=1).cpu().numpy()
+
+            # Write the batch right away, so it isn't scored again if the job stops.
+            writer.writerows([song_id] + [f"{p:.6f}" for p in row] for song_id, row in zip(batch["song_ids"], probabilities))
+            file.flush()
+            done += len(batch["song_ids"])
+
+            now = time.perf_counter()
+            if now - last_report >= report_every:
+                print(f"[{done + len(failed)}/{len(todo)}] {done / (now - start):.1f} songs/s")
+                last_report = now
+
+    seconds = time.perf_counter() - start
+    summary = {"scored": done, "skipped": len(files) - len(todo), "failed": len(failed), "seconds": seconds,
+               "songs_per_second": done / seconds if seconds > 0 else 0.0}
+    print(f"Scored {done} songs in {seconds:.1f}s ({summary['songs_per_second']:.1f} songs/s) into [{output_csv}]")
+    if failed: print(f"Files {sorted(failed)} failed in audio directory [{audio_dir}]")
+    return summary
+
+
+def load_model(model_path: str) -> torch.nn.Module:
+    """
+    Load a classifier saved with torch.jit.save (TorchScript) or torch.save (the whole model).
+
+    Arguments:
+        model_path (str): path to the saved model.
+
+    Return value: torch.nn.Module of the model (on the cpu).
+    """
+    model_path = os.path.join(root, model_path)
+    try:
+        return torch.jit.load(model_path, map_location="cpu")
+    except RuntimeError:
+        return torch.load(model_path, map_location="cpu", weights_only=False)
+
+
+def main(argv: list = None) -> None:
+    """
+    Score a directory of audio files from the command line (or argv).
+    """
+    parser = argparse.ArgumentParser(prog="python -m src.model.inference", description="Score audio files with a trained mood classifier.")
+    parser.add_argument("model", help="model saved with torch.jit.save or torch.save")
+    parser.add_argument("--audio-dir", default="data/DEAM_audio/MEMD_audio")
+    parser.add_argument("--output", default="data/predictions.csv")
+    parser.add_argument("--data-format", choices=["png", "features", "quantized"], default="png")
+    parser.add_argument("--renderer", choices=["matplotlib", "numpy"], default="matplotlib",
+                        help="renderer the training spectograms were made with (png only)")
+    parser.add_argument("--resize", type=int, nargs=2, default=[120, 120], metavar=("HEIGHT", "WIDTH"))
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) - 1))
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--duration", type=float, default=None, help="seconds of each file to score (all of it by default)")
+    parser.add_argument("--offset", type=float, default=0.0, help="where to start reading each file (in seconds)")
+    args = parser.parse_args(argv)
+
+    import torchvision.transforms as transforms
+    from src.dataset.music_dataset import Resize
+    score_directory(load_model(args.model), args.audio_dir, args.output,
+                    transforms=transforms.Compose([Resize(*args.resize), transforms.ToTensor()]),
+                    data_format=args.data_format, batch_size=args.batch_size, num_workers=args.workers,
+                    device=args.device, offset=args.offset, duration=args.duration, renderer=args.renderer)
+
+
+if __name__ == "__main__":
+    main()